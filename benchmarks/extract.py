@@ -0,0 +1,78 @@
+"""
+Compares HTML text extractors by throughput and output size.
+
+Usage example:
+$ python -m benchmarks.extract ./pages
+$ python -m benchmarks.extract page1.html page2.html
+
+Without arguments, runs over a synthetic corpus.
+"""
+
+import pathlib
+import sys
+import time
+
+from bot import extractors
+from bot.budget import count_tokens
+
+N_ROUNDS = 5
+
+
+def main(paths: list[str]) -> None:
+    corpus = load_corpus(paths) if paths else generate_corpus()
+    n_bytes = sum(len(page.encode()) for page in corpus)
+    print(f"corpus: {len(corpus)} pages, {n_bytes / 1e6:.1f} MB")
+    print(f"{'extractor':<10} {'MB/s':>8} {'ms/page':>8} {'tokens':>10}")
+    for name in extractors.names():
+        extractor = extractors.get(name)
+        if extractor.name != name:
+            # the extractor is not available
+            print(f"{name:<10} {'n/a':>8}")
+            continue
+        elapsed, n_tokens = measure(extractor, corpus)
+        mb_per_sec = n_bytes / 1e6 / elapsed
+        ms_per_page = elapsed * 1000 / len(corpus)
+        print(f"{name:<10} {mb_per_sec:>8.1f} {ms_per_page:>8.2f} {n_tokens:>10}")
+
+
+def measure(extractor: extractors.Extractor, corpus: list[str]) -> tuple[float, int]:
+    """Returns the best time to process the corpus and the total number of output tokens."""
+    best = float("inf")
+    n_tokens = 0
+    for _ in range(N_ROUNDS):
+        start = time.perf_counter()
+        texts = [extractor.extract(page) for page in corpus]
+        best = min(best, time.perf_counter() - start)
+        n_tokens = sum(count_tokens(text) for text in texts)
+    return best, n_tokens
+
+
+def load_corpus(paths: list[str]) -> list[str]:
+    """Reads saved HTML pages from files or directories."""
+    corpus = []
+    for path in map(pathlib.Path, paths):
+        files = sorted(path.glob("**/*.htm*")) if path.is_dir() else [path]
+        for file in files:
+            corpus.append(file.read_text(encoding="utf-8", errors="replace"))
+    return corpus
+
+
+def generate_corpus(n_pages: int = 20) -> list[str]:
+    """Generates article-like pages with typical boilerplate."""
+    nav = "<nav>" + "".join(f'<a href="/p{i}">Link {i}</a>\n' for i in range(50)) + "</nav>"
+    script = "<script>" + "var x = {a: 1, b: [1, 2, 3]};\n" * 200 + "</script>"
+    style = "<style>" + ".cls { color: red; margin: 0 auto; }\n" * 200 + "</style>"
+    para = "<p>  Lorem ipsum <b>dolor</b> sit amet,\n    consectetur <a href='#'>adipiscing</a> elit. </p>\n"
+    pages = []
+    for i in range(n_pages):
+        body = f"<h1>Article {i}</h1>\n" + para * (100 + i * 10) + "<pre>code\n    indented</pre>"
+        pages.append(
+            f"<html><head><title>Page {i}</title>{style}{script}</head>"
+            f"<body>{nav}<main><article>{body}</article><aside>{nav}</aside></main>"
+            f"<footer>{nav}</footer>{script}</body></html>"
+        )
+    return pages
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+"""
+Compares the single-pass Markdown renderer with the legacy regex pipeline,
+and with a variant that collects the output in a list and joins it once.
+
+Usage example:
+$ python -m benchmarks.markdown
+"""
+
+import re
+import timeit
+
+from bot import markdown
+
+N_ROUNDS = 5
+
+# The legacy pipeline: three replacements and four regex substitutions
+# over the whole text.
+pre_re = re.compile(r"^[ ]*```\w*$(.+?)^```$", re.MULTILINE | re.DOTALL)
+code_re = re.compile(r"`([^`\n]+)`")
+bold_re = re.compile(r"\*\*([^*]+?)\*\*")
+bullet_re = re.compile(r"^\*\s\s+(.+)$", re.MULTILINE)
+
+
+def legacy_to_html(text: str) -> str:
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    text = pre_re.sub(r"<pre>\1</pre>", text)
+    text = code_re.sub(r"<code>\1</code>", text)
+    text = bold_re.sub(r"<b>\1</b>", text)
+    text = bullet_re.sub(r"— \1", text)
+    return text
+
+
+def list_to_html(text: str) -> str:
+    """Escapes the text between the tokens, and joins the pieces once."""
+    return _render_list(markdown.token_re, "\n" + text)[1:]
+
+
+def _render_list(pattern: re.Pattern, text: str) -> str:
+    parts = []
+    pos = 0
+    for match in pattern.finditer(text):
+        parts.append(_escape(text[pos : match.start()]))
+        parts.append(_render_token(match))
+        pos = match.end()
+    parts.append(_escape(text[pos:]))
+    return "".join(parts)
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _render_token(match: re.Match) -> str:
+    """Like markdown._render_token, but escapes the contents of the token."""
+    kind = match.lastgroup
+    inline = lambda text: _render_list(markdown.inline_re, text)
+    if kind == "code":
+        return f"<code>{_escape(match.group('code'))}</code>"
+    elif kind == "bold":
+        return f"<b>{inline(match.group('bold'))}</b>"
+    elif kind == "bullet":
+        level = len(match.group("bullet")) // len(markdown.INDENT)
+        return "\n" + markdown.INDENT * level + markdown.BULLET
+    elif kind == "italic" or kind == "underscore":
+        return f"<i>{inline(match.group(kind))}</i>"
+    elif kind == "url":
+        url = _escape(match.group("url")).replace('"', "&quot;")
+        return f'<a href="{url}">{inline(match.group("text"))}</a>'
+    elif kind == "heading":
+        return f"\n<b>{inline(match.group('heading'))}</b>"
+    else:
+        pre = _escape(match.group("pre"))
+        return f"\n<pre>{pre}\n</pre>" if kind == "close" else f"\n<pre>{pre}</pre>"
+
+
+# A typical answer: mostly prose with some formatting.
+PROSE_ANSWER = (
+    "Apache Kafka is a distributed event store and stream-processing platform. "
+    "It is an open-source system developed by the Apache Software Foundation "
+    "written in Java and Scala. The project aims to provide a unified, high-throughput, "
+    "low-latency platform for handling real-time data feeds.\n\n" * 3
+    + "Use `kafka-topics.sh` to **create** a topic:\n\n"
+    "```bash\nkafka-topics.sh --create --topic events --partitions 3\n```\n\n"
+)
+
+# A heavily formatted answer: almost every line has some markup.
+MARKUP_ANSWER = """## Using `sqlean-regexp`
+
+You can **easily** use regular expressions with the `sqlean-regexp` extension.
+Unlike other DBMS, adding extensions to SQLite is a breeze & takes *no time* at all.
+
+*   Download the extension.
+*   Load it with `.load ./regexp`.
+*   Query the data:
+
+```sql
+select count(*) from messages
+where msg_text regexp '\\d+' and 10 > 5;
+```
+
+See [Documentation](https://github.com/nalgeon/sqlean) for reference.
+
+"""
+
+
+def main() -> None:
+    for name, answer in (("prose", PROSE_ANSWER), ("markup", MARKUP_ANSWER)):
+        print(f"{name} answers:")
+        print(
+            f"{'size':>8} {'legacy, us':>12} {'single-pass, us':>16} {'speedup':>8}"
+            f" {'list-join, us':>14}"
+        )
+        for n_repeats in (1, 10, 100):
+            text = answer * n_repeats
+            n_calls = max(1000 // n_repeats, 10)
+            legacy = _measure(legacy_to_html, text, n_calls)
+            current = _measure(markdown.to_html, text, n_calls)
+            joined = _measure(list_to_html, text, n_calls)
+            print(
+                f"{len(text):>8} {legacy:>12.1f} {current:>16.1f} {legacy / current:>7.2f}x"
+                f" {joined:>14.1f}"
+            )
+        print()
+
+
+def _measure(func, text: str, n_calls: int) -> float:
+    """Returns the best time of a single call in microseconds."""
+    timer = timeit.Timer(lambda: func(text))
+    return min(timer.repeat(repeat=N_ROUNDS, number=n_calls)) / n_calls * 1e6
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Reports the import time of the bot entry points, based on `python -X importtime`,
+along with the slowest imported modules and the heavy dependencies loaded.
+
+Usage example:
+$ python -m benchmarks.startup
+$ python -m benchmarks.startup bot.cli --top 20
+
+Each module is imported in a fresh interpreter, so the numbers match a cold start
+(except for the OS file cache).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+N_ROUNDS = 5
+
+# Modules to measure by default.
+ENTRY_POINTS = ("bot.cli", "bot.bot")
+
+# Dependencies worth knowing about when they are loaded.
+HEAVY_PACKAGES = ("telegram", "openai", "httpx", "yaml", "bs4", "lxml")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--top", type=int, default=10, help="the number of slowest modules")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        best = None
+        for _ in range(N_ROUNDS):
+            timings = measure(module)
+            if best is None or timings[module][1] < best[module][1]:
+                best = timings
+        total_ms = best[module][1] / 1e3
+        loaded = [name for name in HEAVY_PACKAGES if name in best]
+        print(f"{module}: {total_ms:.1f} ms, loads {', '.join(loaded) or 'no heavy packages'}")
+        print(f"{'self, ms':>10} {'total, ms':>10}  module")
+        top = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in top[1 : args.top + 1]:
+            print(f"{self_us / 1e3:>10.1f} {cumulative_us / 1e3:>10.1f}  {name}")
+        print()
+
+
+def measure(module: str) -> dict[str, tuple[int, int]]:
+    """
+    Imports the module in a fresh interpreter and returns the import times
+    of all the modules loaded, as {name: (self us, cumulative us)}.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return parse(result.stderr)
+
+
+def parse(output: str) -> dict[str, tuple[int, int]]:
+    """Parses the `-X importtime` output."""
+    timings = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        self_us, cumulative_us, name = (field.strip() for field in fields)
+        timings[name] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+if __name__ == "__main__":
+    main()
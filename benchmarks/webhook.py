@@ -0,0 +1,110 @@
+"""
+Replays recorded updates against a webhook server
+and reports the acknowledgement latency.
+
+Usage example:
+$ python -m benchmarks.webhook updates.jsonl --url http://127.0.0.1:8443/telegram --secret xyz
+$ python -m benchmarks.webhook --count 10000 --concurrency 40
+
+The file contains one update per line, as Telegram sends them.
+Without a file, sends synthetic text messages.
+Without --url, starts a local server that only counts the updates,
+which measures the server itself.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+
+import httpx
+
+from bot import webhook
+
+SECRET = "benchmark"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", nargs="?", help="a file with recorded updates (JSON lines)")
+    parser.add_argument("--url", help="the webhook URL (default: a local server)")
+    parser.add_argument("--secret", default=SECRET, help="the secret token")
+    parser.add_argument("--count", type=int, default=1000, help="the number of synthetic updates")
+    parser.add_argument("--concurrency", type=int, default=10, help="simultaneous connections")
+    args = parser.parse_args()
+
+    updates = load_updates(args.path) if args.path else generate_updates(args.count)
+    asyncio.run(replay(updates, args.url, args.secret, args.concurrency))
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def generate_updates(count: int) -> list[dict]:
+    return [
+        {
+            "update_id": idx,
+            "message": {
+                "message_id": idx,
+                "date": int(time.time()),
+                "chat": {"id": idx % 100 + 1, "type": "private"},
+                "from": {"id": idx % 100 + 1, "is_bot": False, "first_name": "Alice"},
+                "text": f"Question #{idx}",
+            },
+        }
+        for idx in range(1, count + 1)
+    ]
+
+
+async def replay(updates: list[dict], url: str, secret: str, concurrency: int) -> None:
+    server = None
+    if not url:
+        server = webhook.Server(path="/telegram", secret_token=secret, handle=lambda data: None)
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.port}/telegram"
+
+    queue = iter(updates)
+    latencies = []
+    statuses = []
+
+    async def send(client: httpx.AsyncClient) -> None:
+        # each client keeps its connection alive, like Telegram does
+        for update in queue:
+            start = time.perf_counter()
+            response = await client.post(url, json=update, headers={webhook.SECRET_HEADER: secret})
+            latencies.append((time.perf_counter() - start) * 1e3)
+            statuses.append(response.status_code)
+
+    clients = [httpx.AsyncClient() for _ in range(concurrency)]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(send(client) for client in clients))
+    finally:
+        for client in clients:
+            await client.aclose()
+        if server:
+            await server.stop()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    n_ok = statuses.count(200)
+    print(f"updates: {len(updates)}, accepted: {n_ok}, rejected: {len(statuses) - n_ok}")
+    print(f"throughput: {len(updates) / elapsed:.0f} updates/s")
+    print(
+        f"latency, ms: p50={statistics.median(latencies):.2f}, "
+        f"p95={_percentile(latencies, 0.95):.2f}, p99={_percentile(latencies, 0.99):.2f}"
+    )
+    by_status = itertools.groupby(sorted(statuses))
+    print("statuses: " + ", ".join(f"{status}={len(list(group))}" for status, group in by_status))
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Shows chat actions (e.g. "typing...") while the bot is working on answers.
+A single background task serves all the chats, sending one action
+per chat (or topic) per interval, however many answers are in progress there.
+The task does not belong to any answer, so each action is sent in a fresh context
+with only the config of its bot: no request id, no deadline of an unrelated answer.
+"""
+
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+import contextvars
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from telegram import Bot
+from telegram.constants import ChatAction
+
+from bot.config import Config, current, use
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows an action for 5 seconds or until the next message.
+INTERVAL = 4
+
+# Actions in the order of precedence, when different kinds of work
+# are in progress in the same chat.
+PRECEDENCE = (ChatAction.UPLOAD_PHOTO, ChatAction.TYPING)
+
+# A chat or a topic within a chat, for a bot (several bots may share the scheduler).
+Key = tuple[str, int, Optional[int]]
+
+
+class ActionScheduler:
+    """Reference-counts the work in progress per chat and shows the matching action."""
+
+    def __init__(self, interval: float = INTERVAL) -> None:
+        self.interval = interval
+        # the number of answers in progress per chat and per action
+        self._active: dict[Key, Counter] = {}
+        self._bots: dict[Key, Bot] = {}
+        self._configs: dict[Key, Config] = {}
+        self._sent_at: dict[Key, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    @asynccontextmanager
+    async def show(
+        self,
+        bot: Bot,
+        chat_id: int,
+        message_thread_id: Optional[int] = None,
+        action: str = ChatAction.TYPING,
+    ) -> AsyncIterator[None]:
+        """Shows the action in the chat for the duration of the block."""
+        key = (bot.username, chat_id, message_thread_id)
+        self._start(key, bot, action)
+        try:
+            yield
+        finally:
+            self._stop(key, action)
+
+    def _start(self, key: Key, bot: Bot, action: str) -> None:
+        """Registers the work in progress and makes sure the sender is running."""
+        counts = self._active.setdefault(key, Counter())
+        counts[action] += 1
+        self._bots[key] = bot
+        self._configs[key] = current()
+        if not self._task or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+        elif counts[action] == 1:
+            # a new kind of work, show it right away
+            self._sent_at.pop(key, None)
+            self._wakeup.set()
+
+    def _stop(self, key: Key, action: str) -> None:
+        """Unregisters the work in progress."""
+        counts = self._active.get(key)
+        if counts is None:
+            return
+        counts[action] -= 1
+        if counts[action] <= 0:
+            del counts[action]
+        if not counts:
+            del self._active[key]
+            del self._bots[key]
+            del self._configs[key]
+            self._sent_at.pop(key, None)
+
+    async def _run(self) -> None:
+        """Sends the actions while there is work in progress."""
+        while self._active:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [
+                key
+                for key in self._active
+                if now - self._sent_at.get(key, -self.interval) >= self.interval
+            ]
+            if due:
+                for key in due:
+                    self._sent_at[key] = now
+                await asyncio.gather(*(self._start_send(key) for key in due))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    def _next_delay(self) -> float:
+        """Returns the time until the next action is due."""
+        if not self._sent_at:
+            return self.interval
+        now = time.monotonic()
+        return max(min(sent_at + self.interval - now for sent_at in self._sent_at.values()), 0)
+
+    def _start_send(self, key: Key) -> asyncio.Task:
+        """Sends the action in the context of the chat's bot."""
+        context = contextvars.Context()
+        context.run(use, self._configs[key])
+        return asyncio.create_task(self._send(key), context=context)
+
+    async def _send(self, key: Key) -> None:
+        """Sends the action for the most important kind of work in the chat."""
+        counts = self._active.get(key)
+        if not counts:
+            return
+        action = next((action for action in PRECEDENCE if counts[action] > 0), next(iter(counts)))
+        _, chat_id, message_thread_id = key
+        try:
+            await self._bots[key].send_chat_action(
+                chat_id=chat_id, action=action, message_thread_id=message_thread_id
+            )
+        except Exception as exc:
+            logger.warning("failed to send action to chat=%s: %s", chat_id, exc)
+
+
+# Shows actions for the answers in progress.
+scheduler = ActionScheduler()
@@ -0,0 +1,145 @@
+"""
+Limits the number of questions answered at the same time.
+Questions above the limit wait in a bounded queue, where chats take turns
+according to their weights (weighted fair queuing), so that a flood from one chat
+does not starve the others. When the queue is full, new questions are refused.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import heapq
+import itertools
+import math
+import time
+from typing import AsyncIterator
+
+from bot import metrics
+from bot.config import PerBot, config
+
+
+class Busy(Exception):
+    """Raised when the queue is full."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"busy, try again in {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Admission control with a global concurrency limit and a bounded queue.
+    Each queued question gets a virtual finish time: the later of the current
+    virtual time and the chat's previous finish time, plus 1/weight.
+    Questions are admitted in the order of their finish times.
+    """
+
+    def __init__(self) -> None:
+        self.n_running = 0
+        self.n_rejected = 0
+        self.virtual_time = 0.0
+        # (finish time, sequence number, chat id, future)
+        self._queue: list[tuple[float, int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        # the latest finish time of each chat with queued questions
+        self._finish_times: dict[int, float] = {}
+
+    @property
+    def n_queued(self) -> int:
+        return len(self._queue)
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int, weight: float = 1) -> AsyncIterator[None]:
+        """
+        Holds a slot for the duration of the block.
+        Waits for a free slot if necessary, or raises Busy if the queue is full.
+        """
+        start = time.perf_counter()
+        await self._acquire(chat_id, weight)
+        metrics.observe("admission.wait_ms", (time.perf_counter() - start) * 1e3)
+        self._update_gauges()
+        run_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.observe("admission.run_ms", (time.perf_counter() - run_start) * 1e3)
+            self._release()
+
+    def retry_after(self) -> int:
+        """Estimates how long it takes to process the queued questions, in seconds."""
+        limit = config.admission.limit or 1
+        run_ms = metrics.summary("admission.run_ms").mean
+        seconds = (self.n_queued + 1) / limit * run_ms / 1e3
+        return max(math.ceil(seconds), 1)
+
+    async def _acquire(self, chat_id: int, weight: float) -> None:
+        """Takes a free slot or waits in the queue."""
+        limit = config.admission.limit
+        if not limit or (self.n_running < limit and not self._queue):
+            self.n_running += 1
+            return
+
+        if self.n_queued >= config.admission.queue_size:
+            self.n_rejected += 1
+            metrics.gauge("admission.rejected", self.n_rejected)
+            raise Busy(self.retry_after())
+
+        start_time = max(self.virtual_time, self._finish_times.get(chat_id, 0.0))
+        finish_time = start_time + 1 / max(weight, 1e-3)
+        self._finish_times[chat_id] = finish_time
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (finish_time, next(self._counter), chat_id, future))
+        self._update_gauges()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # got the slot right before the cancellation, so pass it on
+                self._release()
+            else:
+                self._remove(future)
+            raise
+
+    def _release(self) -> None:
+        """Frees a slot and hands it over to the next queued question, if any."""
+        self.n_running -= 1
+        limit = config.admission.limit
+        while self._queue and (not limit or self.n_running < limit):
+            finish_time, _, chat_id, future = heapq.heappop(self._queue)
+            self.virtual_time = max(self.virtual_time, finish_time)
+            if self._finish_times.get(chat_id) == finish_time:
+                # the chat has no more queued questions
+                del self._finish_times[chat_id]
+            if future.done():
+                continue
+            self.n_running += 1
+            future.set_result(None)
+        self._update_gauges()
+
+    def _remove(self, future: asyncio.Future) -> None:
+        """Removes a cancelled question from the queue."""
+        chat_id = next((item[2] for item in self._queue if item[3] is future), None)
+        if chat_id is None:
+            # already taken off the queue
+            return
+        self._queue = [item for item in self._queue if item[3] is not future]
+        heapq.heapify(self._queue)
+        finish_times = [item[0] for item in self._queue if item[2] == chat_id]
+        if finish_times:
+            self._finish_times[chat_id] = max(finish_times)
+        else:
+            self._finish_times.pop(chat_id, None)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.gauge("admission.running", self.n_running)
+        metrics.gauge("admission.queued", self.n_queued)
+
+
+def weight_of(chat_id: int, chat_type: str) -> float:
+    """Returns the chat's weight: set for the specific chat, for its type, or 1."""
+    weights = config.admission.weights
+    return weights.get(chat_id) or weights.get(str(chat_id)) or weights.get(chat_type) or 1
+
+
+# Admission control for answering questions, separate for each bot.
+questions: PerBot[Admission] = PerBot(Admission)
@@ -1,3 +1,25 @@
-from . import chat
-from . import images
-from . import assistant
+"""
+AI backends. Each one is imported on first use, so that the bot
+does not load the dependencies of the backends it does not use
+(e.g. the `openai` package for the Assistant API).
+"""
+
+import importlib
+import sys
+from types import ModuleType
+
+BACKENDS = ("chat", "images", "assistant")
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name not in BACKENDS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return importlib.import_module(f"{__name__}.{name}")
+
+
+async def close() -> None:
+    """Frees network connections of the loaded backends."""
+    for name in BACKENDS:
+        module = sys.modules.get(f"{__name__}.{name}")
+        if module:
+            await module.close()
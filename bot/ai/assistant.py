@@ -7,13 +7,33 @@ from typing import Dict, Optional
 import openai
 from openai import AsyncOpenAI
 
+from bot import deadline
 from bot.config import config
 
 logger = logging.getLogger(__name__)
 
-# Storage for thread IDs by user_id
+# Storage for thread IDs by assistant and user
 thread_storage: Dict[str, str] = {}
 
+# API clients by key and URL, shared by all the questions (and bots) that use them.
+_clients: Dict[tuple[str, Optional[str]], AsyncOpenAI] = {}
+
+
+def get_client(api_key: str, base_url: Optional[str]) -> AsyncOpenAI:
+    """Returns the client for the API key and URL, creating it on first use."""
+    key = (api_key, base_url)
+    if key not in _clients:
+        _clients[key] = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    return _clients[key]
+
+
+async def close() -> None:
+    """Frees network connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
+
 
 class AssistantModel:
     """OpenAI Assistant API wrapper."""
@@ -24,7 +44,7 @@ class AssistantModel:
         self.user_id = None  # Will be set before ask is called
         
         # Configure the OpenAI client
-        self.client = AsyncOpenAI(
+        self.client = get_client(
             api_key=config.openai.api_key,
             base_url=config.openai.url if config.openai.url != "https://api.openai.com/v1" else None
         )
@@ -49,7 +69,9 @@ class AssistantModel:
         initial_message_id = initial_messages.data[0].id if initial_messages.data else None
         
         # Add the user's message to the thread
-        logger.debug(f"> assistant request: assistant_id={self.assistant_id}, thread_id={thread_id}")
+        logger.debug(
+            "> assistant request: assistant_id=%s, thread_id=%s", self.assistant_id, thread_id
+        )
         
         # Include the system prompt in the first message if no history
         # Otherwise just send the user's question
@@ -80,7 +102,7 @@ class AssistantModel:
                 # If we get here, the run completed successfully
                 break
             except Exception as e:
-                logger.warning(f"Attempt {attempt+1} failed: {str(e)}")
+                logger.warning("Attempt %s failed: %s", attempt + 1, e)
                 if attempt == max_attempts - 1:  # Last attempt
                     raise  # Re-raise the exception if all attempts failed
                 # Otherwise wait a bit and try again
@@ -115,7 +137,10 @@ class AssistantModel:
             )
             
             # Log all messages for debugging
-            logger.debug(f"All messages in thread: {[(msg.id, msg.role) for msg in messages.data]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "All messages in thread: %s", [(msg.id, msg.role) for msg in messages.data]
+                )
             
             # The run might have completed but the message isn't available yet
             # Wait a short time and try again
@@ -146,19 +171,21 @@ class AssistantModel:
         if not answer:
             raise ValueError("Received an empty answer from the assistant")
         
-        logger.debug(f"< assistant response: thread_id={thread_id}, run_id={run.id}")
+        logger.debug("< assistant response: thread_id=%s, run_id=%s", thread_id, run.id)
         
         return answer.strip()
     
     async def _get_or_create_thread(self) -> str:
         """Gets an existing thread or creates a new one for the user."""
-        if self.user_id in thread_storage:
-            return thread_storage[self.user_id]
+        # bots in the same process may use different assistants
+        key = f"{self.assistant_id}:{self.user_id}"
+        if key in thread_storage:
+            return thread_storage[key]
         
         # Create a new thread
         thread = await self.client.beta.threads.create()
-        thread_storage[self.user_id] = thread.id
-        logger.debug(f"Created new thread {thread.id} for user {self.user_id}")
+        thread_storage[key] = thread.id
+        logger.debug("Created new thread %s for user %s", thread.id, self.user_id)
         
         return thread.id
     
@@ -166,12 +193,14 @@ class AssistantModel:
         """Waits for the run to complete and returns the final run object."""
         MAX_WAIT_TIME = 240  # Увеличиваем таймаут до 4 минут
         POLLING_INTERVAL = 1.0  # Увеличиваем интервал проверки до 1 секунды
+        # no longer than the user is willing to wait
+        max_wait = deadline.timeout(MAX_WAIT_TIME)
         
         start_time = time.time()
         elapsed_time = 0
         
         # Poll for run status until it's completed or failed
-        while elapsed_time < MAX_WAIT_TIME:
+        while elapsed_time < max_wait:
             try:
                 run = await self.client.beta.threads.runs.retrieve(
                     thread_id=thread_id,
@@ -186,7 +215,7 @@ class AssistantModel:
                 if run.status == "cancelled":
                     # If the run was cancelled, we'll return a default completed run
                     # This prevents errors when we cancel runs ourselves
-                    logger.info(f"Run {run_id} was cancelled, treating as completed")
+                    logger.info("Run %s was cancelled, treating as completed", run_id)
                     # Даем API немного времени для обработки
                     await asyncio.sleep(1)
                     return run
@@ -203,7 +232,7 @@ class AssistantModel:
             except Exception as e:
                 if "not_found" in str(e).lower():
                     # If the run is not found, it might have been deleted or cancelled
-                    logger.warning(f"Run {run_id} not found, might have been cancelled")
+                    logger.warning("Run %s not found, might have been cancelled", run_id)
                     # Create a dummy run object to return
                     return type('obj', (object,), {'id': run_id, 'status': 'completed'})
                 else:
@@ -217,9 +246,9 @@ class AssistantModel:
                 run_id=run_id
             )
         except Exception as e:
-            logger.warning(f"Failed to cancel timed out run: {str(e)}")
+            logger.warning("Failed to cancel timed out run: %s", e)
             
-        raise TimeoutError(f"Run timed out after {MAX_WAIT_TIME} seconds")
+        raise TimeoutError(f"Run timed out after {max_wait:.0f} seconds")
     
     async def _cancel_active_runs(self, thread_id: str) -> None:
         """Check for any active runs in the thread and cancel them."""
@@ -230,7 +259,7 @@ class AssistantModel:
             # Cancel any active runs
             for run in runs.data:
                 if run.status in ["queued", "in_progress", "requires_action"]:
-                    logger.debug(f"Cancelling active run {run.id} in thread {thread_id}")
+                    logger.debug("Cancelling active run %s in thread %s", run.id, thread_id)
                     try:
                         await self.client.beta.threads.runs.cancel(
                             thread_id=thread_id,
@@ -238,11 +267,11 @@ class AssistantModel:
                         )
                     except Exception as e:
                         # If cancellation fails, log it but continue
-                        logger.warning(f"Failed to cancel run {run.id}: {str(e)}")
+                        logger.warning("Failed to cancel run %s: %s", run.id, e)
                         
             # Small delay to ensure cancellation is processed
             await asyncio.sleep(0.5)
             
         except Exception as e:
             # If listing runs fails, log it but continue
-            logger.warning(f"Failed to list runs for thread {thread_id}: {str(e)}") 
\ No newline at end of file
+            logger.warning("Failed to list runs for thread %s: %s", thread_id, e) 
\ No newline at end of file
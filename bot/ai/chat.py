@@ -1,13 +1,25 @@
 """OpenAI-compatible language model."""
 
+import json
 import logging
-from typing import Optional
+from typing import AsyncIterator, Optional
 import httpx
+from bot import budget
+from bot import deadline
 from bot.config import config
 
-client = httpx.AsyncClient(timeout=60.0)
+# The longest a request may take, in seconds (unless the deadline is closer).
+TIMEOUT = 60.0
+
+client = httpx.AsyncClient(timeout=TIMEOUT)
 logger = logging.getLogger(__name__)
 
+
+async def close() -> None:
+    """Frees network connections."""
+    await client.aclose()
+
+
 # Known models and their context windows
 MODELS = {
     # Gemini
@@ -55,29 +67,12 @@ class Model:
 
     async def ask(self, prompt: str, question: str, history: list[tuple[str, str]]) -> str:
         """Asks the language model a question and returns an answer."""
-        model = self.name
-        prompt_role = ROLE_OVERRIDES.get(model) or "system"
-        params_func = PARAM_OVERRIDES.get(model) or (lambda params: params)
-
-        n_input = _calc_n_input(model, n_output=config.openai.params["max_tokens"])
-        messages = self._generate_messages(prompt_role, prompt, question, history)
-        messages = shorten(messages, length=n_input)
-
-        params = params_func(config.openai.params)
-        logger.debug(
-            f"> chat request: model=%s, params=%s, messages=%s",
-            model,
-            params,
-            messages,
-        )
+        request = self._prepare_request(prompt, question, history)
         response = await client.post(
             f"{config.openai.url}/chat/completions",
             headers={"Authorization": f"Bearer {config.openai.api_key}"},
-            json={
-                "model": model,
-                "messages": messages,
-                **params,
-            },
+            json=request,
+            timeout=deadline.timeout(TIMEOUT),
         )
         resp = response.json()
         if "usage" not in resp:
@@ -91,6 +86,60 @@ class Model:
         answer = self._prepare_answer(resp)
         return answer
 
+    async def ask_stream(
+        self, prompt: str, question: str, history: list[tuple[str, str]]
+    ) -> AsyncIterator[str]:
+        """Asks the language model a question and yields the answer in parts as it is written."""
+        request = self._prepare_request(prompt, question, history)
+        async with client.stream(
+            "POST",
+            f"{config.openai.url}/chat/completions",
+            headers={"Authorization": f"Bearer {config.openai.api_key}"},
+            json={**request, "stream": True},
+            timeout=deadline.timeout(TIMEOUT),
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(response.json())
+            # server-sent events, one per line: "data: {...}"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                resp = json.loads(data)
+                if not resp.get("choices"):
+                    continue
+                delta = resp["choices"][0].get("delta") or {}
+                if delta.get("content"):
+                    yield delta["content"]
+
+    def _prepare_request(
+        self, prompt: str, question: str, history: list[tuple[str, str]]
+    ) -> dict:
+        """Builds the request body: the model, the messages and the parameters."""
+        # a faster model if the time is running out
+        model = deadline.model(self.name)
+        prompt_role = ROLE_OVERRIDES.get(model) or "system"
+        params_func = PARAM_OVERRIDES.get(model) or (lambda params: params)
+
+        n_input = calc_n_input(model, n_output=config.openai.params["max_tokens"])
+        messages = self._generate_messages(prompt_role, prompt, question, history)
+        messages = shorten(messages, length=n_input)
+
+        params = dict(params_func(config.openai.params))
+        if "max_tokens" in params:
+            # a shorter answer if the time is running out
+            params["max_tokens"] = deadline.max_tokens(params["max_tokens"])
+        logger.debug(
+            "> chat request: model=%s, params=%s, messages=%s",
+            model,
+            params,
+            messages,
+        )
+        return {"model": model, "messages": messages, **params}
+
     def _generate_messages(
         self, prompt_role: str, prompt: str, question: str, history: list[tuple[str, str]]
     ) -> list[dict]:
@@ -144,10 +193,10 @@ def shorten(messages: list[dict], length: int) -> list[dict]:
 
 def _calc_tokens(s: str) -> int:
     """Calculates the number of tokens in a string."""
-    return int(len(s.split()) * 1.2)
+    return budget.count_tokens(s)
 
 
-def _calc_n_input(name: str, n_output: int) -> int:
+def calc_n_input(name: str, n_output: int) -> int:
     """
     Calculates the maximum number of input tokens
     according to the model and the maximum number of output tokens.
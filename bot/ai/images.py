@@ -1,9 +1,18 @@
 """OpenAI-compatible image generation model."""
 
 import httpx
+from bot import deadline
 from bot.config import config
 
-client = httpx.AsyncClient(timeout=60.0)
+# The longest a request may take, in seconds (unless the deadline is closer).
+TIMEOUT = 60.0
+
+client = httpx.AsyncClient(timeout=TIMEOUT)
+
+
+async def close() -> None:
+    """Frees network connections."""
+    await client.aclose()
 
 
 class Model:
@@ -20,6 +29,7 @@ class Model:
                 "size": size,
                 "n": 1,
             },
+            timeout=deadline.timeout(TIMEOUT),
         )
         resp = response.json()
         if "data" not in resp:
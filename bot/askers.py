@@ -3,34 +3,51 @@ Asker is an abstraction that sends questions to the AI
 and responds to the user with answers provided by the AI.
 """
 
-import io
 import re
-import textwrap
+from typing import AsyncIterator, Sequence
 
-from telegram import Chat, Message
-from telegram.constants import MessageLimit, ParseMode
+from telegram import Message
+from telegram.constants import ChatAction
 from telegram.ext import CallbackContext
 
 from bot import ai
-from bot import markdown
+from bot import outbox
 from bot.config import config
 
 
 class Asker:
     """Asks AI questions and responds with answers."""
 
+    # the chat action shown while the answer is in progress
+    action = ChatAction.TYPING
+    # whether the answer can be shown while it is being written
+    streams = False
+
     async def ask(self, prompt: str, question: str, history: list[tuple[str, str]]) -> str:
         """Asks AI a question."""
         pass
 
-    async def reply(self, message: Message, context: CallbackContext, answer: str) -> None:
-        """Replies with an answer from AI."""
+    async def ask_stream(
+        self, prompt: str, question: str, history: list[tuple[str, str]]
+    ) -> AsyncIterator[str]:
+        """Asks AI a question and yields the answer in parts as it is written."""
+        yield await self.ask(prompt, question, history)
+
+    async def reply(
+        self, message: Message, context: CallbackContext, answer: str, replace: Sequence[int] = ()
+    ) -> list[int]:
+        """
+        Replies with an answer from AI and returns the ids of the sent messages.
+        Replaces the earlier replies, if any.
+        """
         pass
 
 
 class TextAsker(Asker):
     """Works with chat completion AI."""
 
+    streams = True
+
     def __init__(self, model_name: str) -> None:
         self.model = ai.chat.Model(model_name)
 
@@ -38,26 +55,18 @@ class TextAsker(Asker):
         """Asks AI a question."""
         return await self.model.ask(prompt, question, history)
 
-    async def reply(self, message: Message, context: CallbackContext, answer: str) -> None:
+    async def ask_stream(
+        self, prompt: str, question: str, history: list[tuple[str, str]]
+    ) -> AsyncIterator[str]:
+        """Asks AI a question and yields the answer in parts as it is written."""
+        async for part in self.model.ask_stream(prompt, question, history):
+            yield part
+
+    async def reply(
+        self, message: Message, context: CallbackContext, answer: str, replace: Sequence[int] = ()
+    ) -> list[int]:
         """Replies with an answer from AI."""
-        html_answer = markdown.to_html(answer)
-        if len(html_answer) <= MessageLimit.MAX_TEXT_LENGTH:
-            await message.reply_text(html_answer, parse_mode=ParseMode.HTML)
-            return
-
-        doc = io.StringIO(answer)
-        caption = (
-            textwrap.shorten(answer, width=255, placeholder="...")
-            + " (see attachment for the rest)"
-        )
-        reply_to_message_id = message.id if message.chat.type != Chat.PRIVATE else None
-        await context.bot.send_document(
-            chat_id=message.chat_id,
-            caption=caption,
-            filename=f"{message.id}.md",
-            document=doc,
-            reply_to_message_id=reply_to_message_id,
-        )
+        return await outbox.send(message, outbox.TEXT, answer, replace=replace)
 
 
 class AssistantAsker(Asker):
@@ -70,31 +79,17 @@ class AssistantAsker(Asker):
         """Asks AI a question using the Assistant API."""
         return await self.model.ask(prompt, question, history)
 
-    async def reply(self, message: Message, context: CallbackContext, answer: str) -> None:
+    async def reply(
+        self, message: Message, context: CallbackContext, answer: str, replace: Sequence[int] = ()
+    ) -> list[int]:
         """Replies with an answer from AI."""
-        html_answer = markdown.to_html(answer)
-        if len(html_answer) <= MessageLimit.MAX_TEXT_LENGTH:
-            await message.reply_text(html_answer, parse_mode=ParseMode.HTML)
-            return
-
-        doc = io.StringIO(answer)
-        caption = (
-            textwrap.shorten(answer, width=255, placeholder="...")
-            + " (see attachment for the rest)"
-        )
-        reply_to_message_id = message.id if message.chat.type != Chat.PRIVATE else None
-        await context.bot.send_document(
-            chat_id=message.chat_id,
-            caption=caption,
-            filename=f"{message.id}.md",
-            document=doc,
-            reply_to_message_id=reply_to_message_id,
-        )
+        return await outbox.send(message, outbox.TEXT, answer, replace=replace)
 
 
 class ImagineAsker(Asker):
     """Works with image generation AI."""
 
+    action = ChatAction.UPLOAD_PHOTO
     model = ai.images.Model()
     size_re = re.compile(r"(256|512|1024)(?:x\1)?\s?(?:px)?")
     sizes = {
@@ -114,9 +109,13 @@ class ImagineAsker(Asker):
         self.caption = self._extract_caption(question)
         return await self.model.imagine(prompt=self.caption, size=size)
 
-    async def reply(self, message: Message, context: CallbackContext, answer: str) -> None:
+    async def reply(
+        self, message: Message, context: CallbackContext, answer: str, replace: Sequence[int] = ()
+    ) -> list[int]:
         """Replies with an answer from AI."""
-        await message.reply_photo(answer, caption=self.caption)
+        return await outbox.send(
+            message, outbox.PHOTO, answer, caption=self.caption, replace=replace
+        )
 
     def _extract_size(self, question: str) -> str:
         match = self.size_re.search(question)
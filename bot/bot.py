@@ -1,10 +1,8 @@
 """Telegram chat bot built using the language model from OpenAI."""
 
+import asyncio
 import logging
-import sys
 import textwrap
-import time
-import asyncio
 
 from telegram import Chat, Message, Update
 from telegram.ext import (
@@ -13,55 +11,153 @@ from telegram.ext import (
     CallbackContext,
     CommandHandler,
     MessageHandler,
-    PicklePersistence,
 )
+from bot import actions
+from bot import admission
+from bot import ai
 from bot import askers
 from bot import commands
-from bot import questions
+from bot import deadline
+from bot import inflight
+from bot import ratelimit
+from bot import retention
+from bot import locks
+from bot import logs
+from bot import memory
 from bot import models
-from bot.config import config
-from bot.fetcher import Fetcher
+from bot import outbox
+from bot import persistence
+from bot import pipeline
+from bot import sharding
+from bot import webhook
+from bot import workers
+from bot.config import PerBot, config
 from bot.filters import Filters
 from bot.models import ChatData, UserData
 
 
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("openai").setLevel(logging.WARNING)
-logging.getLogger("bot").setLevel(logging.INFO)
-logging.getLogger("bot.ai.chat").setLevel(logging.INFO)
-logging.getLogger("bot.commands").setLevel(logging.INFO)
-logging.getLogger("bot.questions").setLevel(logging.INFO)
-logging.getLogger("__main__").setLevel(logging.INFO)
-
 logger = logging.getLogger(__name__)
 
-# retrieves remote content
-fetcher = Fetcher()
+# telegram message filters, separate for each bot
+filters: PerBot[Filters] = PerBot(Filters)
+
+# how often sharding workers save changed data, in seconds,
+# so that other workers see it soon
+SHARED_UPDATE_INTERVAL = 1
 
-# telegram message filters
-filters = Filters()
+# how long the tasks left after the bots have stopped get to finish, in seconds
+CANCEL_TIMEOUT = 5
 
 
 def main():
-    persistence = PicklePersistence(filepath=config.persistence_path)
-    application = (
+    logs.setup()
+    if config.sharding.workers:
+        sharding.run(build_application, n_workers=config.sharding.workers)
+        return
+    application = build_application()
+    if config.webhook.url:
+        webhook.run(application)
+    else:
+        application.run_polling()
+
+
+class DrainingApplication(Application):
+    """
+    Finishes the answers in progress before stopping, so that
+    a restart does not cost users their answers. The updater
+    (or the sharding receiver) has already stopped taking new updates by then.
+    Also starts the clock for each update: its request id and deadline,
+    and periodically removes the data of idle users and chats.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.sweeper = retention.Sweeper(self)
+        memory.histories.application = self
+
+    async def process_update(self, update: object) -> None:
+        if isinstance(update, Update):
+            # each update runs in its own task, so the id stays with its log records
+            logs.request_id.set(str(update.update_id))
+            chat = update.effective_chat
+            deadline.start(chat.type if chat else "", _command_of(update))
+            retention.touch(self, update)
+        await super().process_update(update)
+        if isinstance(update, Update):
+            retention.touch(self, update)
+
+    async def start(self) -> None:
+        await super().start()
+        self.sweeper.start()
+
+    async def stop(self) -> None:
+        await self.sweeper.stop()
+        if self.running:
+            timeout = config.shutdown.timeout
+            logger.info("waiting up to %ss for %s answers", timeout, len(inflight.answers))
+            n_abandoned = await inflight.answers.drain(timeout)
+            if n_abandoned:
+                logger.warning("abandoned %s answers", n_abandoned)
+        await super().stop()
+
+    def unload_user_data(self, user_id: int) -> None:
+        """Removes the user data from memory, keeping it in the persistence."""
+        data = self._user_data.pop(user_id, None)
+        if user_id in self._user_ids_to_be_updated_in_persistence:
+            # the changes would otherwise be lost (or overwritten with empty data)
+            self._user_ids_to_be_updated_in_persistence.discard(user_id)
+        else:
+            data = None
+        self.persistence.unload(persistence.USER_TABLE, user_id, data)
+
+    def unload_chat_data(self, chat_id: int) -> None:
+        """Removes the chat data from memory, keeping it in the persistence."""
+        data = self._chat_data.pop(chat_id, None)
+        if chat_id in self._chat_ids_to_be_updated_in_persistence:
+            self._chat_ids_to_be_updated_in_persistence.discard(chat_id)
+        else:
+            data = None
+        self.persistence.unload(persistence.CHAT_TABLE, chat_id, data)
+
+
+def _command_of(update: Update) -> str:
+    """Returns the name of the command in the update, if any."""
+    message = update.effective_message
+    if not message or not message.text or not message.text.startswith("/"):
+        return ""
+    return message.text.split()[0][1:].partition("@")[0].lower()
+
+
+def build_application(shared: bool = False) -> Application:
+    """
+    Creates the bot application.
+    A shared application works in a sharding worker process:
+    it receives updates from the router instead of polling,
+    and shares the persistence with other workers.
+    With a webhook, the application receives updates from the webhook server.
+    """
+    store = persistence.SqlitePersistence(
+        filepath=config.persistence_path,
+        update_interval=SHARED_UPDATE_INTERVAL if shared else 60,
+        shared=shared,
+    )
+    builder = (
         ApplicationBuilder()
+        .application_class(DrainingApplication)
         .token(config.telegram.token)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
-        .persistence(persistence)
+        .persistence(store)
+        .rate_limiter(ratelimit.RateLimiter())
         .concurrent_updates(True)
         .get_updates_http_version("1.1")
         .http_version("1.1")
-        .build()
     )
+    if shared or config.webhook.url:
+        builder = builder.updater(None)
+    application = builder.build()
     add_handlers(application)
-    application.run_polling()
+    return application
 
 
 def add_handlers(application: Application):
@@ -76,6 +172,12 @@ def add_handlers(application: Application):
     application.add_handler(
         CommandHandler("config", commands.Config(filters), filters=filters.admins_private)
     )
+    application.add_handler(
+        CommandHandler("stats", commands.Stats(), filters=filters.admins_private)
+    )
+    application.add_handler(
+        CommandHandler("cancel", commands.Cancel(), filters=filters.admins)
+    )
 
     # message-related commands
     application.add_handler(
@@ -97,32 +199,47 @@ def add_handlers(application: Application):
 async def post_init(application: Application) -> None:
     """Defines bot settings."""
     bot = application.bot
-    logging.info(f"config: file={config.filename}, version={config.version}")
-    logging.info(f"allowed users: {config.telegram.usernames}")
-    logging.info(f"allowed chats: {config.telegram.chat_ids}")
-    logging.info(f"admins: {config.telegram.admins}")
-    logging.info(f"api url: {config.openai.url}")
-    logging.info(f"model name: {config.openai.model}")
-    logging.info(f"bot: username={bot.username}, id={bot.id}")
-    await bot.set_my_commands(commands.BOT_COMMANDS)
+    logger.info("config: file=%s, version=%s", config.filename, config.version)
+    logger.info("allowed users: %s", config.telegram.usernames)
+    logger.info("allowed chats: %s", config.telegram.chat_ids)
+    logger.info("admins: %s", config.telegram.admins)
+    logger.info("api url: %s", config.openai.url)
+    logger.info("model name: %s", config.openai.model)
+    logger.info("bot: username=%s, id=%s", bot.username, bot.id)
+    outbox.init(persistence.database_path(config.persistence_path))
+    if not application.persistence.shared:
+        # the sharding receiver sets the commands
+        # and redelivers the answers for the workers
+        await bot.set_my_commands(commands.BOT_COMMANDS)
+        await outbox.redeliver(bot)
 
 
 async def post_shutdown(application: Application) -> None:
     """Frees acquired resources."""
-    await fetcher.close()
+    outbox.close()
+    await close_resources()
 
 
-async def continuous_typing(chat, message_thread_id=None):
-    """Continuously sends typing action every 4 seconds until stopped."""
-    try:
-        while True:
-            await chat.send_action(action="typing", message_thread_id=message_thread_id)
-            await asyncio.sleep(4)  # Refresh typing indicator every 4 seconds
-    except asyncio.CancelledError:
-        # Task was cancelled, which is expected when response is ready
-        pass
-    except Exception as e:
-        logger.error(f"Error in continuous_typing: {e}")
+async def close_resources() -> None:
+    """Frees the resources shared by all the bots in the process."""
+    # e.g. abandoned answers that are still unwinding,
+    # so that they do not find their connections closed
+    await _cancel_tasks()
+    await pipeline.fetcher.close()
+    await ai.close()
+    workers.shutdown()
+
+
+async def _cancel_tasks() -> None:
+    """Cancels the tasks left after the bots have stopped, and waits for them to finish."""
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+    if not tasks:
+        return
+    logger.info("cancelling %s leftover tasks", len(tasks))
+    for task in tasks:
+        task.cancel()
+    await asyncio.wait(tasks, timeout=CANCEL_TIMEOUT)
 
 
 def with_message_limit(func):
@@ -134,69 +251,114 @@ def with_message_limit(func):
         username = update.effective_user.username
         user = UserData(context.user_data)
 
-        # check if the message counter exceeds the message limit
-        if (
-            not filters.is_known_user(username)
-            and user.message_counter.value >= config.conversation.message_limit.count > 0
-            and not user.message_counter.is_expired()
-        ):
-            # this is a group user and they have exceeded the message limit
-            wait_for = models.format_timedelta(user.message_counter.expires_after())
-            await message.reply_text(f"Please wait {wait_for} before asking a new question.")
-            return
+        # the user's questions are answered one at a time,
+        # so that the history and the message counter stay consistent
+        async with locks.users.hold(update.effective_user.id):
+            # check if the message counter exceeds the message limit
+            if (
+                not filters.is_known_user(username)
+                and user.message_counter.value >= config.conversation.message_limit.count > 0
+                and not user.message_counter.is_expired()
+            ):
+                # this is a group user and they have exceeded the message limit
+                wait_for = models.format_timedelta(user.message_counter.expires_after())
+                await message.reply_text(f"Please wait {wait_for} before asking a new question.")
+                return
+
+            # this is a known user or they have not exceeded the message limit,
+            # so proceed to the actual message handler
+            await func(update=update, message=message, context=context, question=question)
+
+            # increment the message counter
+            message_count = user.message_counter.increment()
+            logger.debug("user=%s, n_messages=%s", username, message_count)
 
-        # this is a known user or they have not exceeded the message limit,
-        # so proceed to the actual message handler
-        await func(update=update, message=message, context=context, question=question)
+    return wrapper
+
+
+def with_inflight(func):
+    """
+    Answers the question in a task that can be cancelled:
+    when the question is edited, the answer to the earlier version is cancelled,
+    and a follow-up in a private chat supersedes the user's answer in progress.
+    """
 
-        # increment the message counter
-        message_count = user.message_counter.increment()
-        logger.debug(f"user={username}, n_messages={message_count}")
+    async def wrapper(
+        update: Update, message: Message, context: CallbackContext, question: str
+    ) -> None:
+        if message.chat.type == Chat.PRIVATE and question.startswith("+"):
+            # the user adds to a question that is not answered yet,
+            # so answer both at once
+            prev_question = inflight.answers.supersede(message.chat_id, update.effective_user.id)
+            if prev_question:
+                question = f"{prev_question}\n\n{question.lstrip('+ ')}"
+        await inflight.answers.run(
+            inflight.key_of(update),
+            user_id=update.effective_user.id,
+            question=question,
+            answer=func(update=update, message=message, context=context, question=question),
+        )
 
     return wrapper
 
 
+def with_admission(func):
+    """
+    Waits for a free slot before replying, or refuses to reply if the bot is too busy.
+    Runs inside the user lock, so that the user's queued questions
+    do not take the slots while waiting for each other.
+    """
+
+    async def wrapper(
+        update: Update, message: Message, context: CallbackContext, question: str
+    ) -> None:
+        chat = message.chat
+        weight = admission.weight_of(chat.id, chat.type)
+        try:
+            async with admission.questions.slot(chat.id, weight):
+                await func(update=update, message=message, context=context, question=question)
+        except admission.Busy as exc:
+            logger.warning("rejected question id=%s: %s", message.id, exc)
+            await message.reply_text(f"I'm busy, try again in {exc.retry_after} s.")
+
+    return wrapper
+
+
+@with_inflight
 @with_message_limit
+@with_admission
 async def reply_to(
     update: Update, message: Message, context: CallbackContext, question: str
 ) -> None:
     """Replies to a specific question."""
-    # Start a background task to continuously show typing indicator
-    typing_task = asyncio.create_task(
-        continuous_typing(message.chat, message.message_thread_id)
-    )
-
     try:
         chat = ChatData(context.chat_data)
         model = chat.model or config.openai.model
         asker = askers.create(model=model, question=question)
+        request = pipeline.Request(
+            update=update,
+            message=message,
+            context=context,
+            question=question,
+            asker=asker,
+            model=model,
+            prompt=chat.prompt,
+        )
         if message.chat.type == Chat.PRIVATE and message.forward_date:
             # this is a forwarded message, don't answer yet
-            answer = "This is a forwarded message. What should I do with it?"
-        else:
-            answer = await _ask_question(message, context, question, asker)
-
-        user = UserData(context.user_data)
-        user.messages.add(question, answer)
-        logger.debug(user.messages)
-        
-        # Cancel the typing indicator before sending the response
-        typing_task.cancel()
-        try:
-            await typing_task
-        except asyncio.CancelledError:
-            pass
-            
-        await asker.reply(message, context, answer)
+            request.answer = "This is a forwarded message. What should I do with it?"
+        # show the action until the answer is delivered
+        async with actions.scheduler.show(
+            message.get_bot(), message.chat_id, message.message_thread_id, action=asker.action
+        ):
+            await pipeline.pipelines.run(request)
 
     except Exception as exc:
-        # Cancel the typing indicator in case of error
-        typing_task.cancel()
-        try:
-            await typing_task
-        except asyncio.CancelledError:
-            pass
-            
+        if isinstance(exc, deadline.Missed) or deadline.expired():
+            # a late answer is of no use, and neither is a timeout error
+            logger.warning("question id=%s took too long", message.id)
+            await message.reply_text("Sorry, this took too long. Please try again.")
+            return
         class_name = f"{exc.__class__.__module__}.{exc.__class__.__qualname__}"
         error_text = f"{class_name}: {exc}"
         logger.error("Failed to answer: %s", error_text)
@@ -204,50 +366,5 @@ async def reply_to(
         await message.reply_text(text)
 
 
-async def _ask_question(
-    message: Message, context: CallbackContext, question: str, asker: askers.Asker
-) -> str:
-    """Answers a question using the OpenAI model."""
-    user_id = message.from_user.username or message.from_user.id
-    logger.info(f"-> question id={message.id}, user={user_id}, n_chars={len(question)}")
-
-    # Set the user ID for AssistantAsker
-    if isinstance(asker, askers.AssistantAsker):
-        asker.model.user_id = str(user_id)
-
-    question, is_follow_up = questions.prepare(question)
-    question = await fetcher.substitute_urls(question)
-    logger.debug(f"Prepared question: {question}")
-
-    user = UserData(context.user_data)
-    if message.chat.type == Chat.PRIVATE:
-        # in private chats the bot remembers previous messages
-        if is_follow_up:
-            # this is a follow-up question,
-            # so the bot should retain the previous history
-            history = user.messages.as_list()
-        else:
-            # user is asking a question 'from scratch',
-            # so the bot should forget the previous history
-            user.messages.clear()
-            history = []
-    else:
-        # in group chats the bot only answers direct questions
-        # or follow-up questions to the bot messages
-        prev_message = questions.extract_prev(message, context)
-        history = [("", prev_message)] if prev_message else []
-
-    chat = ChatData(context.chat_data)
-    start = time.perf_counter_ns()
-    answer = await asker.ask(prompt=chat.prompt, question=question, history=history)
-    elapsed = int((time.perf_counter_ns() - start) / 1e6)
-
-    logger.info(
-        f"<- answer id={message.id}, user={user_id}, "
-        f"n_chars={len(answer)}, len_history={len(history)}, took={elapsed}ms"
-    )
-    return answer
-
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+"""
+Fits text into a token budget.
+Token counts are estimates, not exact values returned by the AI API.
+"""
+
+import re
+
+# Splits text into paragraphs.
+paragraph_re = re.compile(r"\n\s*\n")
+
+# Matches words that are meaningful for relevance scoring.
+term_re = re.compile(r"\w{4,}")
+
+# Common words that do not help to find relevant paragraphs.
+STOP_WORDS = frozenset(
+    [
+        "about",
+        "also",
+        "been",
+        "could",
+        "does",
+        "from",
+        "have",
+        "into",
+        "just",
+        "like",
+        "more",
+        "most",
+        "only",
+        "should",
+        "some",
+        "than",
+        "that",
+        "them",
+        "then",
+        "there",
+        "their",
+        "they",
+        "this",
+        "what",
+        "when",
+        "where",
+        "which",
+        "will",
+        "with",
+        "would",
+        "your",
+    ]
+)
+
+# The number of tokens reserved for each "omitted" label.
+LABEL_TOKENS = 8
+
+# The share of the budget given to the beginning of a text
+# when trimming it by keeping the head and the tail.
+HEAD_SHARE = 0.7
+
+
+def count_tokens(text: str) -> int:
+    """Calculates the (estimated) number of tokens in a string."""
+    return int(len(text.split()) * 1.2)
+
+
+def split(budget: int, sizes: list[int]) -> list[int]:
+    """
+    Splits the budget between several items of given sizes.
+    Small items get as much as they need, and the rest
+    is divided equally between the large ones.
+    """
+    shares = [0] * len(sizes)
+    remaining = max(budget, 0)
+    pending = sorted(range(len(sizes)), key=lambda idx: sizes[idx])
+    while pending:
+        fair_share = remaining // len(pending)
+        idx = pending[0]
+        if sizes[idx] > fair_share:
+            break
+        shares[idx] = sizes[idx]
+        remaining -= sizes[idx]
+        pending.pop(0)
+    for idx in pending:
+        shares[idx] = remaining // len(pending)
+    return shares
+
+
+def trim(text: str, budget: int, query: str = "") -> str:
+    """
+    Trims the text to fit into the budget.
+    Keeps the paragraphs most relevant to the query, or the beginning
+    and the end of the text if none are relevant.
+    Labels the omitted parts.
+    """
+    if count_tokens(text) <= budget:
+        return text
+
+    paragraphs = [par.strip() for par in paragraph_re.split(text) if par.strip()]
+    sizes = [count_tokens(par) for par in paragraphs]
+    terms = _extract_terms(query)
+    scores = [_score(par, terms) for par in paragraphs]
+    if any(scores):
+        keep = _select_relevant(sizes, scores, budget)
+    else:
+        keep = _select_head_tail(sizes, budget)
+
+    if not keep:
+        # even a single paragraph does not fit,
+        # so cut the text by words
+        return _cut_words(text, budget)
+    return _assemble(paragraphs, keep)
+
+
+def _extract_terms(query: str) -> set[str]:
+    """Returns meaningful words from the query."""
+    words = term_re.findall(query.lower())
+    return set(word for word in words if word not in STOP_WORDS)
+
+
+def _score(paragraph: str, terms: set[str]) -> int:
+    """Returns the number of query terms found in the paragraph."""
+    if not terms:
+        return 0
+    words = set(term_re.findall(paragraph.lower()))
+    return len(terms & words)
+
+
+def _select_relevant(sizes: list[int], scores: list[int], budget: int) -> set[int]:
+    """Selects the first paragraph and the most relevant ones that fit into the budget."""
+    keep = set()
+    used = 0
+    order = sorted(range(len(sizes)), key=lambda idx: (-scores[idx], idx))
+    for idx in [0] + order:
+        if idx in keep or (idx > 0 and scores[idx] == 0):
+            continue
+        size = sizes[idx] + LABEL_TOKENS
+        if used + size > budget:
+            continue
+        keep.add(idx)
+        used += size
+    return keep
+
+
+def _select_head_tail(sizes: list[int], budget: int) -> set[int]:
+    """Selects paragraphs from the beginning and the end that fit into the budget."""
+    keep = set()
+    head_budget = int(budget * HEAD_SHARE)
+    used = 0
+    for idx, size in enumerate(sizes):
+        if used + size + LABEL_TOKENS > head_budget:
+            break
+        keep.add(idx)
+        used += size
+    used += LABEL_TOKENS
+    for idx in range(len(sizes) - 1, -1, -1):
+        if idx in keep or used + sizes[idx] > budget:
+            break
+        keep.add(idx)
+        used += sizes[idx]
+    return keep
+
+
+def _assemble(paragraphs: list[str], keep: set[int]) -> str:
+    """Joins the selected paragraphs and labels the omitted ones."""
+    parts = []
+    n_omitted = 0
+    for idx, paragraph in enumerate(paragraphs):
+        if idx not in keep:
+            n_omitted += 1
+            continue
+        if n_omitted:
+            parts.append(_label(n_omitted))
+            n_omitted = 0
+        parts.append(paragraph)
+    if n_omitted:
+        parts.append(_label(n_omitted))
+    return "\n\n".join(parts)
+
+
+def _label(n_omitted: int) -> str:
+    """Returns a label for the omitted paragraphs."""
+    noun = "paragraph" if n_omitted == 1 else "paragraphs"
+    return f"[... {n_omitted} {noun} omitted ...]"
+
+
+def _cut_words(text: str, budget: int) -> str:
+    """Keeps the first and the last words of the text that fit into the budget."""
+    words = text.split()
+    n_words = max(int((budget - LABEL_TOKENS) / 1.2), 0)
+    n_head = int(n_words * HEAD_SHARE)
+    n_tail = n_words - n_head
+    head = " ".join(words[:n_head])
+    tail = " ".join(words[len(words) - n_tail :]) if n_tail else ""
+    n_omitted = len(words) - n_head - n_tail
+    label = f"[... {n_omitted} words omitted ...]"
+    return "\n\n".join(part for part in (head, label, tail) if part)
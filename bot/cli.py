@@ -18,7 +18,7 @@ import bot.ai.chat
 async def main(question):
     print(f"> {question}")
     fetcher = Fetcher()
-    question = await fetcher.substitute_urls(question)
+    question = await fetcher.substitute_urls(question, max_tokens=config.fetcher.max_tokens)
     ai = init_model()
     answer = await ai.ask(prompt=config.openai.prompt, question=question, history=[])
     await fetcher.close()
@@ -0,0 +1,125 @@
+"""
+Merges a burst of messages into a single question. Users often split a question
+into several quick messages, or upload an album of documents (each document
+comes as a separate message). Instead of answering each one, the bot waits
+until the user stops typing, and answers them all at once.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Awaitable, Hashable, Optional
+
+from telegram import Message
+
+from bot.config import PerBot, config
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for the rest of an album, in seconds.
+# Telegram delivers album items within a fraction of a second.
+MEDIA_GROUP_WINDOW = 1.0
+
+
+@dataclass
+class Burst:
+    """Messages that are merged into a single question."""
+
+    # when the burst ends unless more messages come
+    deadline: float
+    # the extracted text of each message, by message id
+    parts: dict[int, str] = field(default_factory=dict)
+    # the number of messages that are still being extracted
+    n_pending: int = 0
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    # resolves to the id of the message that asks the merged question
+    result: Optional[asyncio.Future] = None
+
+
+class Coalescer:
+    """Merges consecutive messages with the same key."""
+
+    def __init__(self) -> None:
+        self._bursts: dict[Hashable, Burst] = {}
+
+    def __len__(self) -> int:
+        return len(self._bursts)
+
+    async def collect(
+        self, key: Hashable, message_id: int, text: Awaitable[str], window: float
+    ) -> str:
+        """
+        Adds the message to the burst and waits until the burst ends,
+        that is, there are no new messages for `window` seconds.
+        Returns the merged question for the latest message in the burst,
+        and an empty string for the others.
+        """
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = Burst(deadline=0, result=asyncio.get_running_loop().create_future())
+            self._bursts[key] = burst
+        burst.deadline = time.monotonic() + window
+        burst.n_pending += 1
+        burst.changed.set()
+
+        try:
+            part = await text
+        except BaseException:
+            self._discard(key, burst)
+            raise
+        burst.parts[message_id] = part
+        burst.n_pending -= 1
+        burst.changed.set()
+
+        while not burst.result.done():
+            delay = burst.deadline - time.monotonic()
+            if burst.n_pending == 0 and delay <= 0:
+                # the burst is over
+                del self._bursts[key]
+                burst.result.set_result(max(burst.parts))
+                break
+            burst.changed.clear()
+            timeout = delay if delay > 0 else None
+            try:
+                await asyncio.wait_for(burst.changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        if burst.result.result() != message_id:
+            return ""
+        if len(burst.parts) > 1:
+            logger.info("merged %s messages into message=%s", len(burst.parts), message_id)
+        return merge([burst.parts[msg_id] for msg_id in sorted(burst.parts)])
+
+    def _discard(self, key: Hashable, burst: Burst) -> None:
+        """Forgets a message that failed to extract."""
+        burst.n_pending -= 1
+        burst.changed.set()
+        if not burst.parts and not burst.n_pending and self._bursts.get(key) is burst:
+            del self._bursts[key]
+
+
+def merge(parts: list[str]) -> str:
+    """
+    Joins the parts into a single question.
+    The question is a follow-up if any of the parts is.
+    """
+    parts = [part for part in parts if part]
+    if len(parts) == 1:
+        return parts[0]
+    is_follow_up = any(part.startswith("+") for part in parts)
+    question = "\n\n".join(part.lstrip("+ ") if part.startswith("+") else part for part in parts)
+    return f"+ {question}" if is_follow_up and question else question
+
+
+def window_of(message: Message) -> float:
+    """Returns how long to wait for more messages after this one, in seconds."""
+    window = config.conversation.debounce
+    if message.media_group_id:
+        window = max(window, MEDIA_GROUP_WINDOW)
+    return window
+
+
+# Bursts of messages in private chats, separate for each bot.
+bursts: PerBot[Coalescer] = PerBot(Coalescer)
@@ -1,4 +1,5 @@
 from .constants import BOT_COMMANDS
+from .cancel import CancelCommand as Cancel
 from .config import ConfigCommand as Config
 from .error import ErrorCommand as Error
 from .help import HelpCommand as Help
@@ -8,4 +9,5 @@ from .model import ModelCommand as Model
 from .prompt import PromptCommand as Prompt
 from .retry import RetryCommand as Retry
 from .start import StartCommand as Start
+from .stats import StatsCommand as Stats
 from .version import VersionCommand as Version
@@ -0,0 +1,31 @@
+"""/cancel command."""
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.constants import ParseMode
+
+from bot import inflight
+
+HELP_MESSAGE = """Syntax:
+<code>/cancel</code> - in this chat
+<code>/cancel [chat id]</code> - in the chat
+<code>/cancel all</code> - in all chats"""
+
+
+class CancelCommand:
+    """Cancels the answers in progress."""
+
+    async def __call__(self, update: Update, context: CallbackContext) -> None:
+        message = update.message or update.edited_message
+        _, _, arg = message.text.partition(" ")
+        arg = arg.strip()
+        if not arg:
+            count = inflight.answers.cancel_chat(message.chat_id)
+        elif arg == "all":
+            count = inflight.answers.cancel_all()
+        elif arg.lstrip("-").isdigit():
+            count = inflight.answers.cancel_chat(int(arg))
+        else:
+            await message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
+            return
+        await message.reply_text(f"✓ Cancelled {count} answers")
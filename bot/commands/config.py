@@ -4,7 +4,8 @@ from telegram import Update
 from telegram.ext import CallbackContext
 from telegram.constants import ParseMode
 
-from bot.config import config, ConfigEditor
+from bot import workers
+from bot.config import ConfigEditor, PerBot, current
 from bot.filters import Filters
 
 HELP_MESSAGE = """Syntax:
@@ -29,7 +30,8 @@ Common properties:
 <code>/config openai.assistant_id</code> - View current assistant ID
 <code>/config openai.assistant_id reset</code> - Disable Assistant API mode"""
 
-editor = ConfigEditor(config)
+# edits the config of the current bot
+editor: PerBot[ConfigEditor] = PerBot(lambda: ConfigEditor(current()))
 
 
 class ConfigCommand:
@@ -65,7 +67,7 @@ class ConfigCommand:
             await message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
             return
 
-        editor.save()
+        await workers.run("config", editor.save)
         if self._should_reload_filters(property):
             self.filters.reload()
 
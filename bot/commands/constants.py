@@ -28,4 +28,6 @@ BOT_COMMANDS = [
 
 ADMIN_COMMANDS = {
     "config": "view or edit the config",
+    "stats": "show load statistics",
+    "cancel": "cancel the answers in progress",
 }
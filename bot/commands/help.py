@@ -28,6 +28,8 @@ def generate_message(username: str) -> str:
     if username in config.telegram.admins:
         admin_commands += "\n\nAdmin-only commads:\n"
         admin_commands += f'/config - {constants.ADMIN_COMMANDS["config"]}\n'
+        admin_commands += f'/stats - {constants.ADMIN_COMMANDS["stats"]}\n'
+        admin_commands += f'/cancel - {constants.ADMIN_COMMANDS["cancel"]}\n'
     admin_commands = admin_commands.rstrip()
 
     # shortcuts
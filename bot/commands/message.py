@@ -4,6 +4,7 @@ import logging
 from typing import Awaitable
 from telegram import Chat, Update
 from telegram.ext import CallbackContext
+from bot import coalesce
 from bot import questions
 
 logger = logging.getLogger(__name__)
@@ -17,12 +18,25 @@ class MessageCommand:
 
     async def __call__(self, update: Update, context: CallbackContext) -> None:
         message = update.message or update.edited_message
-        logger.debug(update)
+        logger.debug(
+            "message: chat=%s, id=%s, user=%s",
+            message.chat_id,
+            message.message_id,
+            message.from_user and message.from_user.username,
+        )
 
         # the bot is meant to answer questions in private chats,
         # but it can also answer a specific question in a group when mentioned
         if message.chat.type == Chat.PRIVATE:
-            question = await questions.extract_private(message, context)
+            extracted = questions.extract_private(message, context)
+            window = coalesce.window_of(message) if update.message else 0
+            if window:
+                # wait for more messages to answer them together,
+                # only the latest message in the burst gets the question
+                key = (message.chat_id, message.from_user.id)
+                question = await coalesce.bursts.collect(key, message.id, extracted, window)
+            else:
+                question = await extracted
         else:
             question, message = await questions.extract_group(message, context)
 
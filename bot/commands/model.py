@@ -4,6 +4,7 @@ from telegram import Chat, Update
 from telegram.ext import CallbackContext
 from telegram.constants import ParseMode
 
+from bot import locks
 from bot.config import config
 from bot.models import ChatData
 
@@ -32,34 +33,37 @@ class ModelCommand:
             # Only admins are allowed to change the model in group chats.
             return
 
-        chat = ChatData(context.chat_data)
-        _, _, model = message.text.partition(" ")
-        if not model:
-            # /model without arguments
-            if chat.model:
-                # the model is already set, show it
+        # settings changes in a chat are applied and confirmed one at a time,
+        # so the last confirmation matches the setting in effect
+        async with locks.chats.hold(message.chat_id):
+            chat = ChatData(context.chat_data)
+            _, _, model = message.text.partition(" ")
+            if not model:
+                # /model without arguments
+                if chat.model:
+                    # the model is already set, show it
+                    await message.reply_text(
+                        f"Using model:\n<code>{chat.model}</code>",
+                        parse_mode=ParseMode.HTML,
+                    )
+                    return
+                else:
+                    # the model is not set, show help message
+                    await message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
+                    return
+
+            if model == RESET:
+                # /model with "reset" argument
+                chat.model = ""
                 await message.reply_text(
-                    f"Using model:\n<code>{chat.model}</code>",
+                    f"✓ Using default model:\n<code>{config.openai.model}</code>",
                     parse_mode=ParseMode.HTML,
                 )
                 return
-            else:
-                # the model is not set, show help message
-                await message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
-                return
 
-        if model == RESET:
-            # /model with "reset" argument
-            chat.model = ""
+            # /model with a name
+            chat.model = model
             await message.reply_text(
-                f"✓ Using default model:\n<code>{config.openai.model}</code>",
+                f"✓ Set model:\n<code>{model}</code>",
                 parse_mode=ParseMode.HTML,
             )
-            return
-
-        # /model with a name
-        chat.model = model
-        await message.reply_text(
-            f"✓ Set model:\n<code>{model}</code>",
-            parse_mode=ParseMode.HTML,
-        )
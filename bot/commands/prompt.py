@@ -4,6 +4,7 @@ from telegram import Chat, Update
 from telegram.ext import CallbackContext
 from telegram.constants import ParseMode
 
+from bot import locks
 from bot.config import config
 from bot.models import ChatData
 
@@ -32,34 +33,37 @@ class PromptCommand:
             # Only admins are allowed to change the prompt in group chats.
             return
 
-        chat = ChatData(context.chat_data)
-        _, _, prompt = message.text.partition(" ")
-        if not prompt:
-            # /prompt without arguments
-            if chat.prompt:
-                # custom prompt is already set, show it
+        # settings changes in a chat are applied and confirmed one at a time,
+        # so the last confirmation matches the setting in effect
+        async with locks.chats.hold(message.chat_id):
+            chat = ChatData(context.chat_data)
+            _, _, prompt = message.text.partition(" ")
+            if not prompt:
+                # /prompt without arguments
+                if chat.prompt:
+                    # custom prompt is already set, show it
+                    await message.reply_text(
+                        f"Using custom prompt:\n<code>{chat.prompt}</code>",
+                        parse_mode=ParseMode.HTML,
+                    )
+                    return
+                else:
+                    # custom prompt is not set, show help message
+                    await message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
+                    return
+
+            if prompt == RESET:
+                # /prompt with "reset" argument
+                chat.prompt = ""
                 await message.reply_text(
-                    f"Using custom prompt:\n<code>{chat.prompt}</code>",
+                    f"✓ Using default prompt:\n<code>{config.openai.prompt}</code>",
                     parse_mode=ParseMode.HTML,
                 )
                 return
-            else:
-                # custom prompt is not set, show help message
-                await message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
-                return
 
-        if prompt == RESET:
-            # /prompt with "reset" argument
-            chat.prompt = ""
+            # /prompt with a custom prompt
+            chat.prompt = prompt
             await message.reply_text(
-                f"✓ Using default prompt:\n<code>{config.openai.prompt}</code>",
+                f"✓ Set custom prompt:\n<code>{prompt}</code>",
                 parse_mode=ParseMode.HTML,
             )
-            return
-
-        # /prompt with a custom prompt
-        chat.prompt = prompt
-        await message.reply_text(
-            f"✓ Set custom prompt:\n<code>{prompt}</code>",
-            parse_mode=ParseMode.HTML,
-        )
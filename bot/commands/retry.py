@@ -3,6 +3,7 @@
 from typing import Awaitable
 from telegram import Update
 from telegram.ext import CallbackContext
+from bot import locks
 from bot.models import UserData
 
 
@@ -13,11 +14,17 @@ class RetryCommand:
         self.reply_func = reply_func
 
     async def __call__(self, update: Update, context: CallbackContext) -> None:
-        user = UserData(context.user_data)
-        last_message = user.messages.pop()
+        # the answer runs in its own task and takes the user lock there,
+        # so the lock here only covers taking the question from the history
+        async with locks.users.hold(update.effective_user.id):
+            user = UserData(context.user_data)
+            last_message = user.messages.pop()
         if not last_message:
             await update.message.reply_text("No message to retry 🤷‍♂️")
             return
         await self.reply_func(
-            update=update, message=update.message, context=context, question=last_message.question
+            update=update,
+            message=update.message,
+            context=context,
+            question=last_message.question,
         )
@@ -0,0 +1,34 @@
+"""/stats command."""
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.constants import ParseMode
+
+from bot import admission
+from bot import metrics
+
+
+class StatsCommand:
+    """Shows load statistics."""
+
+    async def __call__(self, update: Update, context: CallbackContext) -> None:
+        message = update.message or update.edited_message
+        queue = admission.questions
+        text = (
+            "<pre>"
+            "Questions:\n"
+            f"- running: {queue.n_running}\n"
+            f"- queued: {queue.n_queued}\n"
+            f"- rejected: {queue.n_rejected}"
+            "</pre>"
+        )
+
+        lines = []
+        for name, summary in metrics.snapshot().items():
+            lines.append(
+                f"- {name}: n={summary['count']}, "
+                f"p50={summary['p50']:.1f}, p95={summary['p95']:.1f}, p99={summary['p99']:.1f}"
+            )
+        if lines:
+            text += "\n\n<pre>Timings:\n" + "\n".join(lines) + "</pre>"
+        await message.reply_text(text, parse_mode=ParseMode.HTML)
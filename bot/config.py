@@ -1,11 +1,13 @@
 """Bot configuration parameters."""
 
+from contextvars import ContextVar
 import os
-from typing import Any, Optional
-import yaml
+from typing import Any, Callable, Generic, Optional, TypeVar
 import dataclasses
 from dataclasses import dataclass
 
+T = TypeVar("T")
+
 
 @dataclass
 class Telegram:
@@ -80,12 +82,38 @@ class RateLimit:
 class Conversation:
     depth: int
     message_limit: RateLimit
+    debounce: float
+    max_bytes: int
+    max_tokens: int
+    memory_limit: int
+    reply_chain: int
+    stream_interval: float
 
     default_depth = 3
+    default_max_bytes = 262144
+    default_reply_chain = 128
 
-    def __init__(self, depth: int, message_limit: dict) -> None:
+    def __init__(
+        self,
+        depth: int,
+        message_limit: dict,
+        debounce: float = 0,
+        max_bytes: Optional[int] = None,
+        max_tokens: int = 0,
+        memory_limit: int = 0,
+        reply_chain: Optional[int] = None,
+        stream_interval: float = 0,
+    ) -> None:
         self.depth = depth or self.default_depth
         self.message_limit = RateLimit(**message_limit)
+        self.debounce = max(float(debounce or 0), 0)
+        self.max_bytes = self.default_max_bytes if max_bytes is None else max(int(max_bytes), 0)
+        self.max_tokens = max(int(max_tokens or 0), 0)
+        self.memory_limit = max(int(memory_limit or 0), 0)
+        self.reply_chain = (
+            self.default_reply_chain if reply_chain is None else max(int(reply_chain), 0)
+        )
+        self.stream_interval = max(float(stream_interval or 0), 0)
 
 
 @dataclass
@@ -96,6 +124,213 @@ class Imagine:
         self.enabled = enabled if enabled in ("none", "users_only", "users_and_groups") else "none"
 
 
+@dataclass
+class Fetcher:
+    extractor: str
+    max_tokens: int
+
+    allowed_extractors = ("streaming", "lxml", "soup")
+    default_extractor = "streaming"
+    default_max_tokens = 10000
+
+    def __init__(
+        self, extractor: str = default_extractor, max_tokens: int = default_max_tokens
+    ) -> None:
+        if extractor not in self.allowed_extractors:
+            extractor = self.default_extractor
+        self.extractor = extractor
+        self.max_tokens = max_tokens or self.default_max_tokens
+
+
+@dataclass
+class Workers:
+    threads: int
+    threshold: int
+
+    default_threads = 4
+    default_threshold = 65536
+
+    def __init__(self, threads: int = default_threads, threshold: int = default_threshold) -> None:
+        self.threads = threads or self.default_threads
+        self.threshold = threshold if threshold is not None else self.default_threshold
+
+
+@dataclass
+class Admission:
+    limit: int
+    queue_size: int
+    weights: dict
+
+    default_limit = 32
+    default_queue_size = 128
+
+    def __init__(
+        self,
+        limit: int = default_limit,
+        queue_size: int = default_queue_size,
+        weights: Optional[dict] = None,
+    ) -> None:
+        self.limit = limit if limit is not None else self.default_limit
+        self.queue_size = queue_size if queue_size is not None else self.default_queue_size
+        self.weights = weights or {}
+
+
+@dataclass
+class TelegramLimits:
+    global_rate: float
+    chat_rate: float
+    chat_burst: int
+    group_rate: float
+    group_burst: int
+    max_retries: int
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: int = 3,
+        group_rate: float = 20,
+        group_burst: int = 3,
+        max_retries: int = 3,
+    ) -> None:
+        self.global_rate = global_rate or 30
+        self.chat_rate = chat_rate or 1
+        self.chat_burst = max(chat_burst or 1, 1)
+        self.group_rate = group_rate or 20
+        self.group_burst = max(group_burst or 1, 1)
+        self.max_retries = max_retries if max_retries is not None else 3
+
+
+@dataclass
+class Sharding:
+    workers: int
+
+    def __init__(self, workers: int = 0) -> None:
+        self.workers = workers if workers and workers > 1 else 0
+
+
+@dataclass
+class Webhook:
+    url: str
+    listen: str
+    port: int
+    path: str
+    secret_token: str
+    max_connections: int
+
+    def __init__(
+        self,
+        url: str = "",
+        listen: str = "0.0.0.0",
+        port: int = 8443,
+        path: str = "/telegram",
+        secret_token: str = "",
+        max_connections: int = 40,
+    ) -> None:
+        self.url = url or ""
+        self.listen = listen or "0.0.0.0"
+        self.port = port or 8443
+        self.path = path if path and path.startswith("/") else f"/{path or 'telegram'}"
+        self.secret_token = secret_token or ""
+        # Telegram allows 1-100 connections
+        self.max_connections = min(max(max_connections or 40, 1), 100)
+
+
+@dataclass
+class Shutdown:
+    timeout: float
+
+    def __init__(self, timeout: float = 30) -> None:
+        self.timeout = timeout if timeout is not None and timeout >= 0 else 30
+
+
+@dataclass
+class Deadline:
+    timeout: float
+    chat_types: dict
+    commands: dict
+    fast_model: str
+    fast_below: float
+    tokens_per_second: float
+
+    def __init__(
+        self,
+        timeout: float = 0,
+        chat_types: Optional[dict] = None,
+        commands: Optional[dict] = None,
+        fast_model: str = "",
+        fast_below: float = 0,
+        tokens_per_second: float = 0,
+    ) -> None:
+        # the time to answer a question in seconds, 0 = no limit
+        self.timeout = max(timeout or 0, 0)
+        # overrides by chat type (private, group, supergroup) and by command (imagine, retry)
+        self.chat_types = {name: value for name, value in (chat_types or {}).items() if value}
+        self.commands = {name: value for name, value in (commands or {}).items() if value}
+        # a faster model to switch to when less than `fast_below` seconds are left
+        self.fast_model = fast_model or ""
+        self.fast_below = max(fast_below or 0, 0)
+        # how fast the model generates answers, to cut `max_tokens`; 0 = don't cut
+        self.tokens_per_second = max(tokens_per_second or 0, 0)
+
+
+@dataclass
+class Retention:
+    interval: float
+    unload_after: float
+    ttl: float
+
+    def __init__(self, interval: float = 3600, unload_after: float = 24, ttl: float = 0) -> None:
+        # how often to look for idle data, in seconds, 0 = never
+        self.interval = max(interval or 0, 0)
+        # idle data is removed from memory (but kept in the database) after this many hours
+        self.unload_after = max(unload_after or 0, 0)
+        # idle data is deleted after this many days, 0 = never
+        self.ttl = max(ttl or 0, 0)
+
+
+@dataclass
+class Pipeline:
+    stages: list
+    limits: dict
+    timeouts: dict
+
+    def __init__(
+        self,
+        stages: Optional[list] = None,
+        limits: Optional[dict] = None,
+        timeouts: Optional[dict] = None,
+    ) -> None:
+        # extra stages: {"use": "module:Class", "before": "stage name"}
+        self.stages = [
+            stage if isinstance(stage, dict) else {"use": stage} for stage in stages or []
+        ]
+        # the maximum number of requests in a stage at once, by stage name
+        self.limits = {name: max(int(limit or 0), 0) for name, limit in (limits or {}).items()}
+        # the maximum time a stage may take in seconds, by stage name
+        self.timeouts = {
+            name: max(float(timeout or 0), 0.0) for name, timeout in (timeouts or {}).items()
+        }
+
+
+@dataclass
+class Logging:
+    level: str
+    format: str
+    debug_sample: float
+
+    def __init__(
+        self, level: str = "INFO", format: str = "text", debug_sample: float = 1.0
+    ) -> None:
+        level = (level or "INFO").upper()
+        self.level = level if level in ("DEBUG", "INFO", "WARNING", "ERROR") else "INFO"
+        self.format = format if format in ("text", "json") else "text"
+        # the share of requests to write debug records for
+        self.debug_sample = (
+            min(max(debug_sample, 0.0), 1.0) if debug_sample is not None else 1.0
+        )
+
+
 class Config:
     """Config properties."""
 
@@ -132,12 +367,52 @@ class Config:
         self.conversation = Conversation(
             depth=src["conversation"].get("depth"),
             message_limit=src["conversation"].get("message_limit") or {},
+            debounce=src["conversation"].get("debounce"),
+            max_bytes=src["conversation"].get("max_bytes"),
+            max_tokens=src["conversation"].get("max_tokens"),
+            memory_limit=src["conversation"].get("memory_limit"),
+            reply_chain=src["conversation"].get("reply_chain"),
+            stream_interval=src["conversation"].get("stream_interval"),
         )
 
         # Image generation settings.
         self.imagine = Imagine(enabled=src["imagine"].get("enabled") or "")
 
-        # Where to store the chat context file.
+        # Remote content settings.
+        self.fetcher = Fetcher(**(src.get("fetcher") or {}))
+
+        # Background workers settings.
+        self.workers = Workers(**(src.get("workers") or {}))
+
+        # Limits on the number of questions answered at the same time.
+        self.admission = Admission(**(src.get("admission") or {}))
+
+        # Outgoing Telegram requests limits.
+        self.ratelimit = TelegramLimits(**(src.get("ratelimit") or {}))
+
+        # Update processing across several processes.
+        self.sharding = Sharding(**(src.get("sharding") or {}))
+
+        # Receiving updates through a webhook instead of polling.
+        self.webhook = Webhook(**(src.get("webhook") or {}))
+
+        # Stopping the bot.
+        self.shutdown = Shutdown(**(src.get("shutdown") or {}))
+
+        # Logging.
+        self.logging = Logging(**(src.get("logging") or {}))
+
+        # The time to answer a question.
+        self.deadline = Deadline(**(src.get("deadline") or {}))
+
+        # The stages of answering a question.
+        self.pipeline = Pipeline(**(src.get("pipeline") or {}))
+
+        # Removing idle user and chat data.
+        self.retention = Retention(**(src.get("retention") or {}))
+
+        # Where to store the chat context database.
+        # A legacy pickle file path (*.pkl) maps to a database next to it.
         self.persistence_path = src.get("persistence_path") or "./data/persistence.pkl"
 
         # Custom AI commands (additional prompts).
@@ -151,6 +426,17 @@ class Config:
             "openai": dataclasses.asdict(self.openai),
             "conversation": dataclasses.asdict(self.conversation),
             "imagine": dataclasses.asdict(self.imagine),
+            "fetcher": dataclasses.asdict(self.fetcher),
+            "workers": dataclasses.asdict(self.workers),
+            "admission": dataclasses.asdict(self.admission),
+            "ratelimit": dataclasses.asdict(self.ratelimit),
+            "sharding": dataclasses.asdict(self.sharding),
+            "webhook": dataclasses.asdict(self.webhook),
+            "shutdown": dataclasses.asdict(self.shutdown),
+            "logging": dataclasses.asdict(self.logging),
+            "deadline": dataclasses.asdict(self.deadline),
+            "pipeline": dataclasses.asdict(self.pipeline),
+            "retention": dataclasses.asdict(self.retention),
             "persistence_path": self.persistence_path,
             "shortcuts": self.shortcuts,
         }
@@ -175,11 +461,37 @@ class ConfigEditor:
         "openai",
         "conversation",
         "imagine",
+        "fetcher",
+        "workers",
+        "admission",
+        "ratelimit",
+        "sharding",
+        "webhook",
+        "shutdown",
+        "logging",
+        "deadline",
+        "pipeline",
+        "retention",
         "shortcuts",
     ]
     # Changes made to these properties take effect after a restart.
     delayed = [
         "telegram.token",
+        "workers.threads",
+        "sharding.workers",
+        "webhook.url",
+        "webhook.listen",
+        "webhook.port",
+        "webhook.path",
+        "webhook.secret_token",
+        "webhook.max_connections",
+        "logging.level",
+        "logging.format",
+        "logging.debug_sample",
+        "pipeline.stages",
+        "pipeline.limits",
+        "pipeline.timeouts",
+        "retention.interval",
         "persistence_path",
     ]
     # All editable properties.
@@ -224,6 +536,8 @@ class ConfigEditor:
           - `is_immediate` = True if the change takes effect immediately, False otherwise.
           - `new_val`        is the new value
         """
+        import yaml
+
         try:
             val = yaml.safe_load(value)
         except Exception:
@@ -247,6 +561,14 @@ class ConfigEditor:
                     f"Invalid value for imagine.enabled: {value}. "
                     f"Valid options are: none, users_only, users_and_groups"
                 )
+
+        # Special handling for fetcher.extractor
+        if property == "fetcher.extractor":
+            if value not in Fetcher.allowed_extractors:
+                raise ValueError(
+                    f"Invalid value for fetcher.extractor: {value}. "
+                    f"Valid options are: {', '.join(Fetcher.allowed_extractors)}"
+                )
                 
         # Special handling for conversation.depth
         if property == "conversation.depth":
@@ -293,7 +615,10 @@ class ConfigEditor:
         if names[0] not in self.editable:
             raise ValueError(f"Property {property} is not editable")
 
-        is_immediate = property not in self.delayed
+        # e.g. pipeline.limits.ask takes effect no sooner than pipeline.limits
+        is_immediate = not any(
+            property == name or property.startswith(name + ".") for name in self.delayed
+        )
 
         obj = self.config
         for name in names[:-1]:
@@ -314,6 +639,8 @@ class ConfigEditor:
 
     def save(self) -> None:
         """Saves the config to disk."""
+        import yaml
+
         data = self.config.as_dict()
         with open(self.config.filename, "w") as file:
             yaml.safe_dump(data, file, indent=4, allow_unicode=True)
@@ -408,6 +735,8 @@ class SchemaMigrator:
 
 def load(filename) -> dict:
     """Loads the configuration data dictionary from a file."""
+    import yaml
+
     with open(filename, "r", encoding='utf-8') as f:
         data = yaml.safe_load(f)
 
@@ -418,6 +747,80 @@ def load(filename) -> dict:
     return data
 
 
+class LazyConfig:
+    """
+    The config of the current bot.
+    Loads the default config on first use rather than on import,
+    so that importing the bot modules does not touch the config file.
+    When several bots run in the same process, each one runs
+    in its own context with its own config (see `use`).
+    """
+
+    def __init__(self, filename: str) -> None:
+        object.__setattr__(self, "_filename", filename)
+        object.__setattr__(self, "_config", None)
+
+    def _load(self) -> Config:
+        current = _current.get()
+        if current is not None:
+            return current
+        if self._config is None:
+            object.__setattr__(self, "_config", Config(self._filename, load(self._filename)))
+        return self._config
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._load(), name, value)
+
+
+class PerBot(Generic[T]):
+    """
+    An object that keeps separate state for each bot in the process.
+    Creates an instance per config on first use, and delegates to the instance
+    of the current bot.
+    """
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instances", {})
+
+    def get(self) -> T:
+        """Returns the instance for the current bot."""
+        key = config.filename
+        instance = self._instances.get(key)
+        if instance is None:
+            instance = self._factory()
+            self._instances[key] = instance
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.get(), name, value)
+
+    def __len__(self) -> int:
+        return len(self.get())
+
+
+# The config of the bot running in the current context, if not the default one.
+_current: ContextVar[Optional[Config]] = ContextVar("config", default=None)
+
+
+def current() -> Config:
+    """Returns the config of the current bot itself, rather than a proxy to it."""
+    return config._load()
+
+
+def use(current: Config) -> None:
+    """
+    Makes the config current for the calling task
+    and for the tasks it creates from now on.
+    """
+    _current.set(current)
+
+
 filename = os.getenv("CONFIG", "config.yml")
-_config = load(filename)
-config = Config(filename, _config)
+config = LazyConfig(filename)
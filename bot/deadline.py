@@ -0,0 +1,86 @@
+"""
+Limits the time it takes to answer a question, end to end. The deadline is set
+when the update arrives, depending on the chat type and the command, and every step
+(fetching pages, asking the AI, delivering the answer) gets the remaining time
+instead of a fixed timeout. When time runs short, the bot asks for a shorter answer
+or switches to a faster model. When time runs out, the user gets a "took too long"
+reply instead of a late answer.
+"""
+
+from contextvars import ContextVar
+import time
+from typing import Optional
+
+from bot.config import config
+
+# When the current request should be answered, by the monotonic clock.
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+# The least time worth starting a network request with, in seconds.
+MIN_TIMEOUT = 0.1
+
+
+class Missed(Exception):
+    """Raised when the request runs out of time."""
+
+    def __init__(self) -> None:
+        super().__init__("the request took too long")
+
+
+def start(chat_type: str, command: str = "") -> None:
+    """Sets the deadline for the current request."""
+    settings = config.deadline
+    timeout = settings.commands.get(command) or settings.chat_types.get(chat_type)
+    timeout = timeout or settings.timeout
+    _deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def remaining() -> Optional[float]:
+    """Returns the time left for the current request in seconds, or None if unlimited."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    """Checks if the current request has run out of time."""
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check() -> None:
+    """Raises Missed if the current request has run out of time."""
+    if expired():
+        raise Missed()
+
+
+def timeout(default: Optional[float]) -> Optional[float]:
+    """
+    Returns the timeout for a step of the current request: the default one,
+    or the remaining time if shorter. Raises Missed if no time is left.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left < MIN_TIMEOUT:
+        raise Missed()
+    return min(default, left) if default else left
+
+
+def model(name: str) -> str:
+    """Returns the model to answer with, a faster one if the time is running short."""
+    settings = config.deadline
+    left = remaining()
+    if settings.fast_model and left is not None and left < settings.fast_below:
+        return settings.fast_model
+    return name
+
+
+def max_tokens(n_tokens: int) -> int:
+    """Returns the maximum answer length that the model can generate in the remaining time."""
+    rate = config.deadline.tokens_per_second
+    left = remaining()
+    if not rate or left is None:
+        return n_tokens
+    return max(min(n_tokens, int(left * rate)), 1)
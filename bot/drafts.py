@@ -0,0 +1,87 @@
+"""
+Shows a streamed answer while the AI is still writing it: sends a draft
+message and edits it as new text arrives, at most once per interval.
+The final answer replaces the draft when it is delivered through the outbox.
+"""
+
+import logging
+import time
+from typing import Optional
+
+from telegram import Message
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import TelegramError
+
+from bot import markdown
+from bot import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Draft:
+    """An answer in progress, shown in a single message."""
+
+    def __init__(self, message: Message, interval: float) -> None:
+        self.message = message
+        self.interval = interval
+        # the ids of the draft messages (none or one)
+        self.message_ids: list[int] = []
+        self._renderer = markdown.IncrementalRenderer()
+        self._entry = outbox.Entry.from_message(message, outbox.TEXT, "")
+        self._shown_at: Optional[float] = None
+        # the draft shows only the first message of a long answer,
+        # the rest arrives with the final answer
+        self._is_full = False
+
+    @property
+    def text(self) -> str:
+        """The answer written so far."""
+        return self._renderer.text
+
+    async def feed(self, chunk: str) -> None:
+        """Appends a part of the answer, and updates the draft if it is time to."""
+        html = self._renderer.feed(chunk)
+        if self._is_full or not self.text.strip():
+            return
+        now = time.monotonic()
+        if self._shown_at is not None and now - self._shown_at < self.interval:
+            return
+        self._shown_at = now
+        if len(html) > MessageLimit.MAX_TEXT_LENGTH:
+            html = markdown.split_html(html, MessageLimit.MAX_TEXT_LENGTH)[0]
+            self._is_full = True
+        await self._show(html)
+
+    async def discard(self) -> None:
+        """Deletes the draft of an answer that is not going to be delivered."""
+        bot = self.message.get_bot()
+        for message_id in self.message_ids:
+            try:
+                await bot.delete_message(chat_id=self._entry.chat_id, message_id=message_id)
+            except TelegramError as exc:
+                logger.warning("failed to delete draft=%s: %s", message_id, exc)
+        self.message_ids = []
+
+    async def _show(self, html: str) -> None:
+        """Sends or edits the draft message. A failed update is skipped, not retried."""
+        bot = self.message.get_bot()
+        entry = self._entry
+        try:
+            if self.message_ids:
+                await bot.edit_message_text(
+                    chat_id=entry.chat_id,
+                    message_id=self.message_ids[0],
+                    text=html,
+                    parse_mode=ParseMode.HTML,
+                )
+            else:
+                sent = await bot.send_message(
+                    chat_id=entry.chat_id,
+                    text=html,
+                    parse_mode=ParseMode.HTML,
+                    reply_to_message_id=entry.reply_to_message_id,
+                    message_thread_id=entry.message_thread_id,
+                )
+                self.message_ids = [sent.message_id]
+        except TelegramError as exc:
+            logger.debug("failed to update draft in chat=%s: %s", entry.chat_id, exc)
@@ -0,0 +1,236 @@
+"""Extracts human-readable text from HTML pages."""
+
+import logging
+import re
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+# Elements that never contain readable article text.
+SKIP_TAGS = frozenset(
+    ["script", "style", "noscript", "template", "title", "svg", "nav", "footer", "aside"]
+)
+
+# Elements that start a new line.
+LINE_TAGS = frozenset(["br", "li", "dt", "dd", "tr", "option"])
+
+# Elements that start a new paragraph.
+BLOCK_TAGS = frozenset(
+    [
+        "address",
+        "article",
+        "blockquote",
+        "dl",
+        "div",
+        "figcaption",
+        "figure",
+        "form",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "header",
+        "hr",
+        "main",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "table",
+        "ul",
+    ]
+)
+
+# Raw text elements and comments, removed before tokenizing
+# since the tokenizer would only skip them anyway.
+raw_re = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+space_re = re.compile(r"[^\S\n]+")
+blank_lines_re = re.compile(r"\n{3,}")
+
+
+class Extractor:
+    """Extracts human-readable text from an HTML page."""
+
+    name = ""
+
+    def extract(self, html: str) -> str:
+        """Returns the text of the main page content."""
+        raise NotImplementedError()
+
+
+class StreamingExtractor(Extractor):
+    """
+    Extracts text with a streaming tokenizer from the standard library.
+    Does not build a document tree, skips non-content elements
+    and collapses whitespace on the fly.
+    """
+
+    name = "streaming"
+
+    def extract(self, html: str) -> str:
+        parser = _TextParser()
+        parser.feed(raw_re.sub("", html))
+        parser.close()
+        return parser.text()
+
+
+class LxmlExtractor(Extractor):
+    """Extracts text using the lxml parser (requires the `lxml` package)."""
+
+    name = "lxml"
+
+    def __init__(self) -> None:
+        import lxml.html
+
+        self.parser = lxml.html
+
+    def extract(self, html: str) -> str:
+        if not html.strip():
+            return ""
+        root = self.parser.document_fromstring(html)
+        # removing elements while iterating would skip the ones right after them
+        for elem in list(root.iter(*SKIP_TAGS)):
+            elem.drop_tree()
+        for elem in root.iter(*LINE_TAGS, *BLOCK_TAGS):
+            elem.tail = "\n\n" + (elem.tail or "")
+        article = root.find(".//main")
+        if article is None:
+            article = root.find(".//body")
+        if article is None:
+            article = root
+        return normalize(article.text_content())
+
+
+class SoupExtractor(Extractor):
+    """
+    Extracts text using the BeautifulSoup parser.
+    Keeps the legacy behavior: returns all the text, including scripts and whitespace.
+    """
+
+    name = "soup"
+
+    def __init__(self) -> None:
+        from bs4 import BeautifulSoup
+
+        self.parser = BeautifulSoup
+
+    def extract(self, html: str) -> str:
+        soup = self.parser(html, "html.parser")
+        article = soup.find("main") or soup.find("body")
+        if not article:
+            return ""
+        return article.get_text()
+
+
+class _TextParser(HTMLParser):
+    """HTML tokenizer that collects readable text."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.main_start = None
+        self.main_end = None
+        self.n_skip = 0
+        self.n_pre = 0
+        self.n_newlines = 0
+        self.has_space = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in SKIP_TAGS:
+            self.n_skip += 1
+            return
+        if tag == "main" and self.main_start is None:
+            self.main_start = len(self.parts)
+        elif tag == "pre":
+            self.n_pre += 1
+        self._break(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIP_TAGS:
+            self.n_skip = max(self.n_skip - 1, 0)
+            return
+        if tag == "main" and self.main_end is None:
+            self.main_end = len(self.parts)
+        elif tag == "pre":
+            self.n_pre = max(self.n_pre - 1, 0)
+        self._break(tag)
+
+    def handle_data(self, data: str) -> None:
+        if self.n_skip:
+            return
+        if self.n_pre:
+            self._append(data)
+            return
+        if data[:1].isspace():
+            self.has_space = True
+        text = " ".join(data.split())
+        if text:
+            self._append(text)
+            self.has_space = data[-1:].isspace()
+
+    def text(self) -> str:
+        """Returns the collected text."""
+        if self.main_start is not None:
+            parts = self.parts[self.main_start : self.main_end]
+        else:
+            parts = self.parts
+        return "".join(parts).strip()
+
+    def _break(self, tag: str) -> None:
+        """Starts a new line or paragraph if the tag is a block element."""
+        if self.n_skip:
+            return
+        if tag in BLOCK_TAGS:
+            self.n_newlines = 2
+        elif tag in LINE_TAGS:
+            self.n_newlines = max(self.n_newlines, 1)
+
+    def _append(self, text: str) -> None:
+        """Appends text, preceded by a pending line break or space."""
+        if self.n_newlines:
+            self.parts.append("\n" * self.n_newlines)
+        elif self.has_space:
+            self.parts.append(" ")
+        self.parts.append(text)
+        self.n_newlines = 0
+        self.has_space = False
+
+
+def normalize(text: str) -> str:
+    """Collapses whitespace within lines and removes extra blank lines."""
+    lines = (space_re.sub(" ", line).strip() for line in text.splitlines())
+    text = "\n".join(lines)
+    return blank_lines_re.sub("\n\n", text).strip()
+
+
+_extractors = {
+    StreamingExtractor.name: StreamingExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+    SoupExtractor.name: SoupExtractor,
+}
+_instances: dict[str, Extractor] = {}
+
+
+def get(name: str) -> Extractor:
+    """
+    Returns an extractor by name.
+    Falls back to the streaming extractor if the requested one is not available.
+    """
+    if name in _instances:
+        return _instances[name]
+    if name not in _extractors:
+        raise ValueError(f"Unknown extractor: {name}")
+    try:
+        extractor = _extractors[name]()
+    except ImportError as exc:
+        logger.warning("Extractor %s is not available (%s), using streaming", name, exc)
+        extractor = StreamingExtractor()
+    _instances[name] = extractor
+    return extractor
+
+
+def names() -> list[str]:
+    """Returns the names of known extractors."""
+    return list(_extractors)
@@ -1,8 +1,14 @@
 """Retrieves remote content over HTTP."""
 
+import asyncio
 import re
+from typing import Optional
 import httpx
-from bs4 import BeautifulSoup
+from bot import budget
+from bot import deadline
+from bot import extractors
+from bot import workers
+from bot.config import config
 
 
 class Fetcher:
@@ -15,15 +21,31 @@ class Fetcher:
     def __init__(self):
         self.client = httpx.AsyncClient(follow_redirects=True, timeout=self.timeout)
 
-    async def substitute_urls(self, text: str) -> str:
+    async def substitute_urls(self, text: str, max_tokens: Optional[int] = None) -> str:
         """
         Extracts URLs from text, fetches their contents,
         and appends the contents to the text.
+        If `max_tokens` is set, splits it between the URLs
+        and trims each content to fit its share.
         """
         urls = self._extract_urls(text)
-        for url in urls:
-            content = await self._fetch_url(url)
-            text += f"\n\n---\n{url} contents:\n\n{content}\n---"
+        if not urls:
+            return text
+
+        contents = await asyncio.gather(*(self._fetch_url(url) for url in urls))
+        if max_tokens is None:
+            shares = [None] * len(urls)
+        else:
+            sizes = [budget.count_tokens(content) for content in contents]
+            shares = budget.split(max_tokens, sizes)
+
+        query = self.url_re.sub(" ", text)
+        for url, content, share in zip(urls, contents, shares):
+            if share is not None and budget.count_tokens(content) > share:
+                content = budget.trim(content, share, query=query)
+                text += f"\n\n---\n{url} contents (trimmed):\n\n{content}\n---"
+            else:
+                text += f"\n\n---\n{url} contents:\n\n{content}\n---"
         return text
 
     async def close(self) -> None:
@@ -38,10 +60,14 @@ class Fetcher:
     async def _fetch_url(self, url: str) -> str:
         """Retrieves URL content and returns it as text."""
         try:
-            response = await self.client.get(url)
+            # fetches shrink as the deadline approaches
+            response = await self.client.get(url, timeout=deadline.timeout(self.timeout))
             response.raise_for_status()
             content = Content(response)
-            return content.extract_text()
+            return await workers.run("extract", content.extract_text, size=len(response.content))
+        except deadline.Missed:
+            # the whole question is out of time, not just this page
+            raise
         except Exception as exc:
             class_name = f"{exc.__class__.__module__}.{exc.__class__.__qualname__}"
             return f"Failed to fetch ({class_name})"
@@ -69,9 +95,8 @@ class Content:
             return "Unknown binary content"
         if self.content_type != "text/html":
             return self.response.text
-        html = BeautifulSoup(self.response.text, "html.parser")
-        article = html.find("main") or html.find("body")
-        return article.get_text()
+        extractor = extractors.get(config.fetcher.extractor)
+        return extractor.extract(self.response.text)
 
     def is_text(self) -> bool:
         """Checks if the content type is plain text."""
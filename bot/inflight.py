@@ -0,0 +1,183 @@
+"""
+Keeps track of the answers in progress, so that an answer nobody waits for anymore
+(because the question was edited, superseded by a follow-up, or cancelled by an admin)
+stops right away, AI request included. Also remembers the replies to recent questions,
+so that the answer to an edited question replaces the earlier reply.
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import time
+from typing import Any, Coroutine, Optional
+
+from telegram import Update
+
+from bot import metrics
+from bot.config import PerBot
+
+logger = logging.getLogger(__name__)
+
+# The number of recent questions to remember the replies for.
+MAX_REPLIES = 1024
+
+# A question: chat id and message id.
+Key = tuple[int, int]
+
+
+@dataclass
+class Flight:
+    """An answer in progress."""
+
+    task: asyncio.Task
+    user_id: int
+    question: str
+    # the answer is being delivered, so it is too late to cancel it
+    committed: bool = False
+    cancelled: bool = False
+    # the earlier answer to the same question, to wait for before starting
+    previous: Optional["Flight"] = None
+
+
+class Registry:
+    """Answers in progress and replies to recent questions."""
+
+    def __init__(self, max_replies: int = MAX_REPLIES) -> None:
+        self.max_replies = max_replies
+        self.n_cancelled = 0
+        self._flights: dict[Key, Flight] = {}
+        self._replies: OrderedDict[Key, list[int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: Key, user_id: int, question: str, answer: Coroutine) -> bool:
+        """
+        Answers the question in a separate task that can be cancelled.
+        An answer already in progress for the same question is cancelled
+        (or, if already being delivered, awaited) first.
+        Returns False if the answer was cancelled.
+        """
+        previous = self._flights.get(key)
+        if previous:
+            self._cancel(previous)
+
+        async def start() -> Any:
+            # the earlier answers finish (or get cancelled) first,
+            # including the ones they were waiting for themselves
+            while flight.previous:
+                await asyncio.wait([flight.previous.task])
+                flight.previous = flight.previous.previous
+            return await answer
+
+        # the flight is registered before anything is awaited, so that another
+        # version of the question arriving meanwhile cancels this one
+        flight = Flight(
+            task=asyncio.create_task(start()), user_id=user_id, question=question, previous=previous
+        )
+        # an answer cancelled before it starts is never awaited, so it is closed
+        # explicitly (closing a finished coroutine does nothing)
+        flight.task.add_done_callback(lambda _: answer.close())
+        self._flights[key] = flight
+        try:
+            await flight.task
+            return True
+        except asyncio.CancelledError:
+            if flight.cancelled and flight.task.cancelled():
+                logger.info("cancelled answer to chat=%s, message=%s", *key)
+                return False
+            raise
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def commit(self, key: Key) -> None:
+        """Marks the answer as being delivered, so that it is no longer cancelled."""
+        flight = self._flights.get(key)
+        if flight:
+            flight.committed = True
+
+    def cancel(self, key: Key) -> bool:
+        """Cancels the answer to the question, returns True if there was one."""
+        flight = self._flights.get(key)
+        return self._cancel(flight) if flight else False
+
+    def cancel_chat(self, chat_id: int) -> int:
+        """Cancels all the answers in the chat, returns their number."""
+        flights = [flight for key, flight in self._flights.items() if key[0] == chat_id]
+        return sum(self._cancel(flight) for flight in flights)
+
+    def cancel_all(self) -> int:
+        """Cancels all the answers, returns their number."""
+        return sum(self._cancel(flight) for flight in list(self._flights.values()))
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Waits for the answers in progress to finish, up to the timeout.
+        Cancels the remaining ones and returns their number.
+        Answers already being delivered are not cancelled.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # answers may start while waiting (e.g. for the updates received earlier)
+            tasks = [flight.task for flight in self._flights.values() if not flight.task.done()]
+            remaining = deadline - time.monotonic()
+            if not tasks or remaining <= 0:
+                break
+            await asyncio.wait(tasks, timeout=remaining)
+
+        n_abandoned = 0
+        for key, flight in list(self._flights.items()):
+            if self._cancel(flight):
+                logger.warning("abandoned answer to chat=%s, message=%s", *key)
+                n_abandoned += 1
+        return n_abandoned
+
+    def supersede(self, chat_id: int, user_id: int) -> Optional[str]:
+        """
+        Cancels the user's latest answer in progress in the chat,
+        and returns its question so that the follow-up can include it.
+        """
+        keys = [
+            key
+            for key, flight in self._flights.items()
+            if key[0] == chat_id and flight.user_id == user_id
+        ]
+        if not keys:
+            return None
+        flight = self._flights[max(keys)]
+        if not self._cancel(flight):
+            return None
+        return flight.question
+
+    def remember(self, key: Key, message_ids: list[int]) -> None:
+        """Remembers the replies to the question."""
+        if not message_ids:
+            return
+        self._replies[key] = message_ids
+        self._replies.move_to_end(key)
+        while len(self._replies) > self.max_replies:
+            self._replies.popitem(last=False)
+
+    def replies_to(self, key: Key) -> list[int]:
+        """Returns the replies to the question, if remembered."""
+        return self._replies.get(key, [])
+
+    def _cancel(self, flight: Flight) -> bool:
+        if flight.committed or flight.cancelled or flight.task.done():
+            return False
+        flight.cancelled = True
+        flight.task.cancel()
+        self.n_cancelled += 1
+        metrics.gauge("inflight.cancelled", self.n_cancelled)
+        return True
+
+
+def key_of(update: Update) -> Key:
+    """Returns the key of the question in the update."""
+    return (update.effective_chat.id, update.effective_message.id)
+
+
+# Answers to questions, separate for each bot.
+answers: PerBot[Registry] = PerBot(Registry)
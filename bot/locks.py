@@ -0,0 +1,84 @@
+"""
+Keyed async locks that serialize state changes per user and per chat.
+Updates from different users and chats still run concurrently.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import time
+from typing import AsyncIterator, Hashable, Optional
+import weakref
+
+from bot import metrics
+
+# Locks held by the current task, so that nested sections
+# (e.g. a handler calling a helper that takes the same lock) do not deadlock.
+# Tasks created inside a section copy the context, but not the locks:
+# they run on their own and must wait for the lock like everyone else.
+_held: ContextVar[tuple[Optional[asyncio.Task], frozenset]] = ContextVar(
+    "held_locks", default=(None, frozenset())
+)
+
+
+class KeyedLocks:
+    """
+    A registry of locks, one per key.
+    A lock exists only while someone holds or waits for it,
+    then the registry forgets it.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._locks: weakref.WeakValueDictionary[Hashable, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def is_held(self, key: Hashable) -> bool:
+        """Checks if someone holds the lock for the key."""
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def get(self, key: Hashable) -> asyncio.Lock:
+        """Returns the lock for the key, creating it if necessary."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """
+        Acquires the lock for the key for the duration of the block.
+        Re-entering the block for the same key within a task does not block.
+        Records the time spent waiting for the lock.
+        """
+        task = asyncio.current_task()
+        owner, held = _held.get()
+        if owner is not task:
+            held = frozenset()
+        if (self.name, key) in held:
+            yield
+            return
+
+        # the local variable keeps the lock alive while it is in use
+        lock = self.get(key)
+        start = time.perf_counter()
+        async with lock:
+            metrics.observe(f"locks.{self.name}.wait_ms", (time.perf_counter() - start) * 1e3)
+            token = _held.set((task, held | {(self.name, key)}))
+            try:
+                yield
+            finally:
+                _held.reset(token)
+
+
+# Serializes changes to user data.
+users = KeyedLocks("user")
+
+# Serializes changes to chat data.
+chats = KeyedLocks("chat")
@@ -0,0 +1,136 @@
+"""
+Logging setup. Records are queued and written to stdout by a background thread,
+so that a slow stdout pipe does not block the event loop. Each record carries
+the id of the request (update) it belongs to, and can be written as JSON
+for log collectors. Debug records can be sampled by request to keep the volume down.
+"""
+
+import atexit
+from contextvars import ContextVar
+import copy
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional, TextIO
+import zlib
+
+from bot.config import Logging, config
+
+# The id of the request being processed in the current context.
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Third-party loggers that are too chatty below the warning level.
+QUIET_LOGGERS = ("httpx", "openai")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RequestFilter(logging.Filter):
+    """Adds the current request id to the records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class Sampler(logging.Filter):
+    """
+    Passes only a share of the debug records. Samples by request,
+    so that a request is either logged in full or not at all.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.threshold = int(rate * 1000)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.threshold >= 1000:
+            return True
+        key = getattr(record, "request_id", "-")
+        return zlib.crc32(key.encode()) % 1000 < self.threshold
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the records with the message formatted, but leaves
+    the final formatting (text or JSON) to the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the arguments may change or be unpicklable by the time the record is written
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats the records as JSON lines."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["error"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup(settings: Optional[Logging] = None, stream: TextIO = sys.stdout) -> None:
+    """
+    Configures logging according to the settings (from the config by default)
+    and starts the writer thread. The thread writes the remaining records and stops on exit.
+    """
+    global _listener
+    stop()
+    settings = settings or config.logging
+
+    writer = logging.StreamHandler(stream)
+    if settings.format == "json":
+        writer.setFormatter(JsonFormatter())
+    else:
+        writer.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(RequestFilter())
+    handler.addFilter(Sampler(settings.debug_sample))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    logging.getLogger("bot").setLevel(settings.level)
+    logging.getLogger("__main__").setLevel(settings.level)
+
+    _listener = logging.handlers.QueueListener(records, writer)
+    _listener.start()
+
+
+def stop() -> None:
+    """Writes the queued records and stops the writer thread."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
@@ -2,37 +2,290 @@
 
 import re
 
+# Block-level patterns match at the beginning of a line,
+# including the preceding line break.
+
 # Code blocks, e.g.:
 # ```sql
 # select count(*) from messages;
 # ```
-pre_re = re.compile(r"^[ ]*```\w*$(.+?)^```$", re.MULTILINE | re.DOTALL)
+# An unclosed block lasts until the end of the text.
+pre_pattern = (
+    r"\n[ ]*```[\w+#.-]*[ ]*(?=\n|\Z)"
+    # line by line rather than char by char, up to the closing fence
+    r"(?P<pre>(?:\n(?![ ]*```[ ]*(?:\n|\Z))[^\n]*)*)"
+    r"(?:(?P<close>\n[ ]*```[ ]*(?=\n|\Z))|\Z)"
+)
+
+# Headings, e.g.:
+# ## Installation
+# The optional closing hashes are removed when rendering.
+heading_pattern = r"\n#{1,6}[ ]+(?P<heading>[^ \n][^\n]*)"
+
+# Unordered list items, possibly nested, e.g.:
+# *   Wake up.
+# *   Have breakfast:
+#     - eggs,
+#     - coffee.
+bullet_pattern = r"\n(?P<bullet>[ ]*)[*+-][ ]+(?=\S)"
 
-# Inline code, e.g.:
+# Inline patterns:
 # `print(message)` displays the message.
-code_re = re.compile(r"`([^`\n]+)`")
+# **Note**. Cats **do** like boxes, *really **do***.
+# Cats *really* like boxes. Or _maybe_ not.
+# See [Documentation](https://github.com/nalgeon/sqlean) for reference.
+# Bold text may contain italic text and vice versa.
+# As in CommonMark, an opening marker is not followed by a space,
+# and a closing one is not preceded by a space: "a ** b ** c" stays as is.
+# Every pattern starts with a literal character,
+# so the regex engine quickly skips the plain text between them.
+# Runs of plain characters are matched as a whole rather than
+# one alternative per character, which keeps backtracking cheap.
+inline_pattern = (
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*(?!\s)(?P<bold>[^*\n]+(?:\*[^*\n]+\*[^*\n]*)*)(?<!\s)\*\*"
+    r"|\*(?<![\w*]\*)(?P<italic>[^*\s][^*\n]*(?:\*\*[^*\n]+\*\*[^*\n]*)*)(?<!\s)\*(?![\w*])"
+    r"|_(?<!\w_)(?P<underscore>[^_\s](?:[^_\n]*[^_\s])?)_(?!\w)"
+    r"|\[(?P<text>[^\]\n]+)\]\((?P<url>[^()\s]+)\)"
+)
 
-# Bold text, e.g.:
-# **Note**. Cats **do** like boxes.
-bold_re = re.compile(r"\*\*([^*]+?)\*\*")
+# Matches every token that needs converting, so the text is scanned only once.
+# Everything between the tokens is copied as is.
+token_re = re.compile(f"{pre_pattern}|{heading_pattern}|{bullet_pattern}|{inline_pattern}")
+inline_re = re.compile(inline_pattern)
 
-# Unordered list items, e.g.:
-# *   Wake up.
-# *   Have breakfast.
-# *   Go to work.
-bullet_re = re.compile(r"^\*\s\s+(.+)$", re.MULTILINE)
+# HTML tags produced by the renderer.
+tag_re = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+# Code block fence lines, used to find the boundaries of code blocks.
+fence_re = re.compile(r"^[ ]*```(?P<lang>[\w+#.-]*)[ ]*$", re.MULTILINE)
+
+# Bullet marker and indentation for list items.
+BULLET = "— "
+INDENT = "  "
 
 
 def to_html(text: str) -> str:
     """
     Converts Markdown text to "Telegram HTML", which supports only some of the tags.
     See https://core.telegram.org/bots/api#html-style for details.
-    Escapes certain entities and converts `code` and `pre`,
+    Escapes certain entities and converts code blocks, inline code,
+    bold and italic text, links, headings and lists,
     but ignores all other formatting.
     """
+    # none of the patterns match the entities, so the whole text is escaped
+    # upfront instead of token by token. The regex engine then copies the text
+    # between the tokens itself: collecting the escaped pieces and the tokens
+    # in a list and joining it once is 1.2-1.8x slower (see benchmarks/markdown.py)
     text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-    text = pre_re.sub(r"<pre>\1</pre>", text)
-    text = code_re.sub(r"<code>\1</code>", text)
-    text = bold_re.sub(r"<b>\1</b>", text)
-    text = bullet_re.sub(r"— \1", text)
-    return text
+    # the leading line break lets block-level patterns match the first line,
+    # and is removed from the output afterwards
+    return token_re.sub(_render_token, "\n" + text)[1:]
+
+
+def _render_inline(text: str) -> str:
+    """Converts text inside formatting tags to HTML."""
+    return inline_re.sub(_render_token, text)
+
+
+def _render_token(match: re.Match) -> str:
+    """
+    Converts a single matched token to HTML. The regex engine copies
+    the text between the tokens, so there is no Python code per plain chunk.
+    """
+    kind = match.lastgroup
+    if kind == "code":
+        return f"<code>{match.group('code')}</code>"
+    elif kind == "bold":
+        return f"<b>{_render_inline(match.group('bold'))}</b>"
+    elif kind == "bullet":
+        level = len(match.group("bullet")) // len(INDENT)
+        return "\n" + INDENT * level + BULLET
+    elif kind == "italic" or kind == "underscore":
+        return f"<i>{_render_inline(match.group(kind))}</i>"
+    elif kind == "url":
+        url = match.group("url").replace('"', "&quot;")
+        return f'<a href="{url}">{_render_inline(match.group("text"))}</a>'
+    elif kind == "heading":
+        heading = match.group("heading").rstrip(" ")
+        closed = heading.rstrip("#")
+        if closed.endswith(" "):
+            # the closing hashes, e.g. "## Installation ##"
+            heading = closed.rstrip(" ")
+        return f"\n<b>{_render_inline(heading)}</b>"
+    else:
+        # a code block, closed or not
+        pre = match.group("pre")
+        return f"\n<pre>{pre}\n</pre>" if kind == "close" else f"\n<pre>{pre}</pre>"
+
+
+class IncrementalRenderer:
+    """
+    Converts Markdown text that arrives in chunks (e.g. a streamed answer) to HTML.
+    Keeps the HTML of the text up to the last paragraph break outside code blocks,
+    and re-renders only the text after it.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        # the part of the text that has already been converted
+        self.n_done = 0
+        self.html = ""
+
+    def feed(self, chunk: str) -> str:
+        """Appends a chunk of Markdown text and returns the HTML of the whole text."""
+        self.text += chunk
+        tail = self.text[self.n_done :]
+        boundary = _find_boundary(tail)
+        if boundary:
+            self.html += to_html(tail[:boundary])
+            self.n_done += boundary
+            tail = tail[boundary:]
+        return self.html + to_html(tail)
+
+
+def _find_boundary(text: str) -> int:
+    """
+    Returns the position right after the last paragraph break outside code blocks,
+    or zero if there is none. No formatting token spans such a break,
+    so the text before and after it can be converted separately.
+    """
+    boundary = 0
+    in_pre = False
+    pos = 0
+    for match in fence_re.finditer(text):
+        if in_pre and match.group("lang"):
+            # not a closing fence
+            continue
+        if not in_pre:
+            idx = text.rfind("\n\n", pos, match.start())
+            if idx >= 0:
+                boundary = idx + 2
+        in_pre = not in_pre
+        pos = match.end()
+    if not in_pre:
+        idx = text.rfind("\n\n", pos)
+        if idx >= 0:
+            boundary = idx + 2
+    return boundary
+
+
+def split_html(html: str, limit: int) -> list[str]:
+    """
+    Splits HTML text into chunks no longer than `limit` characters.
+    Prefers to split on paragraph breaks and code block boundaries,
+    then on line breaks and spaces. Closes the tags that are open
+    at the end of a chunk, and reopens them at the beginning of the next one.
+    """
+    chunks = []
+    # the tags open at the beginning of the rest of the text
+    open_tags = []
+    reopen = ""
+    while len(reopen) + len(html) > limit:
+        closing_size = sum(len(name) + 3 for name, _ in open_tags)
+        if len(reopen) + closing_size > limit // 2:
+            # the tags take too much room to repeat in every chunk
+            # (e.g. a very long link), so the rest of the text goes without them
+            html = _drop_closing(html, [name for name, _ in open_tags])
+            open_tags, reopen = [], ""
+            continue
+        # the tags opened within the chunk need closing too,
+        # so the budget shrinks until the chunk fits
+        budget = limit - len(reopen) - closing_size
+        while True:
+            cut = _find_cut(html, budget)
+            piece = reopen + html[:cut]
+            tags = _find_open_tags(piece)
+            chunk = piece.rstrip() + "".join(f"</{name}>" for name, _ in reversed(tags))
+            if len(chunk) <= limit or budget <= 1:
+                break
+            budget = max(budget - (len(chunk) - limit), 1)
+        chunks.append(chunk)
+        open_tags = tags
+        reopen = "".join(tag for _, tag in open_tags)
+        html = html[cut:].lstrip("\n" if not open_tags else "")
+    if html.strip():
+        chunks.append(reopen + html)
+    return chunks
+
+
+def _find_cut(html: str, budget: int) -> int:
+    """Returns the best position to split the text at, not farther than `budget`."""
+    window = html[:budget]
+    min_pos = budget // 2
+
+    # a paragraph break outside code blocks
+    pos = window.rfind("\n\n")
+    while pos >= min_pos:
+        if window.count("<pre>", 0, pos) == window.count("</pre>", 0, pos):
+            return pos + 1
+        pos = window.rfind("\n\n", 0, pos)
+
+    # a code block boundary
+    pos = max(window.rfind("\n<pre>"), window.rfind("</pre>\n") + len("</pre>"))
+    if pos >= min_pos:
+        return pos + 1
+
+    # a line break, possibly inside a code block
+    pos = window.rfind("\n")
+    if pos >= min_pos:
+        return pos + 1
+
+    # a space outside tags
+    pos = window.rfind(" ")
+    while pos >= min_pos and _is_inside_tag(window, pos):
+        pos = window.rfind(" ", 0, pos)
+    if pos >= min_pos:
+        return pos + 1
+
+    # anywhere outside tags and entities
+    pos = budget
+    tag_start = window.rfind("<")
+    if tag_start > window.rfind(">"):
+        pos = tag_start
+    entity_start = window.rfind("&", 0, pos)
+    if entity_start > window.rfind(";", 0, pos):
+        pos = entity_start
+    return max(pos, 1)
+
+
+def _find_open_tags(html: str) -> list[tuple[str, str]]:
+    """Returns the tags that are open at the end of the text, as (name, opening tag) pairs."""
+    stack = []
+    for match in tag_re.finditer(html):
+        is_closing, name = match.groups()
+        if not is_closing:
+            stack.append((name, match.group()))
+        elif stack and stack[-1][0] == name:
+            stack.pop()
+    return stack
+
+
+def _drop_closing(html: str, names: list[str]) -> str:
+    """
+    Removes the closing tags of the elements that are open before the text,
+    given their names from the outermost to the innermost.
+    """
+    names = list(names)
+    nested = []
+    parts = []
+    pos = 0
+    for match in tag_re.finditer(html):
+        if not names:
+            break
+        is_closing, name = match.groups()
+        if not is_closing:
+            nested.append(name)
+        elif nested and nested[-1] == name:
+            nested.pop()
+        elif name == names[-1]:
+            parts.append(html[pos : match.start()])
+            pos = match.end()
+            names.pop()
+    parts.append(html[pos:])
+    return "".join(parts)
+
+
+def _is_inside_tag(html: str, pos: int) -> bool:
+    """Checks if the position is inside an HTML tag."""
+    return html.rfind("<", 0, pos) > html.rfind(">", 0, pos)
@@ -0,0 +1,79 @@
+"""
+Keeps the total size of the users' histories under the configured ceiling.
+When the bot is about to take more memory than allowed, it unloads
+the data of the least recently active users first. The data stays
+in the database and is loaded back when the user returns.
+"""
+
+from collections import OrderedDict
+import logging
+from typing import Mapping, Optional
+
+from telegram.ext import Application
+
+from bot import locks
+from bot import metrics
+from bot.config import PerBot, config
+from bot.models import UserData
+
+logger = logging.getLogger(__name__)
+
+
+class Memory:
+    """The users' histories, from the least to the most recently active."""
+
+    def __init__(self) -> None:
+        # unloads the data, keeping it in the persistence;
+        # without it the histories are never evicted
+        self.application: Optional[Application] = None
+        self.n_evicted = 0
+        self._users: OrderedDict[int, tuple[Mapping, int]] = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        """The (approximate) number of bytes the histories take."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def touch(self, user_id: int, data: Mapping) -> None:
+        """
+        Marks the user as the most recently active one and accounts
+        for the size of their history. Unloads the data
+        of other users if the total size exceeds the limit.
+        """
+        _, old_size = self._users.pop(user_id, (None, 0))
+        size = UserData(data).messages.size
+        self._users[user_id] = (data, size)
+        self._size += size - old_size
+        self._evict(keep=user_id)
+        metrics.gauge("memory.history_bytes", self._size)
+        metrics.gauge("memory.n_users", len(self._users))
+
+    def forget(self, user_id: int) -> None:
+        """Stops tracking the user (e.g. when their data is deleted or unloaded)."""
+        _, size = self._users.pop(user_id, (None, 0))
+        self._size -= size
+
+    def _evict(self, keep: int) -> None:
+        limit = config.conversation.memory_limit * 1024 * 1024
+        if not limit or not self.application:
+            return
+        for user_id in list(self._users):
+            if self._size <= limit:
+                break
+            if user_id == keep or locks.users.is_held(user_id):
+                # an answer in progress still changes the data
+                continue
+            _, size = self._users.pop(user_id)
+            self._size -= size
+            self.application.unload_user_data(user_id)
+            self.n_evicted += 1
+            metrics.gauge("memory.n_evicted", self.n_evicted)
+            logger.info("unloaded the data of user %s, %s bytes", user_id, size)
+
+
+# The histories of each bot's users.
+histories: PerBot[Memory] = PerBot(Memory)
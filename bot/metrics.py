@@ -0,0 +1,72 @@
+"""Runtime metrics collected in memory."""
+
+from collections import deque
+import math
+
+
+class Summary:
+    """Tracks the number, total and recent values of an observed quantity."""
+
+    def __init__(self, size: int = 1024) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.values = deque(maxlen=size)
+
+    def observe(self, value: float) -> None:
+        """Records an observed value."""
+        self.count += 1
+        self.total += value
+        self.values.append(value)
+
+    @property
+    def mean(self) -> float:
+        """The mean of all the observed values."""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Returns the given percentile (0-100) of the recent values."""
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        idx = math.ceil(pct / 100 * len(values)) - 1
+        return values[min(max(idx, 0), len(values) - 1)]
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 3),
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+        }
+
+
+_summaries: dict[str, Summary] = {}
+_gauges: dict[str, float] = {}
+
+
+def observe(name: str, value: float) -> None:
+    """Records an observed value of the named quantity."""
+    summary(name).observe(value)
+
+
+def summary(name: str) -> Summary:
+    """Returns the summary of the named quantity."""
+    if name not in _summaries:
+        _summaries[name] = Summary()
+    return _summaries[name]
+
+
+def gauge(name: str, value: float) -> None:
+    """Sets the current value of the named quantity."""
+    _gauges[name] = value
+
+
+def gauges() -> dict[str, float]:
+    """Returns the current values of all the gauges."""
+    return dict(sorted(_gauges.items()))
+
+
+def snapshot() -> dict[str, dict]:
+    """Returns all the summaries as dictionaries."""
+    return {name: summary.as_dict() for name, summary in sorted(_summaries.items())}
@@ -1,16 +1,42 @@
 """Bot data models."""
 
-from collections import deque
+from collections import Counter, OrderedDict, deque
 import datetime as dt
-from typing import Generic, Mapping, NamedTuple, Optional, TypeVar
+import hashlib
+import re
+import time
+from typing import Any, Generic, Iterator, Mapping, Optional, TypeVar, Union
+import zlib
+from bot.budget import count_tokens
 from bot.config import config
 
 T = TypeVar("T")
 
+# Text, or text compressed with zlib.
+Text = Union[str, bytes]
+
+# The number of latest messages in the history that are not compressed.
+N_PLAIN_MESSAGES = 1
+
+# Shorter texts are not worth compressing.
+MIN_COMPRESS_SIZE = 256
+
+# Documents inlined in the questions (see questions._extract_document_text).
+document_re = re.compile(r"(:\n```\n)(.*?)(\n```)", re.DOTALL)
+
+# Shorter documents are kept in the question.
+MIN_BLOB_SIZE = 16384
+
+# A reference to a document stored separately from the message.
+BLOB_REF = "\x00blob:{}\x00"
+blob_ref_re = re.compile(r"\x00blob:([0-9a-f]{16})\x00")
+
 
 class ChatData:
     """Represents data associated with a specific chat."""
 
+    __slots__ = ("data",)
+
     def __init__(self, data: Mapping):
         # data should be a 'chat data' mapping from the chat context
         self.data = data
@@ -33,7 +59,12 @@ class ChatData:
 
 
 class UserData:
-    """Represents data associated with a specific user."""
+    """
+    Represents data associated with a specific user.
+    Wraps the persisted mapping without copying it, so it is cheap to create.
+    """
+
+    __slots__ = ("data", "messages", "message_counter")
 
     def __init__(self, data: Mapping):
         # data should be a 'user data' mapping from the chat context
@@ -43,46 +74,246 @@ class UserData:
         message_count = TimestampedValue(data, name="message_counter", initial=0)
         self.message_counter = ExpiringCounter(message_count, period=period)
 
+    @property
+    def last_active(self) -> int:
+        """When the user last asked a question, in epoch seconds (0 if unknown)."""
+        return self.data.get("last_active") or 0
+
+    def touch(self) -> None:
+        """Marks the user as active right now."""
+        self.data["last_active"] = int(time.time())
 
-class UserMessage(NamedTuple):
-    """Represents a question and an answer to it."""
+    @staticmethod
+    def compact(data: dict) -> bool:
+        """
+        Removes the parts of the user data that carry no information:
+        an expired message counter and an empty history.
+        Returns True if anything was removed.
+        """
+        size = len(data)
+        stored = data.get("message_counter")
+        if stored is not None:
+            period = parse_period(value=1, period=config.conversation.message_limit.period)
+            counter = ExpiringCounter(TimestampedValue(data, name="message_counter"), period)
+            if counter.is_expired():
+                del data["message_counter"]
+        if "messages" in data and not data["messages"]:
+            del data["messages"]
+            data.pop("blobs", None)
+        return len(data) < size
+
+
+class UserMessage:
+    """
+    Represents a question and an answer to it.
+    Older messages are kept compressed, and decompressed on access.
+    """
+
+    __slots__ = ("_question", "_answer", "n_tokens", "_blobs")
+
+    def __new__(
+        cls,
+        question: Text,
+        answer: Text,
+        n_tokens: Optional[int] = None,
+        blobs: Optional[tuple[str, ...]] = None,
+    ) -> "UserMessage":
+        # older versions stored messages as named tuples,
+        # which unpickle by calling __new__ with the fields
+        self = super().__new__(cls)
+        self._question = question
+        self._answer = answer
+        self.n_tokens = n_tokens
+        self._blobs = blobs
+        return self
 
-    question: str
-    answer: str
+    @property
+    def question(self) -> str:
+        return _decompress(self._question)
+
+    @property
+    def answer(self) -> str:
+        return _decompress(self._answer)
+
+    @property
+    def blobs(self) -> tuple[str, ...]:
+        """The keys of the documents the question refers to."""
+        if self._blobs is None:
+            # messages stored by older versions
+            self._blobs = tuple(blob_ref_re.findall(self.question))
+        return self._blobs
+
+    @property
+    def size(self) -> int:
+        """The (approximate) number of bytes the message takes."""
+        return len(self._question) + len(self._answer)
+
+    @property
+    def is_compressed(self) -> bool:
+        return isinstance(self._question, bytes) or isinstance(self._answer, bytes)
+
+    def compress(self) -> None:
+        """Compresses the question and the answer, unless they are too short to bother."""
+        if self.n_tokens is None:
+            self.n_tokens = count_tokens(self.question) + count_tokens(self.answer)
+        self._question = _compress(self._question)
+        self._answer = _compress(self._answer)
+
+    def __reduce__(self) -> tuple:
+        return (UserMessage, (self._question, self._answer, self.n_tokens, self._blobs))
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.question
+        yield self.answer
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (UserMessage, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"UserMessage(question={self.question!r}, answer={self.answer!r})"
 
 
 class UserMessages:
-    """Represents user message history."""
+    """
+    Represents user message history.
+    The history is bounded by the conversation depth, size and tokens.
+    Large documents in the questions are stored once, separately from the messages.
+    """
+
+    __slots__ = ("data", "messages")
 
     def __init__(self, data: Mapping, maxlen: int) -> None:
-        messages = data.get("messages") or []
-        data["messages"] = deque(messages, maxlen)
+        messages = data.get("messages")
+        if not isinstance(messages, deque) or messages.maxlen != maxlen:
+            # the history is new, or the conversation depth has changed
+            messages = deque(messages or [], maxlen)
+            data["messages"] = messages
         self.data = data
-        self.messages = data["messages"]
+        self.messages = messages
 
     @property
     def last(self) -> Optional[UserMessage]:
         """The latest chat message (if any)."""
         if not self.messages:
             return None
-        return self.messages[-1]
+        return self._expand(self.messages[-1])
+
+    @property
+    def size(self) -> int:
+        """The (approximate) number of bytes the history takes."""
+        blobs = self.data.get("blobs") or {}
+        return sum(message.size for message in self.messages) + sum(
+            len(blob) for blob in blobs.values()
+        )
+
+    @property
+    def n_tokens(self) -> int:
+        """The number of tokens in the history, documents included."""
+        return sum(_n_tokens_of(message) for message in self.messages)
 
     def add(self, question: str, answer: str):
         """Adds a message to the message history."""
-        self.messages.append(UserMessage(question, answer))
+        n_tokens = count_tokens(question) + count_tokens(answer)
+        blobs = []
+        question = self._store_blobs(question, blobs)
+        self.messages.append(UserMessage(question, answer, n_tokens, tuple(blobs)))
+        # the latest messages are the most likely to be needed, keep them as they are
+        for idx in range(len(self.messages) - N_PLAIN_MESSAGES):
+            self.messages[idx].compress()
+        self._shrink()
 
     def pop(self) -> Optional[UserMessage]:
         """Removes the last message from the message history and returns it."""
         if not self.messages:
             return None
-        return self.messages.pop()
+        message = self._expand(self.messages.pop())
+        self._collect_blobs()
+        return message
 
     def clear(self):
         """Cleares messages history."""
         self.messages.clear()
+        self.data.pop("blobs", None)
+
+    def as_list(self) -> list[tuple[str, str]]:
+        return [
+            (self._expand_text(message.question), message.answer) for message in self.messages
+        ]
 
-    def as_list(self):
-        return list(self.messages)
+    def _store_blobs(self, text: str, keys: list[str]) -> str:
+        """
+        Moves large documents out of the text, replacing them with references.
+        Adds the keys of the documents to `keys`.
+        """
+
+        def store(match: re.Match) -> str:
+            content = match.group(2)
+            if len(content) < MIN_BLOB_SIZE:
+                return match.group(0)
+            key = hashlib.sha1(content.encode()).hexdigest()[:16]
+            blobs = self.data.setdefault("blobs", {})
+            if key not in blobs:
+                blobs[key] = zlib.compress(content.encode())
+            keys.append(key)
+            return f"{match.group(1)}{BLOB_REF.format(key)}{match.group(3)}"
+
+        return document_re.sub(store, text)
+
+    def _expand(self, message: UserMessage) -> UserMessage:
+        """Returns the message with the documents in place of their references."""
+        if not self.data.get("blobs"):
+            return message
+        return UserMessage(self._expand_text(message.question), message.answer)
+
+    def _expand_text(self, text: str) -> str:
+        blobs = self.data.get("blobs")
+        if not blobs:
+            return text
+
+        def load(match: re.Match) -> str:
+            blob = blobs.get(match.group(1))
+            return zlib.decompress(blob).decode() if blob else "(document is no longer available)"
+
+        return blob_ref_re.sub(load, text)
+
+    def _shrink(self) -> None:
+        """Removes the oldest messages until the history fits the size and token limits."""
+        max_bytes = config.conversation.max_bytes
+        max_tokens = config.conversation.max_tokens
+        if max_bytes or max_tokens:
+            # keep the totals up to date instead of recounting after each removal
+            blobs = self.data.get("blobs") or {}
+            n_refs = Counter(key for message in self.messages for key in message.blobs)
+            size = sum(message.size for message in self.messages)
+            size += sum(len(blobs[key]) for key in n_refs if key in blobs)
+            n_tokens = self.n_tokens
+            while len(self.messages) > 1 and (
+                (max_bytes and size > max_bytes) or (max_tokens and n_tokens > max_tokens)
+            ):
+                message = self.messages.popleft()
+                size -= message.size
+                n_tokens -= _n_tokens_of(message)
+                for key in message.blobs:
+                    n_refs[key] -= 1
+                    if not n_refs[key] and key in blobs:
+                        size -= len(blobs[key])
+        # the depth limit may have removed a message as well
+        self._collect_blobs()
+
+    def _collect_blobs(self) -> None:
+        """Removes the documents no longer referenced by the messages."""
+        blobs = self.data.get("blobs")
+        if not blobs:
+            return
+        used = set()
+        for message in self.messages:
+            used.update(message.blobs)
+        for key in blobs.keys() - used:
+            del blobs[key]
+        if not blobs:
+            del self.data["blobs"]
 
     def __str__(self) -> str:
         return str(self.messages)
@@ -91,34 +322,162 @@ class UserMessages:
         return repr(self.messages)
 
 
+class ChainLink:
+    """A message in a reply chain: its text, who sent it, and the message it replies to."""
+
+    __slots__ = ("parent", "is_bot", "_text")
+
+    def __new__(cls, parent: Optional[int], is_bot: bool, text: Text) -> "ChainLink":
+        self = super().__new__(cls)
+        self.parent = parent
+        self.is_bot = is_bot
+        self._text = text
+        return self
+
+    @property
+    def text(self) -> str:
+        return _decompress(self._text)
+
+    def __reduce__(self) -> tuple:
+        return (ChainLink, (self.parent, self.is_bot, self._text))
+
+    def __repr__(self) -> str:
+        return f"ChainLink(parent={self.parent}, is_bot={self.is_bot}, text={self.text!r})"
+
+
+class ReplyChains:
+    """
+    Recent questions and answers in a chat, by message id, along with the messages
+    they reply to. Follows the replies back to rebuild the conversation
+    that a message belongs to. Only the most recently used messages are kept.
+    """
+
+    __slots__ = ("links", "maxlen")
+
+    def __init__(self, data: Mapping, maxlen: int) -> None:
+        links = data.get("replies")
+        if not isinstance(links, OrderedDict):
+            links = OrderedDict()
+            data["replies"] = links
+        self.links = links
+        self.maxlen = maxlen
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+    def add_question(self, message_id: int, parent: Optional[int], text: str) -> None:
+        """Remembers a question and the message it replies to."""
+        self._add(message_id, ChainLink(parent, False, _compress(text)))
+
+    def add_answer(self, message_ids: list[int], question_id: int, text: str) -> None:
+        """
+        Remembers an answer to a question. A long answer takes several messages,
+        so each of them leads to the previous one, and the first one to the question.
+        """
+        parent = question_id
+        for idx, message_id in enumerate(message_ids):
+            self._add(message_id, ChainLink(parent, True, _compress(text) if idx == 0 else ""))
+            parent = message_id
+
+    def history(self, message_id: int, max_tokens: int, depth: int) -> list[tuple[str, str]]:
+        """
+        Returns the conversation that ends with the message, as (question, answer) pairs,
+        oldest first. Takes as many of the latest messages as fit into max_tokens,
+        and no more than depth pairs.
+        """
+        links = []
+        n_tokens = 0
+        seen = set()
+        while message_id is not None and message_id not in seen:
+            link = self.links.get(message_id)
+            if link is None:
+                break
+            seen.add(message_id)
+            self.links.move_to_end(message_id)
+            text = link.text
+            if text:
+                n_tokens += count_tokens(text)
+                if n_tokens > max_tokens:
+                    break
+                links.append(link)
+            message_id = link.parent
+
+        pairs = []
+        question = None
+        for link in reversed(links):
+            if not link.is_bot:
+                if question is not None:
+                    # a question without an answer
+                    pairs.append((question, ""))
+                question = link.text
+            else:
+                pairs.append((question or "", link.text))
+                question = None
+        return pairs[-depth:] if depth else pairs
+
+    def _add(self, message_id: int, link: ChainLink) -> None:
+        self.links[message_id] = link
+        self.links.move_to_end(message_id)
+        while len(self.links) > self.maxlen:
+            self.links.popitem(last=False)
+
+
+class Stamped:
+    """A persisted value along with the time it was last changed (epoch seconds)."""
+
+    __slots__ = ("value", "timestamp")
+
+    def __new__(cls, value: Any, timestamp: int) -> "Stamped":
+        self = super().__new__(cls)
+        self.value = value
+        self.timestamp = timestamp
+        return self
+
+    def __reduce__(self) -> tuple:
+        return (Stamped, (self.value, self.timestamp))
+
+    def __repr__(self) -> str:
+        return f"Stamped(value={self.value!r}, timestamp={self.timestamp})"
+
+
 class TimestampedValue(Generic[T]):
     """A value with a 'last modified' timestamp."""
 
+    __slots__ = ("_data",)
+
     def __init__(self, data: Mapping, name: str, initial: Optional[T] = None) -> None:
-        if name not in data:
-            data[name] = {"value": initial, "timestamp": dt.datetime.now()}
-        self._data = data[name]
+        stored = data.get(name)
+        if stored is None:
+            stored = Stamped(initial, int(time.time()))
+            data[name] = stored
+        elif isinstance(stored, dict):
+            # older versions stored {"value": ..., "timestamp": datetime}
+            stored = Stamped(stored["value"], int(stored["timestamp"].timestamp()))
+            data[name] = stored
+        self._data = stored
 
     @property
     def value(self) -> T:
         """Returns the value."""
-        return self._data["value"]
+        return self._data.value
 
     @value.setter
     def value(self, value: T) -> None:
         """Sets the value."""
-        self._data["value"] = value
-        self._data["timestamp"] = dt.datetime.now()
+        self._data.value = value
+        self._data.timestamp = int(time.time())
 
     @property
-    def timestamp(self) -> dt.datetime:
-        """Returns the date and time of the last modification."""
-        return self._data["timestamp"]
+    def timestamp(self) -> int:
+        """Returns the time of the last modification, in epoch seconds."""
+        return self._data.timestamp
 
 
 class ExpiringCounter:
     """A counter that expires after a given period of time."""
 
+    __slots__ = ("_data", "period")
+
     def __init__(self, data: TimestampedValue, period: dt.timedelta) -> None:
         self._data = data
         self.period = period
@@ -130,7 +489,7 @@ class ExpiringCounter:
 
     def is_expired(self) -> bool:
         """Checks if the counter value has expired."""
-        return dt.datetime.now() > self._data.timestamp + self.period
+        return time.time() > self._data.timestamp + self.period.total_seconds()
 
     def expires_after(self) -> dt.timedelta:
         """
@@ -140,7 +499,8 @@ class ExpiringCounter:
         """
         if self.is_expired():
             return dt.timedelta(0)
-        return self._data.timestamp + self.period - dt.datetime.now()
+        seconds = self._data.timestamp + self.period.total_seconds() - time.time()
+        return dt.timedelta(seconds=seconds)
 
     def increment(self) -> int:
         """Increments and returns the counter value."""
@@ -150,6 +510,25 @@ class ExpiringCounter:
         return self._data.value
 
 
+def _compress(text: Text) -> Text:
+    if isinstance(text, bytes) or len(text) < MIN_COMPRESS_SIZE:
+        return text
+    return zlib.compress(text.encode())
+
+
+def _decompress(text: Text) -> str:
+    if isinstance(text, bytes):
+        return zlib.decompress(text).decode()
+    return text
+
+
+def _n_tokens_of(message: UserMessage) -> int:
+    if message.n_tokens is None:
+        # messages stored by older versions
+        message.n_tokens = count_tokens(message.question) + count_tokens(message.answer)
+    return message.n_tokens
+
+
 def parse_period(value: int, period: str) -> dt.timedelta:
     """Creates a timedelta from a time period description."""
     if value < 0:
@@ -0,0 +1,99 @@
+"""
+Runs several bots in one process, one for each config file.
+The bots share the event loop, the AI and fetcher connection pools,
+the worker threads and the action scheduler, which costs much less memory
+than a separate process for each bot. Each bot keeps its own config,
+persistence, outbox and limits.
+
+Usage example:
+$ python -m bot.multibot config.first.yml config.second.yml
+"""
+
+import asyncio
+import logging
+import signal
+import sys
+
+from telegram import Update
+
+from bot import bot
+from bot import logs
+from bot import outbox
+from bot import webhook
+from bot.config import Config, config, load, use
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    filenames = sys.argv[1:]
+    if not filenames:
+        print("usage: python -m bot.multibot config.yml [config.yml ...]", file=sys.stderr)
+        sys.exit(2)
+    configs = [Config(filename, load(filename)) for filename in filenames]
+    check(configs)
+    # the bots share the process, and so the logging settings
+    logs.setup(configs[0].logging)
+    asyncio.run(run(configs))
+
+
+def check(configs: list[Config]) -> None:
+    """Fails if the bots would get in each other's way."""
+    paths = [conf.persistence_path for conf in configs]
+    if len(set(paths)) < len(paths):
+        raise ValueError("each bot needs its own persistence_path")
+    endpoints = [(conf.webhook.port, conf.webhook.path) for conf in configs if conf.webhook.url]
+    if len(set(endpoints)) < len(endpoints):
+        raise ValueError("each bot needs its own webhook port or path")
+
+
+async def run(configs: list[Config]) -> None:
+    """Runs the bots until interrupted."""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    try:
+        # each bot runs in its own task, so it has its own context and config
+        results = await asyncio.gather(
+            *(serve(conf, stopping) for conf in configs), return_exceptions=True
+        )
+        for conf, result in zip(configs, results):
+            if isinstance(result, Exception):
+                logger.error("bot %s failed: %s", conf.filename, result, exc_info=result)
+    finally:
+        await bot.close_resources()
+
+
+async def serve(conf: Config, stopping: asyncio.Event) -> None:
+    """Runs the bot with the given config until stopped."""
+    use(conf)
+    if config.sharding.workers:
+        logger.warning("%s: sharding is not supported with several bots, ignored", conf.filename)
+    application = bot.build_application()
+
+    def handle(data: dict) -> None:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            if config.webhook.url:
+                await webhook.serve(application.bot, handle, stopping)
+            else:
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                await stopping.wait()
+                await application.updater.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        # the shared resources are freed once all the bots have stopped
+        outbox.close()
+
+
+if __name__ == "__main__":
+    main()
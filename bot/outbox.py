@@ -0,0 +1,431 @@
+"""
+Stores answers before delivering them, so that an answer already paid for
+is not lost if Telegram fails to accept it. Undelivered answers are retried
+with backoff, and redelivered after a restart. An answer is dropped only when
+Telegram rejects it for good (e.g. the bot is blocked).
+"""
+
+import asyncio
+import dataclasses
+from dataclasses import dataclass, field
+import html
+import io
+import json
+import logging
+import sqlite3
+import textwrap
+import threading
+import time
+from typing import Optional, Sequence
+
+from telegram import Bot, Chat, Message
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from bot import markdown
+from bot import workers
+from bot.config import PerBot
+
+logger = logging.getLogger(__name__)
+
+# Answer kinds.
+TEXT = "text"
+PHOTO = "photo"
+
+# The maximum number of messages to split a text answer into.
+# Longer answers are sent as an attached markdown file.
+MAX_MESSAGES = 5
+
+# Delays before retrying an undelivered answer, in seconds.
+# After the last one, the answer waits in the outbox for the next start.
+RETRY_DELAYS = (5, 30, 120, 600)
+
+SCHEMA = """
+create table if not exists outbox (
+    id integer primary key,
+    entry text not null,
+    created_at integer not null
+);
+"""
+
+
+@dataclass
+class Entry:
+    """An answer to deliver."""
+
+    chat_id: int
+    message_id: int
+    is_reply: bool
+    message_thread_id: Optional[int]
+    kind: str
+    text: str
+    caption: str = ""
+    # earlier replies to edit (or delete) instead of sending new messages
+    replace: list[int] = field(default_factory=list)
+    # the ids of the messages already sent (for answers split into several messages)
+    message_ids: list[int] = field(default_factory=list)
+    attempts: int = 0
+    id: Optional[int] = None
+
+    @classmethod
+    def from_message(
+        cls, message: Message, kind: str, text: str, caption: str = "", replace: Sequence[int] = ()
+    ) -> "Entry":
+        """Creates an entry that answers the message."""
+        return cls(
+            chat_id=message.chat_id,
+            message_id=message.id,
+            # in groups the bot replies to the specific message
+            is_reply=message.chat.type != Chat.PRIVATE,
+            message_thread_id=message.message_thread_id if message.is_topic_message else None,
+            kind=kind,
+            text=text,
+            caption=caption,
+            replace=list(replace),
+        )
+
+    @property
+    def reply_to_message_id(self) -> Optional[int]:
+        return self.message_id if self.is_reply else None
+
+
+class Outbox:
+    """Undelivered answers stored in an SQLite database."""
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        """Opens the database."""
+        self._db = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._db.execute("pragma journal_mode = wal")
+        self._db.execute("pragma synchronous = normal")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """Closes the database."""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    async def add(self, entry: Entry) -> None:
+        """Stores a new entry."""
+        entry.id = await workers.run("outbox", self._insert, entry, size=len(entry.text))
+
+    async def save(self, entry: Entry) -> None:
+        """Stores the delivery progress."""
+        await workers.run("outbox", self._update, entry, size=len(entry.text))
+
+    async def remove(self, entry: Entry) -> None:
+        """Removes a delivered (or abandoned) entry."""
+        await workers.run("outbox", self._delete, entry.id, size=0)
+
+    def pending(self) -> list[Entry]:
+        """Returns the undelivered entries."""
+        with self._lock:
+            rows = self._db.execute("select id, entry from outbox order by id").fetchall()
+        entries = []
+        for entry_id, value in rows:
+            entry = Entry(**_loads(value))
+            entry.id = entry_id
+            entries.append(entry)
+        return entries
+
+    def _insert(self, entry: Entry) -> int:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "insert into outbox(entry, created_at) values (?, ?)",
+                (_dumps(entry), int(time.time())),
+            )
+            return cursor.lastrowid
+
+    def _update(self, entry: Entry) -> None:
+        with self._lock, self._db:
+            self._db.execute("update outbox set entry = ? where id = ?", (_dumps(entry), entry.id))
+
+    def _delete(self, entry_id: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("delete from outbox where id = ?", (entry_id,))
+
+
+class Delivery:
+    """The outbox and the scheduled retries of a bot."""
+
+    def __init__(self) -> None:
+        # the outbox is used only when opened by the application,
+        # otherwise the answers are delivered directly
+        self.outbox: Optional[Outbox] = None
+        self.retries: set[asyncio.Task] = set()
+
+
+_state: PerBot[Delivery] = PerBot(Delivery)
+
+
+def init(filepath: str) -> None:
+    """Opens the outbox stored in the given database."""
+    _state.outbox = Outbox(filepath)
+    _state.outbox.open()
+
+
+def close() -> None:
+    """Cancels the scheduled retries and closes the outbox."""
+    state = _state.get()
+    if state.retries:
+        logger.info("left %s undelivered answers for the next start", len(state.retries))
+    for task in list(state.retries):
+        task.cancel()
+    if state.outbox:
+        state.outbox.close()
+        state.outbox = None
+
+
+async def send(
+    message: Message, kind: str, text: str, caption: str = "", replace: Sequence[int] = ()
+) -> list[int]:
+    """
+    Delivers an answer to the message and returns the ids of the sent messages.
+    Edits the `replace` messages (earlier replies) where possible instead of sending new ones.
+    With the outbox open, stores the answer first, and retries later if delivery fails.
+    Otherwise, raises the delivery error.
+    """
+    entry = Entry.from_message(message, kind=kind, text=text, caption=caption, replace=replace)
+    if _state.outbox:
+        await _state.outbox.add(entry)
+    return await _deliver(message.get_bot(), entry)
+
+
+async def redeliver(bot: Bot) -> int:
+    """Starts delivering the answers left undelivered, returns their number."""
+    if not _state.outbox:
+        return 0
+    entries = _state.outbox.pending()
+    for entry in entries:
+        _schedule(bot, entry, delay=0)
+    if entries:
+        logger.info("redelivering %s answers", len(entries))
+    return len(entries)
+
+
+async def _deliver(bot: Bot, entry: Entry) -> list[int]:
+    """
+    Sends the entry, removes it on success and schedules a retry on a failure.
+    Drops the entry only on a permanent failure (e.g. the bot is blocked).
+    """
+    try:
+        await _send(bot, entry)
+    except BadRequest as exc:
+        if entry.is_reply and _is_missing_reply(exc):
+            # the question has been deleted, so answer without quoting it
+            logger.warning(
+                "message=%s in chat=%s is gone, answering without a reply",
+                entry.message_id,
+                entry.chat_id,
+            )
+            entry.is_reply = False
+            return await _deliver(bot, entry)
+        return await _drop(entry, exc)
+    except Forbidden as exc:
+        # the bot is blocked or removed from the chat, retrying won't help
+        return await _drop(entry, exc)
+    except (NetworkError, RetryAfter) as exc:
+        # BadRequest is a NetworkError too, so it is handled above
+        return await _retry(bot, entry, exc)
+    except Exception as exc:
+        # not necessarily permanent (e.g. a bug fixed by the next release),
+        # and the answer has been paid for, so it is kept
+        logger.error("unexpected error delivering answer: %s", exc, exc_info=exc)
+        return await _retry(bot, entry, exc)
+
+    if _state.outbox:
+        await _state.outbox.remove(entry)
+    return entry.message_ids
+
+
+async def _retry(bot: Bot, entry: Entry, exc: Exception) -> list[int]:
+    """
+    Schedules another attempt to deliver the entry. After the last attempt,
+    leaves it in the outbox to redeliver on the next start.
+    """
+    if not _state.outbox:
+        raise exc
+    if entry.attempts >= len(RETRY_DELAYS):
+        logger.error(
+            "failed to deliver answer to chat=%s, message=%s after %s attempts, "
+            "will retry on the next start: %s",
+            entry.chat_id,
+            entry.message_id,
+            entry.attempts + 1,
+            exc,
+        )
+        return []
+    entry.attempts += 1
+    delay = RETRY_DELAYS[entry.attempts - 1]
+    if isinstance(exc, RetryAfter):
+        delay = max(delay, exc.retry_after)
+    logger.warning(
+        "failed to deliver answer to chat=%s, message=%s, retry in %ss: %s",
+        entry.chat_id,
+        entry.message_id,
+        delay,
+        exc,
+    )
+    await _state.outbox.save(entry)
+    _schedule(bot, entry, delay)
+    return []
+
+
+async def _drop(entry: Entry, exc: Exception) -> list[int]:
+    """Gives up on delivering the entry."""
+    if not _state.outbox:
+        raise exc
+    logger.error(
+        "dropped answer to chat=%s, message=%s after %s attempts: %s",
+        entry.chat_id,
+        entry.message_id,
+        entry.attempts + 1,
+        exc,
+    )
+    await _state.outbox.remove(entry)
+    return []
+
+
+def _is_missing_reply(exc: BadRequest) -> bool:
+    """Checks if Telegram has rejected the message because the replied message is gone."""
+    error = str(exc).lower()
+    return "repl" in error and "not found" in error
+
+
+def _schedule(bot: Bot, entry: Entry, delay: float) -> None:
+    """Delivers the entry after a delay."""
+
+    async def retry() -> None:
+        await asyncio.sleep(delay)
+        await _deliver(bot, entry)
+
+    task = asyncio.create_task(retry())
+    retries = _state.retries
+    retries.add(task)
+    task.add_done_callback(retries.discard)
+
+
+async def _send(bot: Bot, entry: Entry) -> None:
+    """Sends the entry to the chat, recording the ids of the sent messages."""
+    if entry.kind == PHOTO:
+        sent = await bot.send_photo(
+            chat_id=entry.chat_id,
+            photo=entry.text,
+            caption=entry.caption,
+            reply_to_message_id=entry.reply_to_message_id,
+            message_thread_id=entry.message_thread_id,
+        )
+        entry.message_ids = [sent.message_id]
+        await _delete(bot, entry.chat_id, entry.replace)
+        return
+
+    chunks = markdown.split_html(markdown.to_html(entry.text), MessageLimit.MAX_TEXT_LENGTH)
+    if len(chunks) > MAX_MESSAGES:
+        sent = await _send_document(bot, entry)
+        entry.message_ids = [sent.message_id]
+        await _delete(bot, entry.chat_id, entry.replace)
+        return
+
+    for idx in range(len(entry.message_ids), len(chunks)):
+        if idx < len(entry.replace):
+            message_id = await _edit_chunk(bot, entry, entry.replace[idx], chunks[idx])
+        else:
+            message_id = (await _send_chunk(bot, entry, chunks[idx])).message_id
+        entry.message_ids.append(message_id)
+        if _state.outbox and len(entry.message_ids) < len(chunks):
+            await _state.outbox.save(entry)
+    # the earlier reply was longer than the new one
+    await _delete(bot, entry.chat_id, entry.replace[len(chunks) :])
+
+
+async def _send_chunk(bot: Bot, entry: Entry, chunk: str) -> Message:
+    """Sends a part of a text answer, falling back to plain text if Telegram rejects the HTML."""
+    try:
+        return await bot.send_message(
+            chat_id=entry.chat_id,
+            text=chunk,
+            parse_mode=ParseMode.HTML,
+            reply_to_message_id=entry.reply_to_message_id,
+            message_thread_id=entry.message_thread_id,
+        )
+    except BadRequest as exc:
+        if "parse" not in str(exc).lower():
+            raise
+        logger.warning("failed to send HTML to chat=%s, sending plain text: %s", entry.chat_id, exc)
+        return await bot.send_message(
+            chat_id=entry.chat_id,
+            text=to_plain_text(chunk),
+            reply_to_message_id=entry.reply_to_message_id,
+            message_thread_id=entry.message_thread_id,
+        )
+
+
+async def _edit_chunk(bot: Bot, entry: Entry, message_id: int, chunk: str) -> int:
+    """
+    Replaces an earlier reply with a part of a text answer, returns the message id.
+    Sends a new message if the earlier one can no longer be edited.
+    """
+    try:
+        await bot.edit_message_text(
+            chat_id=entry.chat_id,
+            message_id=message_id,
+            text=chunk,
+            parse_mode=ParseMode.HTML,
+        )
+        return message_id
+    except BadRequest as exc:
+        error = str(exc).lower()
+        if "not modified" in error:
+            return message_id
+        if "parse" in error:
+            await bot.edit_message_text(
+                chat_id=entry.chat_id, message_id=message_id, text=to_plain_text(chunk)
+            )
+            return message_id
+        logger.warning("failed to edit message=%s in chat=%s: %s", message_id, entry.chat_id, exc)
+        return (await _send_chunk(bot, entry, chunk)).message_id
+
+
+async def _delete(bot: Bot, chat_id: int, message_ids: Sequence[int]) -> None:
+    """Deletes the earlier replies that the new answer does not replace."""
+    for message_id in message_ids:
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except BadRequest as exc:
+            logger.warning("failed to delete message=%s in chat=%s: %s", message_id, chat_id, exc)
+
+
+async def _send_document(bot: Bot, entry: Entry) -> Message:
+    """Sends a very long text answer as an attachment."""
+    caption = (
+        textwrap.shorten(entry.text, width=255, placeholder="...")
+        + " (see attachment for the rest)"
+    )
+    return await bot.send_document(
+        chat_id=entry.chat_id,
+        caption=caption,
+        filename=f"{entry.message_id}.md",
+        document=io.StringIO(entry.text),
+        reply_to_message_id=entry.reply_to_message_id,
+        message_thread_id=entry.message_thread_id,
+    )
+
+
+def to_plain_text(html_text: str) -> str:
+    """Removes the HTML tags and unescapes the entities."""
+    return html.unescape(markdown.tag_re.sub("", html_text))
+
+
+def _dumps(entry: Entry) -> str:
+    value = dataclasses.asdict(entry)
+    del value["id"]
+    return json.dumps(value)
+
+
+def _loads(value: str) -> dict:
+    return json.loads(value)
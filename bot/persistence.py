@@ -0,0 +1,363 @@
+"""
+Stores user and chat data in an SQLite database.
+Writes only the changed entries, and loads the entries lazily on first access.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bot import workers
+
+logger = logging.getLogger(__name__)
+
+USER_TABLE = "user_data"
+CHAT_TABLE = "chat_data"
+TABLES = (USER_TABLE, CHAT_TABLE)
+
+SCHEMA = """
+create table if not exists user_data (
+    id integer primary key,
+    data blob not null,
+    updated_at integer not null,
+    version integer not null default 0
+);
+create table if not exists chat_data (
+    id integer primary key,
+    data blob not null,
+    updated_at integer not null,
+    version integer not null default 0
+);
+create table if not exists meta (
+    key text primary key,
+    value text
+);
+"""
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Persistence for user and chat data based on SQLite in WAL mode.
+    The application passes the changed entries to the persistence periodically.
+    They are pickled and written in a single transaction in a worker thread,
+    so the event loop does not block. The entries are loaded when the bot receives
+    the first update from a user or a chat, not at startup.
+    Does not store bot data, callback data and conversations (the bot does not use them).
+
+    With `shared=True`, several processes work with the same database.
+    Each entry has a version, and an entry is reloaded when another process
+    has written a newer version of it. The last write wins.
+    """
+
+    def __init__(self, filepath: str, update_interval: float = 60, shared: bool = False) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.filepath, self.pickle_path = _resolve_paths(filepath)
+        self.shared = shared
+        self._reader: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._write_task: Optional[asyncio.Task] = None
+        # changed entries waiting to be written, None means 'delete'
+        self._pending: dict[str, dict[int, Optional[dict]]] = {table: {} for table in TABLES}
+        # changed entries being written right now
+        self._writing: dict[str, dict[int, Optional[dict]]] = {table: {} for table in TABLES}
+        # entries already loaded into the application
+        self._loaded: dict[str, set[int]] = {table: set() for table in TABLES}
+        # versions of the entries loaded or written by this process
+        self._versions: dict[str, dict[int, int]] = {table: {} for table in TABLES}
+
+    async def get_user_data(self) -> dict[int, dict]:
+        """Opens the database. The user data is loaded lazily."""
+        self._open()
+        return {}
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        """Opens the database. The chat data is loaded lazily."""
+        self._open()
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Loads the user data from the database on first access."""
+        self._refresh(USER_TABLE, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        """Loads the chat data from the database on first access."""
+        self._refresh(CHAT_TABLE, chat_id, chat_data)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        """Schedules the user data for writing."""
+        self._pending[USER_TABLE][user_id] = data
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        """Schedules the chat data for writing."""
+        self._pending[CHAT_TABLE][chat_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        """Schedules the user data for deletion."""
+        self._pending[USER_TABLE][user_id] = None
+        self._loaded[USER_TABLE].discard(user_id)
+        self._versions[USER_TABLE].pop(user_id, None)
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        """Schedules the chat data for deletion."""
+        self._pending[CHAT_TABLE][chat_id] = None
+        self._loaded[CHAT_TABLE].discard(chat_id)
+        self._versions[CHAT_TABLE].pop(chat_id, None)
+        self._schedule_write()
+
+    async def flush(self) -> None:
+        """Writes all pending changes and closes the database."""
+        if self._write_task:
+            await self._write_task
+        if self._writer:
+            self._write(self._take_pending())
+        self._close()
+
+    @property
+    def busy(self) -> bool:
+        """Whether some changes are not yet written to the database."""
+        writing = self._write_task is not None and not self._write_task.done()
+        return writing or any(self._pending.values())
+
+    def unload(self, table: str, key: int, data: Optional[dict] = None) -> None:
+        """
+        Forgets that the entry is loaded, so that it is loaded again on next access.
+        Called when the application removes an entry from memory. The `data`
+        are the entry's changes not yet passed to the persistence, if any.
+        """
+        if data is not None:
+            self._pending[table][key] = copy.deepcopy(data)
+            self._schedule_write()
+        self._loaded[table].discard(key)
+        self._versions[table].pop(key, None)
+
+    async def expire(self, before: int) -> dict[str, int]:
+        """
+        Deletes the entries not changed since the given time (in epoch seconds),
+        except the ones loaded into the application. Returns the number of deleted
+        entries per table.
+        """
+        if not self._writer:
+            return {}
+        keep = {table: self._loaded[table] | self._pending[table].keys() for table in TABLES}
+        return await workers.run("persistence", self._expire, before, keep)
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object) -> None:
+        pass
+
+    def _open(self) -> None:
+        """Opens the database, creating and migrating it if necessary."""
+        if self._writer:
+            return
+        dirname = os.path.dirname(self.filepath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._writer = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._writer.execute("pragma journal_mode = wal")
+        self._writer.execute("pragma synchronous = normal")
+        self._writer.executescript(SCHEMA)
+        self._upgrade()
+        self._reader = sqlite3.connect(self.filepath)
+        self._migrate()
+
+    def _close(self) -> None:
+        """Closes the database connections."""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def _upgrade(self) -> None:
+        """Adds the columns missing from databases created by older versions."""
+        for table in TABLES:
+            columns = [row[1] for row in self._writer.execute(f"pragma table_info({table})")]
+            if "version" not in columns:
+                self._writer.execute(
+                    f"alter table {table} add column version integer not null default 0"
+                )
+
+    def _migrate(self) -> None:
+        """Imports the data from the legacy pickle file (only once)."""
+        if not os.path.exists(self.pickle_path):
+            return
+        row = self._reader.execute("select value from meta where key = 'migrated_from'").fetchone()
+        if row:
+            return
+        with open(self.pickle_path, "rb") as file:
+            data = pickle.load(file)
+        batch = {
+            USER_TABLE: data.get("user_data") or {},
+            CHAT_TABLE: data.get("chat_data") or {},
+        }
+        self._write(batch)
+        with self._writer:
+            self._writer.execute(
+                "insert into meta(key, value) values ('migrated_from', ?)", (self.pickle_path,)
+            )
+        logger.info(
+            "migrated from %s: users=%s, chats=%s",
+            self.pickle_path,
+            len(batch[USER_TABLE]),
+            len(batch[CHAT_TABLE]),
+        )
+
+    def _refresh(self, table: str, key: int, data: dict) -> None:
+        """
+        Loads the entry into the application's data on first access.
+        In shared mode, also reloads the entry if another process has changed it.
+        """
+        loaded = self._loaded[table]
+        if key in loaded and not self.shared:
+            return
+        pending, writing = self._pending[table], self._writing[table]
+        if key in pending or key in writing:
+            # the application has a newer version than the database
+            unwritten = pending[key] if key in pending else writing[key]
+            if key not in loaded and unwritten:
+                # unloaded before being written, so the newer version is taken back
+                for name, value in copy.deepcopy(unwritten).items():
+                    data.setdefault(name, value)
+            loaded.add(key)
+            return
+
+        if key in loaded:
+            row = self._reader.execute(f"select version from {table} where id = ?", (key,))
+            version = row.fetchone()
+            if not version or version[0] == self._versions[table].get(key):
+                return
+
+        row = self._reader.execute(
+            f"select data, version from {table} where id = ?", (key,)
+        ).fetchone()
+        if not row:
+            loaded.add(key)
+            return
+        stored = pickle.loads(row[0])
+        if key in loaded:
+            # changed by another process
+            data.clear()
+            data.update(stored)
+        else:
+            for name, value in stored.items():
+                data.setdefault(name, value)
+        loaded.add(key)
+        self._versions[table][key] = row[1]
+
+    def _schedule_write(self) -> None:
+        """Starts writing the pending changes unless already doing so."""
+        if self._write_task and not self._write_task.done():
+            return
+        self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        """Writes the pending changes in a worker thread."""
+        # the application updates all changed entries at once,
+        # so let the remaining updates join the batch
+        await asyncio.sleep(0)
+        while any(self._pending.values()):
+            self._writing = self._take_pending()
+            try:
+                await workers.run("persistence", self._write, self._writing)
+            finally:
+                self._writing = {table: {} for table in TABLES}
+
+    def _take_pending(self) -> dict[str, dict[int, Optional[dict]]]:
+        """Returns the pending changes and resets them."""
+        batch = self._pending
+        self._pending = {table: {} for table in TABLES}
+        return batch
+
+    def _write(self, batch: dict[str, dict[int, Optional[dict]]]) -> None:
+        """Writes the changes in a single transaction."""
+        now = int(time.time())
+        version = time.time_ns()
+        with self._write_lock, self._writer:
+            for table, entries in batch.items():
+                rows = [
+                    (key, pickle.dumps(data, pickle.HIGHEST_PROTOCOL), now, version)
+                    for key, data in entries.items()
+                    if data is not None
+                ]
+                deleted = [(key,) for key, data in entries.items() if data is None]
+                self._writer.executemany(
+                    f"insert or replace into {table}(id, data, updated_at, version) "
+                    "values (?, ?, ?, ?)",
+                    rows,
+                )
+                self._writer.executemany(f"delete from {table} where id = ?", deleted)
+                versions = self._versions[table]
+                for key, *_ in rows:
+                    versions[key] = version
+
+    def _expire(self, before: int, keep: dict[str, set[int]]) -> dict[str, int]:
+        """Deletes the stale entries in a single transaction."""
+        counts = {}
+        with self._write_lock, self._writer:
+            for table in TABLES:
+                rows = self._writer.execute(
+                    f"select id from {table} where updated_at < ?", (before,)
+                ).fetchall()
+                stale = [(key,) for key, in rows if key not in keep[table]]
+                self._writer.executemany(f"delete from {table} where id = ?", stale)
+                counts[table] = len(stale)
+        return counts
+
+
+def database_path(filepath: str) -> str:
+    """Returns the path of the database for the configured persistence path."""
+    return _resolve_paths(filepath)[0]
+
+
+def prepare(filepath: str) -> None:
+    """
+    Creates the database and imports the legacy data if necessary.
+    Called once before starting several processes that share the database.
+    """
+    store = SqlitePersistence(filepath)
+    store._open()
+    store._close()
+
+
+def _resolve_paths(filepath: str) -> tuple[str, str]:
+    """
+    Returns the database path and the legacy pickle file path.
+    The pickle path from older configs is mapped to a database next to it.
+    """
+    root, ext = os.path.splitext(filepath)
+    if ext == ".pkl":
+        return root + ".db", filepath
+    return filepath, root + ".pkl"
@@ -0,0 +1,345 @@
+"""
+Answers a question in a sequence of stages: prepare the question and history,
+fetch the linked pages, ask the AI, remember the answer, reply to the user.
+Each stage can limit the number of requests it handles at once and the time
+it takes, and reports its wait and run time to metrics. Deployments can add
+their own stages (e.g. caching or routing) through the config.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import importlib
+import logging
+import time
+from typing import Optional
+
+from telegram import Chat, Message, Update
+from telegram.ext import CallbackContext
+
+from bot import ai
+from bot import askers
+from bot import budget
+from bot import deadline
+from bot import drafts
+from bot import inflight
+from bot import memory
+from bot import metrics
+from bot import questions
+from bot.config import PerBot, config
+from bot.fetcher import Fetcher
+from bot.models import ReplyChains, UserData
+
+logger = logging.getLogger(__name__)
+
+# retrieves remote content, shared by all the bots in the process
+fetcher = Fetcher()
+
+
+@dataclass
+class Request:
+    """A question on its way through the pipeline."""
+
+    update: Update
+    message: Message
+    context: CallbackContext
+    question: str
+    asker: askers.Asker
+    model: str
+    prompt: Optional[str] = None
+    history: list[tuple[str, str]] = field(default_factory=list)
+    # the stages that produce the answer are skipped once it is set
+    answer: Optional[str] = None
+    # the ids of the messages sent in reply
+    message_ids: list[int] = field(default_factory=list)
+    # the ids of the messages that showed the answer while it was being written
+    draft_ids: list[int] = field(default_factory=list)
+    # the question as asked, before the stages change it
+    original: str = ""
+    # the question without the follow-up mark and commands,
+    # before the URLs are substituted with their contents
+    prepared: str = ""
+
+    def __post_init__(self) -> None:
+        self.original = self.original or self.question
+
+
+class Stage:
+    """A step in answering a question."""
+
+    name = ""
+    # the maximum number of requests in the stage at once, 0 = no limit
+    limit = 0
+    # the maximum time the stage may take, in seconds, 0 = no limit
+    timeout = 0.0
+    # whether the stage works on the answer (rather than delivers it),
+    # so that it is skipped when the answer is already known
+    answers = True
+
+    async def process(self, request: Request) -> None:
+        """Processes the request."""
+        pass
+
+
+class Prepare(Stage):
+    """Removes the follow-up mark from the question and selects the history."""
+
+    name = "prepare"
+
+    async def process(self, request: Request) -> None:
+        message = request.message
+        user_id = message.from_user.username or message.from_user.id
+        logger.info(
+            "-> question id=%s, user=%s, n_chars=%s", message.id, user_id, len(request.question)
+        )
+
+        # Set the user ID for AssistantAsker
+        if isinstance(request.asker, askers.AssistantAsker):
+            request.asker.model.user_id = str(user_id)
+
+        request.question, is_follow_up = questions.prepare(request.question)
+        request.prepared = request.question
+
+        user = UserData(request.context.user_data)
+        if message.chat.type == Chat.PRIVATE:
+            # in private chats the bot remembers previous messages
+            if is_follow_up:
+                # this is a follow-up question,
+                # so the bot should retain the previous history
+                request.history = user.messages.as_list()
+            else:
+                # user is asking a question 'from scratch',
+                # so the bot should forget the previous history
+                user.messages.clear()
+                request.history = []
+        else:
+            # in group chats the bot only answers direct questions
+            # or follow-up questions to the bot messages
+            prev_message = questions.extract_prev(message, request.context)
+            request.history = [("", prev_message)] if prev_message else []
+            if prev_message and config.conversation.reply_chain:
+                # recall the earlier turns of the conversation the user is replying to
+                chains = ReplyChains(request.context.chat_data, config.conversation.reply_chain)
+                max_tokens = _calc_history_budget(request.model, request.prompt, request.question)
+                history = chains.history(
+                    message.reply_to_message.id, max_tokens, depth=config.conversation.depth
+                )
+                request.history = history or request.history
+
+
+class Fetch(Stage):
+    """Substitutes the URLs in the question with their contents."""
+
+    name = "fetch"
+
+    async def process(self, request: Request) -> None:
+        max_tokens = _calc_fetch_budget(
+            request.model, request.prompt, request.question, request.history
+        )
+        request.question = await fetcher.substitute_urls(request.question, max_tokens=max_tokens)
+        logger.debug("prepared question: %s", request.question)
+
+
+class Ask(Stage):
+    """Asks the AI."""
+
+    name = "ask"
+
+    async def process(self, request: Request) -> None:
+        start = time.perf_counter_ns()
+        if config.conversation.stream_interval and request.asker.streams:
+            request.answer = await self._ask_stream(request)
+        else:
+            request.answer = await request.asker.ask(
+                prompt=request.prompt, question=request.question, history=request.history
+            )
+        elapsed = int((time.perf_counter_ns() - start) / 1e6)
+        user = request.message.from_user
+        logger.info(
+            "<- answer id=%s, user=%s, n_chars=%s, len_history=%s, took=%sms",
+            request.message.id,
+            user.username or user.id,
+            len(request.answer),
+            len(request.history),
+            elapsed,
+        )
+
+
+    async def _ask_stream(self, request: Request) -> str:
+        """Asks the AI, showing the answer in a draft message while it is being written."""
+        draft = drafts.Draft(request.message, config.conversation.stream_interval)
+        try:
+            async for part in request.asker.ask_stream(
+                prompt=request.prompt, question=request.question, history=request.history
+            ):
+                await draft.feed(part)
+            answer = draft.text.strip()
+            if not answer:
+                raise ValueError("received an empty answer")
+        except BaseException:
+            # cancelled or failed, so the answer is not coming
+            await draft.discard()
+            raise
+        request.draft_ids = draft.message_ids
+        return answer
+
+
+class Remember(Stage):
+    """Adds the question and the answer to the user's history."""
+
+    name = "remember"
+    answers = False
+
+    async def process(self, request: Request) -> None:
+        user = UserData(request.context.user_data)
+        user.messages.add(request.original, request.answer)
+        user.touch()
+        memory.histories.touch(request.message.from_user.id, request.context.user_data)
+        logger.debug("history: %s", user.messages)
+
+
+class Reply(Stage):
+    """Sends the answer, replacing the earlier replies to the same question."""
+
+    name = "reply"
+    answers = False
+
+    async def process(self, request: Request) -> None:
+        # too late to cancel the answer, it is going to the chat anyway
+        key = inflight.key_of(request.update)
+        inflight.answers.commit(key)
+        request.message_ids = await request.asker.reply(
+            request.message,
+            request.context,
+            request.answer,
+            # the final answer takes the place of the draft
+            replace=request.draft_ids + inflight.answers.replies_to(key),
+        )
+        inflight.answers.remember(key, request.message_ids)
+        message = request.message
+        if message.chat.type != Chat.PRIVATE and config.conversation.reply_chain:
+            # so that replies to the answer can recall the conversation;
+            # nothing is awaited while the chains change, so no chat lock is needed
+            chains = ReplyChains(request.context.chat_data, config.conversation.reply_chain)
+            parent = message.reply_to_message.id if message.reply_to_message else None
+            chains.add_question(message.id, parent, request.prepared or request.question)
+            chains.add_answer(request.message_ids, message.id, request.answer)
+
+
+# Stages in the order they run.
+DEFAULT_STAGES = (Prepare, Fetch, Ask, Remember, Reply)
+
+
+class Pipeline:
+    """Runs the requests through the stages."""
+
+    def __init__(self, stages: list[Stage]) -> None:
+        self.stages = stages
+        self._slots = {
+            stage.name: asyncio.Semaphore(stage.limit) for stage in stages if stage.limit > 0
+        }
+        self.n_timeouts = 0
+
+    async def run(self, request: Request) -> None:
+        """Runs the request through the stages."""
+        for stage in self.stages:
+            if stage.answers and request.answer is not None:
+                continue
+            await self._run_stage(stage, request)
+
+    async def _run_stage(self, stage: Stage, request: Request) -> None:
+        start = time.perf_counter()
+        slots = self._slots.get(stage.name)
+        if slots:
+            await slots.acquire()
+        try:
+            run_start = time.perf_counter()
+            metrics.observe(f"pipeline.{stage.name}.wait_ms", (run_start - start) * 1e3)
+            # the answer is not worth delivering if the user has given up on it
+            deadline.check()
+            timeout = stage.timeout or None
+            if stage.answers:
+                timeout = deadline.timeout(timeout)
+            try:
+                await asyncio.wait_for(stage.process(request), timeout=timeout)
+            except asyncio.TimeoutError:
+                if deadline.expired():
+                    raise deadline.Missed()
+                self.n_timeouts += 1
+                metrics.gauge("pipeline.timeouts", self.n_timeouts)
+                logger.warning("stage %s timed out after %ss", stage.name, stage.timeout)
+                raise
+            finally:
+                metrics.observe(
+                    f"pipeline.{stage.name}.run_ms", (time.perf_counter() - run_start) * 1e3
+                )
+        finally:
+            if slots:
+                slots.release()
+
+
+def build() -> Pipeline:
+    """Creates the pipeline from the default stages and the ones from the config."""
+    settings = config.pipeline
+    stages = [cls() for cls in DEFAULT_STAGES]
+    for spec in settings.stages:
+        stage = load_stage(spec["use"])
+        names = [stage.name for stage in stages]
+        before = spec.get("before") or "reply"
+        if before not in names:
+            raise ValueError(f"unknown pipeline stage: {before}")
+        stages.insert(names.index(before), stage)
+    for stage in stages:
+        if stage.name in settings.limits:
+            stage.limit = settings.limits[stage.name]
+        if stage.name in settings.timeouts:
+            stage.timeout = settings.timeouts[stage.name]
+    logger.info("pipeline: %s", " -> ".join(stage.name for stage in stages))
+    return Pipeline(stages)
+
+
+def load_stage(path: str) -> Stage:
+    """Creates a stage from its class path, e.g. 'mypackage.cache:CacheStage'."""
+    module_name, _, class_name = path.partition(":")
+    if not class_name:
+        module_name, _, class_name = path.rpartition(".")
+    try:
+        cls = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError, ValueError) as exc:
+        raise ValueError(f"cannot load pipeline stage {path}: {exc}") from exc
+    if not (isinstance(cls, type) and issubclass(cls, Stage)):
+        raise ValueError(f"{path} is not a pipeline stage")
+    stage = cls()
+    stage.name = stage.name or class_name.lower()
+    return stage
+
+
+def _calc_history_budget(model: str, prompt: str, question: str) -> int:
+    """
+    Calculates the number of tokens available for the conversation history,
+    leaving half of the model context that remains after the prompt and question
+    for the fetched URL contents.
+    """
+    n_input = ai.chat.calc_n_input(model, n_output=config.openai.params["max_tokens"])
+    n_used = budget.count_tokens(prompt or config.openai.prompt) + budget.count_tokens(question)
+    max_tokens = max((n_input - n_used) // 2, 0)
+    if config.conversation.max_tokens:
+        max_tokens = min(max_tokens, config.conversation.max_tokens)
+    return max_tokens
+
+
+def _calc_fetch_budget(
+    model: str, prompt: str, question: str, history: list[tuple[str, str]]
+) -> int:
+    """
+    Calculates the number of tokens available for the fetched URL contents,
+    so that they fit into the model context along with the prompt, question and history.
+    """
+    n_input = ai.chat.calc_n_input(model, n_output=config.openai.params["max_tokens"])
+    n_used = budget.count_tokens(prompt or config.openai.prompt) + budget.count_tokens(question)
+    for prev_question, prev_answer in history:
+        n_used += budget.count_tokens(prev_question) + budget.count_tokens(prev_answer)
+    return max(min(config.fetcher.max_tokens, n_input - n_used), 0)
+
+
+# The pipeline of each bot, built on first use.
+pipelines: PerBot[Pipeline] = PerBot(build)
@@ -3,6 +3,7 @@
 from telegram import Message, MessageEntity
 from telegram.ext import CallbackContext
 from bot import shortcuts
+from bot import workers
 
 
 async def extract_private(message: Message, context: CallbackContext) -> str:
@@ -111,6 +112,11 @@ async def _extract_document_text(message: Message, context: CallbackContext) ->
     """Extracts text from a document message."""
     file = await context.bot.get_file(message.document.file_id)
     bytes = await file.download_as_bytearray()
-    text = bytes.decode("utf-8").strip()
+    text = await workers.run("decode", _decode, bytes, size=len(bytes))
     caption = f"{message.caption}\n\n" if message.caption else ""
     return f"{caption}{message.document.file_name}:\n```\n{text}\n```"
+
+
+def _decode(data: bytearray) -> str:
+    """Decodes document contents as UTF-8 text."""
+    return data.decode("utf-8").strip()
@@ -0,0 +1,263 @@
+"""
+Paces outgoing Telegram requests to stay within the flood limits,
+and retries the requests that failed because of flood control or network errors.
+
+The buckets live in the process memory. When the updates are sharded
+between several workers, each worker paces its own requests, so together
+they may send up to the number of workers times the configured rates.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Optional, Union
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from bot import metrics
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower values go first.
+PRIORITY_ANSWER = 0
+PRIORITY_EDIT = 1
+PRIORITY_ACTION = 2
+
+# Endpoints with non-default priorities.
+PRIORITIES = {
+    "editMessageText": PRIORITY_EDIT,
+    "editMessageCaption": PRIORITY_EDIT,
+    "editMessageReplyMarkup": PRIORITY_EDIT,
+    "sendChatAction": PRIORITY_ACTION,
+}
+
+# Endpoints that must not be retried after a timeout: the request may have
+# reached Telegram, and a retry would send the message twice.
+NOT_IDEMPOTENT = {
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "sendAudio",
+    "sendVoice",
+    "sendVideo",
+    "sendMediaGroup",
+    "forwardMessage",
+    "copyMessage",
+}
+
+# The number of chat buckets that triggers removing the idle ones.
+MAX_IDLE_CHATS = 1024
+
+# Delay before the first retry after a network error, in seconds.
+# Doubles with each retry.
+RETRY_DELAY = 1
+
+Result = Union[bool, dict[str, Any], list[dict[str, Any]]]
+
+
+class TokenBucket:
+    """
+    A token bucket that serves its waiters in the order of priority.
+    Holds up to `capacity` tokens and gains `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # (priority, sequence number, future)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def is_idle(self) -> bool:
+        """True if the bucket is full and nobody waits for it."""
+        self._refill()
+        return self.tokens >= self.capacity and not self._waiters
+
+    def try_take(self) -> bool:
+        """Takes a token if one is available right away."""
+        self._refill()
+        if self._waiters or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def take(self, priority: int) -> None:
+        """Takes a token, waiting for it after the waiters with higher priority."""
+        if self.try_take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # got the token right before the cancellation, so give it back
+                self.tokens += 1
+            self._waiters = [item for item in self._waiters if item[2] is not future]
+            heapq.heapify(self._waiters)
+            raise
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for the given number of seconds."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - self.rate * seconds
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._schedule()
+
+    def resize(self, rate: float, capacity: float) -> None:
+        """Changes the rate and the capacity, keeping the waiters and the pauses."""
+        if rate == self.rate and capacity == self.capacity:
+            return
+        self._refill()
+        if self.tokens < 0:
+            # a pause lasts as long as before
+            self.tokens *= rate / self.rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._schedule()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.capacity)
+        self.updated_at = now
+
+    def _schedule(self) -> None:
+        """Wakes up the waiters when the next token is available."""
+        if self._timer or not self._waiters:
+            return
+        delay = max((1 - self.tokens) / self.rate, 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        self._schedule()
+
+
+class RateLimiter(BaseRateLimiter):
+    """
+    Throttles the requests to chats within the global and per-chat budgets.
+    Final answers go first, edits next, and chat actions last. A chat action
+    is skipped rather than delayed when the chat has no budget left, since
+    it is useless when late. Requests not related to a chat are not throttled.
+    Retries after flood control errors and network errors, but not the sends
+    that timed out, since they may have been delivered.
+    """
+
+    def __init__(self) -> None:
+        self._global: Optional[TokenBucket] = None
+        self._chats: dict[Union[int, str], TokenBucket] = {}
+        self.n_skipped = 0
+
+    async def initialize(self) -> None:
+        # the buckets are created on demand
+        pass
+
+    async def shutdown(self) -> None:
+        self._global = None
+        self._chats.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Result]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Result:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = rate_limit_args if rate_limit_args is not None else PRIORITIES.get(endpoint, 0)
+        chat = self._get_chat(chat_id)
+        for attempt in range(config.ratelimit.max_retries + 1):
+            start = time.perf_counter()
+            if priority == PRIORITY_ACTION:
+                if not chat.try_take():
+                    self.n_skipped += 1
+                    metrics.gauge("ratelimit.skipped", self.n_skipped)
+                    return True
+            else:
+                await chat.take(priority)
+            await self._get_global().take(priority)
+            metrics.observe("ratelimit.wait_ms", (time.perf_counter() - start) * 1e3)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == config.ratelimit.max_retries:
+                    raise
+                logger.warning(
+                    "flood control: %s to chat=%s, retry in %ss", endpoint, chat_id, exc.retry_after
+                )
+                chat.pause(exc.retry_after)
+            except BadRequest:
+                raise
+            except TimedOut:
+                if endpoint in NOT_IDEMPOTENT or attempt == config.ratelimit.max_retries:
+                    raise
+                delay = RETRY_DELAY * 2**attempt
+                logger.warning("timed out: %s to chat=%s, retry in %ss", endpoint, chat_id, delay)
+                await asyncio.sleep(delay)
+            except NetworkError as exc:
+                if attempt == config.ratelimit.max_retries:
+                    raise
+                delay = RETRY_DELAY * 2**attempt
+                logger.warning(
+                    "network error: %s to chat=%s, retry in %ss: %s", endpoint, chat_id, delay, exc
+                )
+                await asyncio.sleep(delay)
+
+    def _get_global(self) -> TokenBucket:
+        """Returns the global bucket, sized by the current limits."""
+        rate = config.ratelimit.global_rate
+        if not self._global:
+            self._global = TokenBucket(rate=rate, capacity=rate)
+        else:
+            # the limits may have been changed with /config
+            self._global.resize(rate=rate, capacity=rate)
+        return self._global
+
+    def _get_chat(self, chat_id: Union[int, str]) -> TokenBucket:
+        """Returns the chat's bucket sized by the current limits, creating it if necessary."""
+        limits = config.ratelimit
+        if _is_group(chat_id):
+            rate, capacity = limits.group_rate / 60, limits.group_burst
+        else:
+            rate, capacity = limits.chat_rate, limits.chat_burst
+        bucket = self._chats.get(chat_id)
+        if bucket:
+            bucket.resize(rate=rate, capacity=capacity)
+            return bucket
+        if len(self._chats) >= MAX_IDLE_CHATS:
+            self._chats = {key: val for key, val in self._chats.items() if not val.is_idle}
+        bucket = TokenBucket(rate=rate, capacity=capacity)
+        self._chats[chat_id] = bucket
+        return bucket
+
+def _is_group(chat_id: Union[int, str]) -> bool:
+    """Group and channel IDs are negative, or usernames for public ones."""
+    return isinstance(chat_id, str) or chat_id < 0
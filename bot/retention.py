@@ -0,0 +1,158 @@
+"""
+Removes the data of users and chats that have not talked to the bot for a while.
+A background task periodically looks at the last activity of each user and chat:
+idle data is removed from memory (it stays in the database and is loaded back
+when the user returns), and data idle for longer than the TTL is deleted for good.
+Expired message counters and empty histories are removed along the way,
+so that memory stays proportional to the active users rather than all users ever.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from bot import memory
+from bot import metrics
+from bot.config import config
+from bot.models import UserData
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Result:
+    """What a single sweep has done."""
+
+    compacted: int = 0
+    unloaded: int = 0
+    dropped: int = 0
+    expired: int = 0
+
+
+# Data changed less than this many seconds ago may belong to an answer
+# in progress, so it is never removed, even if empty.
+MIN_IDLE = 600
+
+
+def touch(application: Application, update: Update) -> None:
+    """Marks the user and the chat of the update as active, if their data is in memory."""
+    user, chat = update.effective_user, update.effective_chat
+    now = int(time.time())
+    if user and user.id in application.user_data:
+        # not through UserData, which would create an empty history
+        application.user_data[user.id]["last_active"] = now
+    if chat and chat.id in application.chat_data:
+        application.chat_data[chat.id]["last_active"] = now
+
+
+class Sweeper:
+    """Periodically removes idle data from the application and its persistence."""
+
+    def __init__(self, application: Application) -> None:
+        self.application = application
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Starts sweeping in the background."""
+        if not config.retention.interval:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops sweeping."""
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(config.retention.interval)
+            try:
+                await self.sweep()
+            except Exception as exc:
+                logger.error("failed to remove idle data: %s", exc, exc_info=exc)
+
+    async def sweep(self) -> Result:
+        """Removes idle data once."""
+        settings = config.retention
+        application = self.application
+        store = application.persistence
+        result = Result()
+
+        # idle data must reach the database before it leaves memory
+        await application.update_persistence()
+        if store:
+            while store.busy:
+                await asyncio.sleep(0.01)
+
+        now = int(time.time())
+        quiet_before = now - MIN_IDLE
+        unload_before = now - settings.unload_after * 3600 if settings.unload_after else None
+        drop_before = now - settings.ttl * 86400 if settings.ttl else None
+        # no awaits from here on, so the data does not change while being removed
+        can_unload = store is not None and not store.busy
+        changed = set()
+        for user_id, data in list(application.user_data.items()):
+            last_active = data.get("last_active")
+            if not last_active:
+                # the data of an older version, start counting from now
+                data["last_active"] = now
+                changed.add(user_id)
+                continue
+            if last_active > quiet_before:
+                continue
+            if UserData.compact(data):
+                result.compacted += 1
+                changed.add(user_id)
+            if (drop_before and last_active < drop_before) or len(data) == 1:
+                application.drop_user_data(user_id)
+                memory.histories.forget(user_id)
+                changed.discard(user_id)
+                result.dropped += 1
+            elif can_unload and unload_before and last_active < unload_before:
+                if user_id not in changed:
+                    application.unload_user_data(user_id)
+                    memory.histories.forget(user_id)
+                    result.unloaded += 1
+        application.mark_data_for_update_persistence(user_ids=changed)
+
+        changed = set()
+        for chat_id, data in list(application.chat_data.items()):
+            last_active = data.get("last_active")
+            if not last_active:
+                data["last_active"] = now
+                changed.add(chat_id)
+            elif last_active > quiet_before:
+                continue
+            elif (drop_before and last_active < drop_before) or len(data) == 1:
+                application.drop_chat_data(chat_id)
+                result.dropped += 1
+            elif can_unload and unload_before and last_active < unload_before:
+                application.unload_chat_data(chat_id)
+                result.unloaded += 1
+        application.mark_data_for_update_persistence(chat_ids=changed)
+
+        if drop_before and store:
+            counts = await store.expire(drop_before)
+            result.expired = sum(counts.values())
+
+        metrics.gauge("retention.users", len(application.user_data))
+        metrics.gauge("retention.chats", len(application.chat_data))
+        logger.info(
+            "removed idle data: compacted=%s, unloaded=%s, dropped=%s, expired=%s",
+            result.compacted,
+            result.unloaded,
+            result.dropped,
+            result.expired,
+        )
+        return result
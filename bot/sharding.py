@@ -0,0 +1,159 @@
+"""
+Processes updates in several worker processes.
+A single receiver takes updates from Telegram and routes them to the workers by chat,
+so each chat's data (the model, the prompt, the reply chains) is changed by exactly one
+worker, and commands that act on a whole chat (e.g. /cancel) reach all its answers.
+A private chat has the same id as its user, so the user's history and message counter
+are changed by a single worker too. The workers share the persistence database.
+A user who talks to the bot in several groups may have their data changed by several
+workers, each reloads the data changed by the others, and the last write wins.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+from typing import Callable, Optional
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+from bot import commands
+from bot import logs
+from bot import outbox
+from bot import persistence
+from bot import webhook
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+# Long polling timeout in seconds.
+POLL_TIMEOUT = 10
+
+# How long to wait before polling again after an error, in seconds.
+RETRY_DELAY = 1
+
+# A message that tells a worker to stop.
+STOP = None
+
+
+class Router:
+    """Routes updates to the workers' queues."""
+
+    def __init__(self, queues: list[multiprocessing.Queue]) -> None:
+        self.queues = queues
+
+    def route(self, update: Update) -> int:
+        """Sends the update to its worker and returns the worker's index."""
+        index = shard_of(update, len(self.queues))
+        self.queues[index].put(update.to_dict())
+        return index
+
+
+def shard_of(update: Update, n_shards: int) -> int:
+    """
+    Returns the index of the worker responsible for the update.
+    Updates from the same chat always go to the same worker.
+    Updates without a chat (e.g. inline queries) go by user.
+    """
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = 0
+    return key % n_shards
+
+
+def run(build: Callable[..., Application], n_workers: int) -> None:
+    """
+    Starts the worker processes and receives updates until interrupted.
+    `build(shared=True)` should return an application without an updater.
+    """
+    persistence.prepare(config.persistence_path)
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(n_workers)]
+    processes = [
+        context.Process(target=_work, args=(build, index, queue), name=f"shard-{index}")
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("started %s worker processes", n_workers)
+
+    try:
+        asyncio.run(_receive(Router(queues)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(STOP)
+        for process in processes:
+            process.join()
+        logger.info("stopped %s worker processes", n_workers)
+
+
+async def _receive(router: Router) -> None:
+    """Receives updates from Telegram (via polling or webhook) and routes them to the workers."""
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+    bot = Bot(config.telegram.token)
+    outbox.init(persistence.database_path(config.persistence_path))
+    async with bot:
+        # once for all the workers
+        await bot.set_my_commands(commands.BOT_COMMANDS)
+        await outbox.redeliver(bot)
+        if config.webhook.url:
+            await webhook.serve(bot, lambda data: router.route(Update.de_json(data, bot)), stopping)
+        else:
+            await _poll(bot, router, stopping)
+    outbox.close()
+
+
+async def _poll(bot: Bot, router: Router, stopping: asyncio.Event) -> None:
+    """Polls Telegram for updates and routes them to the workers."""
+    await bot.delete_webhook()
+    offset: Optional[int] = None
+    while not stopping.is_set():
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES
+            )
+        except TelegramError as exc:
+            logger.warning("failed to get updates: %s", exc)
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            router.route(update)
+
+
+def _work(build: Callable[..., Application], index: int, queue: multiprocessing.Queue) -> None:
+    """Runs a worker process."""
+    logs.setup()
+    # the receiver decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(build(shared=True), index, queue))
+
+
+async def _serve(application: Application, index: int, queue: multiprocessing.Queue) -> None:
+    """Processes the updates from the queue until told to stop."""
+    loop = asyncio.get_running_loop()
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info("worker %s started", index)
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is STOP:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info("worker %s stopped", index)
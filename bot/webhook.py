@@ -0,0 +1,227 @@
+"""
+Receives updates from Telegram through a webhook, as an alternative to long polling.
+A small asyncio HTTP server checks the secret token, acknowledges each update
+right away and queues it for processing, so Telegram never waits for an answer.
+Several bot instances can serve the same webhook behind a load balancer.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+from typing import Callable, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+# Telegram sends the secret token in this header.
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+# The maximum size of an update, in bytes.
+MAX_BODY_SIZE = 1024 * 1024
+
+# How long to wait for the next request on a keep-alive connection, in seconds.
+IDLE_TIMEOUT = 60
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+class Server:
+    """
+    An HTTP server that accepts Telegram updates at the given path
+    and passes them to `handle` as dictionaries.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        secret_token: str,
+        handle: Callable[[dict], None],
+        max_connections: int = 40,
+    ) -> None:
+        self.path = path
+        self.secret_token = secret_token
+        self.handle = handle
+        self.max_connections = max_connections
+        self.n_received = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(max_connections)
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str, port: int) -> None:
+        """Starts accepting connections."""
+        self._server = await asyncio.start_server(self._accept, host, port)
+        logger.info("listening for updates at %s:%s%s", host, self.port, self.path)
+
+    async def stop(self) -> None:
+        """Stops accepting updates and closes the connections."""
+        if not self._server:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+        logger.info("stopped listening for updates, received %s", self.n_received)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves a connection, limiting the number of concurrent connections."""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            async with self._slots:
+                await self._serve(reader, writer)
+        except (asyncio.CancelledError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as exc:
+            logger.warning("malformed request: %s", exc)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves the requests on a (possibly keep-alive) connection."""
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), timeout=IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = await _read_headers(reader)
+            keep_alive = headers.get("connection", "").lower() != "close"
+
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_SIZE:
+                await _respond(writer, 413, keep_alive=False)
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            status, data = self._check(method, path, headers, body)
+            # acknowledge first, process later
+            await _respond(writer, status, keep_alive)
+            if data is not None:
+                self.n_received += 1
+                try:
+                    self.handle(data)
+                except Exception as exc:
+                    logger.warning("failed to queue update: %s", exc)
+            if not keep_alive:
+                return
+
+    def _check(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> tuple[int, Optional[dict]]:
+        """Validates the request, returns the response status and the update."""
+        if path.split("?", 1)[0] != self.path:
+            return 404, None
+        if method != "POST":
+            return 405, None
+        # bytes, since compare_digest does not accept non-ASCII strings
+        secret_token = headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(secret_token, self.secret_token.encode()):
+            logger.warning("rejected update with a wrong secret token")
+            return 403, None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, None
+        if not isinstance(data, dict):
+            return 400, None
+        return 200, data
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> dict[str, str]:
+    """Reads the request headers, with lowercase names."""
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+    connection = "keep-alive" if keep_alive else "close"
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        f"Content-Length: 0\r\nConnection: {connection}\r\n\r\n".encode("latin-1")
+    )
+    await writer.drain()
+
+
+async def serve(bot: Bot, handle: Callable[[dict], None], stopping: asyncio.Event) -> None:
+    """Registers the webhook and receives updates until stopped."""
+    settings = config.webhook
+    secret_token = settings.secret_token
+    if not secret_token:
+        # fine for a single instance, but several instances need the same token
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("webhook.secret_token is not set, using a random one")
+
+    server = Server(
+        path=settings.path,
+        secret_token=secret_token,
+        handle=handle,
+        max_connections=settings.max_connections,
+    )
+    await server.start(settings.listen, settings.port)
+    try:
+        await bot.set_webhook(
+            url=settings.url,
+            secret_token=secret_token,
+            max_connections=settings.max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stopping.wait()
+    finally:
+        # the webhook stays registered, so that Telegram keeps the updates
+        # until the bot (or another instance) is back
+        await server.stop()
+
+
+def run(application: Application) -> None:
+    """Runs the application with updates received through the webhook."""
+    asyncio.run(_run(application))
+
+
+async def _run(application: Application) -> None:
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    def handle(data: dict) -> None:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await serve(application.bot, handle, stopping)
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
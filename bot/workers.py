@@ -0,0 +1,73 @@
+"""
+Runs CPU-heavy tasks in a thread pool, so that the event loop stays responsive.
+Small tasks are executed inline, since handing them over to the pool costs more.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
+import time
+from typing import Callable, Optional, TypeVar
+
+from bot import metrics
+from bot.config import config
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def run(name: str, func: Callable[..., T], *args, size: Optional[int] = None) -> T:
+    """
+    Executes `func(*args)` and returns the result.
+    Runs the function in the worker pool unless the `size` of its input
+    is below the configured threshold. Without the `size`, always uses the pool.
+    Records the queue wait time and the run time under the `name`.
+    """
+    if size is not None and size < config.workers.threshold:
+        start = time.perf_counter()
+        result = func(*args)
+        _observe(name, wait=0.0, elapsed=time.perf_counter() - start)
+        return result
+
+    submitted_at = time.perf_counter()
+
+    def job() -> tuple[T, float, float]:
+        start = time.perf_counter()
+        result = func(*args)
+        return result, start - submitted_at, time.perf_counter() - start
+
+    loop = asyncio.get_running_loop()
+    # the job sees the caller's context, e.g. the config of the current bot
+    context = contextvars.copy_context()
+    result, wait, elapsed = await loop.run_in_executor(_get_executor(), context.run, job)
+    _observe(name, wait=wait, elapsed=elapsed)
+    logger.debug("task=%s, size=%s, wait=%.1fms, took=%.1fms", name, size, wait * 1e3, elapsed * 1e3)
+    return result
+
+
+def shutdown() -> None:
+    """Stops the worker pool, waiting for the running tasks to finish."""
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Returns the worker pool, creating it if necessary."""
+    global _executor
+    if not _executor:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.workers.threads, thread_name_prefix="worker"
+        )
+    return _executor
+
+
+def _observe(name: str, wait: float, elapsed: float) -> None:
+    """Records task timings in milliseconds."""
+    metrics.observe(f"workers.{name}.wait_ms", wait * 1e3)
+    metrics.observe(f"workers.{name}.run_ms", elapsed * 1e3)
@@ -1,11 +1,14 @@
+import asyncio
+import datetime as dt
 from typing import Optional
-from telegram import User
+from telegram import Chat, Message, User
 from bot import askers
 
 
 class FakeGPT:
     def __init__(self, error: Optional[Exception] = None):
         self.error = error
+        self.delay = 0
         self.prompt = None
         self.question = None
         self.history = None
@@ -14,10 +17,23 @@ class FakeGPT:
         self.prompt = prompt
         self.question = question
         self.history = history
+        if self.delay:
+            await asyncio.sleep(self.delay)
         if self.error:
             raise self.error
         return question
 
+    async def ask_stream(self, prompt: str, question: str, history: list):
+        self.prompt = prompt
+        self.question = question
+        self.history = history
+        for idx, word in enumerate(question.split(" ")):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.error:
+                raise self.error
+            yield word if idx == 0 else f" {word}"
+
 
 class FakeAssistant:
     def __init__(self, error: Optional[Exception] = None):
@@ -69,6 +85,10 @@ class FakeBot:
             can_read_all_group_messages=True,
         )
         self.text = ""
+        self.texts = []
+        self.edits = {}
+        self.deleted = []
+        self.n_sent = 0
 
     @property
     def username(self) -> str:
@@ -88,20 +108,37 @@ class FakeBot:
     async def send_chat_action(self, **kwargs) -> None:
         pass
 
-    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> Message:
         self.text = text
+        self.texts.append(text)
+        return self._sent(chat_id)
 
     async def send_document(
         self, chat_id: int, document: object, caption: str, filename: str, **kwargs
-    ) -> None:
+    ) -> Message:
         self.text = f"{caption}: {filename}"
+        return self._sent(chat_id)
 
-    async def send_photo(self, chat_id: int, photo: str, caption: str = None, **kwargs) -> None:
+    async def send_photo(self, chat_id: int, photo: str, caption: str = None, **kwargs) -> Message:
         self.text = f"{caption}: {photo}"
+        return self._sent(chat_id)
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, **kwargs) -> None:
+        self.text = text
+        self.edits[message_id] = text
+
+    async def delete_message(self, chat_id: int, message_id: int, **kwargs) -> bool:
+        self.deleted.append(message_id)
+        return True
 
     async def get_me(self, **kwargs) -> User:
         return self.user
 
+    def _sent(self, chat_id: int) -> Message:
+        self.n_sent += 1
+        chat = Chat(id=chat_id, type=Chat.PRIVATE if chat_id > 0 else Chat.GROUP)
+        return Message(message_id=1000 + self.n_sent, date=dt.datetime.now(), chat=chat)
+
 
 class FakeApplication:
     def __init__(self, bot: FakeBot) -> None:
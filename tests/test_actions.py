@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+
+from telegram.constants import ChatAction
+
+from bot import logs
+from bot.actions import ActionScheduler
+from bot.config import Config, current, use
+
+
+class FakeBot:
+    def __init__(self, username: str = "bot") -> None:
+        self.username = username
+        self.actions = []
+
+        self.contexts = []
+
+    async def send_chat_action(self, chat_id: int, action: str, message_thread_id=None) -> None:
+        self.actions.append((chat_id, message_thread_id, action))
+        self.contexts.append((current().filename, logs.request_id.get()))
+
+
+class ActionSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.bot = FakeBot()
+        self.scheduler = ActionScheduler(interval=0.05)
+
+    async def _work(self, chat_id: int, action: str = ChatAction.TYPING, thread_id=None) -> None:
+        async with self.scheduler.show(self.bot, chat_id, thread_id, action=action):
+            await asyncio.sleep(0.12)
+
+    async def test_single(self):
+        await self._work(1)
+        self.assertTrue(2 <= len(self.bot.actions) <= 3)
+        self.assertEqual(self.bot.actions[0], (1, None, ChatAction.TYPING))
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_dedup(self):
+        await asyncio.gather(*(self._work(1) for _ in range(5)))
+        self.assertTrue(2 <= len(self.bot.actions) <= 3)
+
+    async def test_chats(self):
+        await asyncio.gather(self._work(1), self._work(2), self._work(1, thread_id=10))
+        keys = {(chat_id, thread_id) for chat_id, thread_id, _ in self.bot.actions}
+        self.assertEqual(keys, {(1, None), (2, None), (1, 10)})
+
+    async def test_bots(self):
+        other = FakeBot("other")
+
+        async def work(bot: FakeBot) -> None:
+            async with self.scheduler.show(bot, 1):
+                await asyncio.sleep(0.12)
+
+        await asyncio.gather(work(self.bot), work(other))
+        self.assertEqual(self.bot.actions[0], (1, None, ChatAction.TYPING))
+        self.assertEqual(other.actions[0], (1, None, ChatAction.TYPING))
+
+    async def test_precedence(self):
+        await asyncio.gather(self._work(1), self._work(1, action=ChatAction.UPLOAD_PHOTO))
+        self.assertEqual(self.bot.actions[-1], (1, None, ChatAction.UPLOAD_PHOTO))
+
+    async def test_stop(self):
+        await self._work(1)
+        n_actions = len(self.bot.actions)
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(self.bot.actions), n_actions)
+        self.assertTrue(self.scheduler._task.done())
+
+    async def test_context(self):
+        other = FakeBot("other")
+        src = {
+            "telegram": {"token": "tg-1234"},
+            "openai": {"api_key": "oa-1234"},
+            "conversation": {},
+            "imagine": {},
+        }
+        configs = [Config("config.first.yml", src), Config("config.second.yml", src)]
+
+        async def work(bot: FakeBot, config: Config, request_id: str) -> None:
+            use(config)
+            logs.request_id.set(request_id)
+            async with self.scheduler.show(bot, 1):
+                await asyncio.sleep(0.12)
+
+        # each bot runs in its own task, as in multibot.run
+        await asyncio.gather(
+            asyncio.create_task(work(self.bot, configs[0], "11")),
+            asyncio.create_task(work(other, configs[1], "12")),
+        )
+        self.assertEqual(set(self.bot.contexts), {("config.first.yml", "-")})
+        self.assertEqual(set(other.contexts), {("config.second.yml", "-")})
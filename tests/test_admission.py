@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+from bot import admission
+from bot import metrics
+from bot.config import config
+
+
+class AdmissionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.limit = config.admission.limit
+        self.queue_size = config.admission.queue_size
+        config.admission.limit = 1
+        config.admission.queue_size = 10
+        self.admission = admission.Admission()
+        self.order = []
+        self.gate = asyncio.Event()
+
+    def tearDown(self) -> None:
+        config.admission.limit = self.limit
+        config.admission.queue_size = self.queue_size
+
+    async def _work(self, chat_id: int, name: str, weight: float = 1) -> None:
+        async with self.admission.slot(chat_id, weight):
+            self.order.append(name)
+            await self.gate.wait()
+
+    async def _start(self, *args) -> asyncio.Task:
+        task = asyncio.create_task(self._work(*args))
+        await asyncio.sleep(0)
+        return task
+
+    async def test_limit(self):
+        first = await self._start(1, "a1")
+        second = await self._start(2, "b1")
+        self.assertEqual(self.admission.n_running, 1)
+        self.assertEqual(self.admission.n_queued, 1)
+        self.gate.set()
+        await asyncio.gather(first, second)
+        self.assertEqual(self.order, ["a1", "b1"])
+        self.assertEqual(self.admission.n_running, 0)
+        self.assertEqual(self.admission.n_queued, 0)
+
+    async def test_fair_queuing(self):
+        tasks = [await self._start(0, "running")]
+        # a flood from chat 1, then a single question from chat 2
+        for idx in range(3):
+            tasks.append(await self._start(1, f"a{idx}"))
+        tasks.append(await self._start(2, "b0"))
+        self.gate.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.order, ["running", "a0", "b0", "a1", "a2"])
+
+    async def test_weights(self):
+        tasks = [await self._start(0, "running")]
+        for idx in range(4):
+            tasks.append(await self._start(1, f"a{idx}", 1))
+            tasks.append(await self._start(2, f"b{idx}", 2))
+        self.gate.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(
+            self.order, ["running", "b0", "a0", "b1", "b2", "a1", "b3", "a2", "a3"]
+        )
+
+    async def test_busy(self):
+        config.admission.queue_size = 1
+        first = await self._start(1, "a0")
+        second = await self._start(1, "a1")
+        with self.assertRaises(admission.Busy) as ctx:
+            async with self.admission.slot(2):
+                pass
+        self.assertTrue(ctx.exception.retry_after >= 1)
+        self.assertEqual(self.admission.n_rejected, 1)
+        self.gate.set()
+        await asyncio.gather(first, second)
+
+    async def test_cancel(self):
+        first = await self._start(1, "a0")
+        second = await self._start(2, "b0")
+        third = await self._start(3, "c0")
+        second.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(self.admission.n_queued, 1)
+        self.gate.set()
+        await asyncio.gather(first, third)
+        self.assertEqual(self.order, ["a0", "c0"])
+        self.assertEqual(self.admission.n_running, 0)
+
+    async def test_no_limit(self):
+        config.admission.limit = 0
+        tasks = [await self._start(1, f"a{idx}") for idx in range(5)]
+        self.assertEqual(self.admission.n_running, 5)
+        self.gate.set()
+        await asyncio.gather(*tasks)
+
+    async def test_metrics(self):
+        count = metrics.summary("admission.wait_ms").count
+        self.gate.set()
+        await self._work(1, "a0")
+        self.assertEqual(metrics.summary("admission.wait_ms").count, count + 1)
+        self.assertEqual(metrics.gauges()["admission.running"], 0)
+
+
+class WeightOfTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.weights = config.admission.weights
+        config.admission.weights = {"private": 2, -100: 5}
+
+    def tearDown(self) -> None:
+        config.admission.weights = self.weights
+
+    def test_weight_of(self):
+        self.assertEqual(admission.weight_of(1, "private"), 2)
+        self.assertEqual(admission.weight_of(-100, "group"), 5)
+        self.assertEqual(admission.weight_of(-200, "group"), 1)
@@ -1,6 +1,10 @@
+import json
 import unittest
+
+import httpx
+
 from bot.config import config
-from bot.ai import chat
+from bot.ai import assistant, chat
 from bot.models import UserMessage
 
 
@@ -89,3 +93,57 @@ class ShortenTest(unittest.TestCase):
                 {"role": "user", "content": "Is it cold today?"},
             ],
         )
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.client = chat.client
+        self.requests = []
+
+    async def asyncTearDown(self) -> None:
+        await chat.client.aclose()
+        chat.client = self.client
+
+    def _serve(self, status_code: int, body: str) -> None:
+        def handle(request: httpx.Request) -> httpx.Response:
+            self.requests.append(json.loads(request.content))
+            return httpx.Response(status_code, text=body)
+
+        chat.client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+    async def test_stream(self):
+        events = [
+            {"choices": [{"delta": {"role": "assistant"}}]},
+            {"choices": [{"delta": {"content": "Hello"}}]},
+            {"choices": [{"delta": {"content": ", world"}}]},
+            {"choices": []},
+        ]
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        self._serve(200, body)
+        model = chat.Model("gpt")
+        parts = [part async for part in model.ask_stream("", "Hi", [])]
+        self.assertEqual(parts, ["Hello", ", world"])
+        self.assertTrue(self.requests[0]["stream"])
+        self.assertEqual(self.requests[0]["model"], "gpt")
+
+    async def test_error(self):
+        self._serve(401, json.dumps({"error": {"message": "invalid api key"}}))
+        model = chat.Model("gpt")
+        with self.assertRaises(Exception) as ctx:
+            async for _ in model.ask_stream("", "Hi", []):
+                pass
+        self.assertIn("invalid api key", str(ctx.exception))
+
+
+class AssistantClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_shared(self):
+        client = assistant.get_client("sk-test", None)
+        self.assertIs(assistant.get_client("sk-test", None), client)
+        self.assertIsNot(assistant.get_client("sk-other", None), client)
+
+    async def test_close(self):
+        client = assistant.get_client("sk-test", None)
+        await assistant.close()
+        self.assertTrue(client.is_closed())
+        self.assertIsNot(assistant.get_client("sk-test", None), client)
+        await assistant.close()
@@ -0,0 +1,69 @@
+import unittest
+from bot import budget
+
+
+class CountTokensTest(unittest.TestCase):
+    def test_count(self):
+        self.assertEqual(budget.count_tokens(""), 0)
+        self.assertEqual(budget.count_tokens("one two three four five"), 6)
+
+
+class SplitTest(unittest.TestCase):
+    def test_enough(self):
+        shares = budget.split(100, [10, 20, 30])
+        self.assertEqual(shares, [10, 20, 30])
+
+    def test_equal(self):
+        shares = budget.split(90, [100, 200, 300])
+        self.assertEqual(shares, [30, 30, 30])
+
+    def test_redistribute(self):
+        shares = budget.split(100, [10, 200, 300])
+        self.assertEqual(shares, [10, 45, 45])
+
+    def test_empty(self):
+        self.assertEqual(budget.split(100, []), [])
+        self.assertEqual(budget.split(0, [10, 20]), [0, 0])
+
+
+class TrimTest(unittest.TestCase):
+    def test_fits(self):
+        text = "Cats like boxes.\n\nNobody knows why."
+        self.assertEqual(budget.trim(text, 100), text)
+
+    def test_relevant(self):
+        paragraphs = [
+            "Cats and boxes",
+            "Cats sleep a lot during the day and night.",
+            "Some breeds are more active than others.",
+            "Boxes make cats feel safe and warm.",
+            "Dogs do not care about boxes at all.",
+        ]
+        text = "\n\n".join(paragraphs)
+        trimmed = budget.trim(text, 30, query="Why do cats like boxes?")
+        self.assertEqual(
+            trimmed,
+            "Cats and boxes\n\n"
+            "[... 2 paragraphs omitted ...]\n\n"
+            "Boxes make cats feel safe and warm.\n\n"
+            "[... 1 paragraph omitted ...]",
+        )
+
+    def test_head_tail(self):
+        paragraphs = [f"Paragraph number {idx} goes here." for idx in range(10)]
+        text = "\n\n".join(paragraphs)
+        trimmed = budget.trim(text, 40)
+        self.assertEqual(
+            trimmed,
+            "Paragraph number 0 goes here.\n\n"
+            "Paragraph number 1 goes here.\n\n"
+            "Paragraph number 2 goes here.\n\n"
+            "[... 5 paragraphs omitted ...]\n\n"
+            "Paragraph number 8 goes here.\n\n"
+            "Paragraph number 9 goes here.",
+        )
+
+    def test_words(self):
+        text = " ".join(f"w{idx}" for idx in range(100))
+        trimmed = budget.trim(text, 20)
+        self.assertEqual(trimmed, "w0 w1 w2 w3 w4 w5 w6\n\n[... 90 words omitted ...]\n\nw97 w98 w99")
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from bot import coalesce
+
+
+async def text(value: str, delay: float = 0) -> str:
+    await asyncio.sleep(delay)
+    return value
+
+
+class CoalescerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.bursts = coalesce.Coalescer()
+
+    async def test_single(self):
+        question = await self.bursts.collect(1, 11, text("Hello"), window=0.01)
+        self.assertEqual(question, "Hello")
+        self.assertEqual(len(self.bursts), 0)
+
+    async def test_burst(self):
+        results = await asyncio.gather(
+            self.bursts.collect(1, 11, text("Hello"), window=0.05),
+            self.bursts.collect(1, 12, text("How are you?"), window=0.05),
+            self.bursts.collect(1, 13, text("What's up?"), window=0.05),
+        )
+        self.assertEqual(results, ["", "", "Hello\n\nHow are you?\n\nWhat's up?"])
+        self.assertEqual(len(self.bursts), 0)
+
+    async def test_order(self):
+        # the first message takes longer to extract
+        results = await asyncio.gather(
+            self.bursts.collect(1, 11, text("document.txt", delay=0.05), window=0.01),
+            self.bursts.collect(1, 12, text("Summarize it"), window=0.01),
+        )
+        self.assertEqual(results, ["", "document.txt\n\nSummarize it"])
+
+    async def test_keys(self):
+        results = await asyncio.gather(
+            self.bursts.collect(1, 11, text("Hello"), window=0.01),
+            self.bursts.collect(2, 21, text("Hi"), window=0.01),
+        )
+        self.assertEqual(results, ["Hello", "Hi"])
+
+    async def test_separate(self):
+        first = await self.bursts.collect(1, 11, text("Hello"), window=0.01)
+        second = await self.bursts.collect(1, 12, text("Hi"), window=0.01)
+        self.assertEqual((first, second), ("Hello", "Hi"))
+
+    async def test_error(self):
+        async def fail() -> str:
+            raise ValueError("failed to download")
+
+        results = await asyncio.gather(
+            self.bursts.collect(1, 11, text("Hello"), window=0.01),
+            self.bursts.collect(1, 12, fail(), window=0.01),
+            return_exceptions=True,
+        )
+        self.assertEqual(results[0], "Hello")
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(len(self.bursts), 0)
+
+
+class MergeTest(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual(coalesce.merge(["Hello", "", "Hi"]), "Hello\n\nHi")
+
+    def test_single(self):
+        self.assertEqual(coalesce.merge(["+ Hello"]), "+ Hello")
+
+    def test_follow_up(self):
+        self.assertEqual(coalesce.merge(["Hello", "+ Hi"]), "+ Hello\n\nHi")
@@ -1,13 +1,18 @@
+import asyncio
 import datetime as dt
 import unittest
-from telegram import Chat, Message, MessageEntity, Update, User
+from telegram import Chat, Document, Message, MessageEntity, Update, User
 from telegram.constants import ChatType
 from telegram.ext import CallbackContext
 from telegram.ext import filters as tg_filters
 
+from bot import admission
 from bot import askers
 from bot import bot
 from bot import commands
+from bot import deadline
+from bot import inflight
+from bot import locks
 from bot import models
 from bot.config import config
 from bot.filters import Filters
@@ -32,6 +37,18 @@ class Helper:
         message.set_bot(self.bot)
         return Update(update_id=update_id, message=message)
 
+    def _edit(self, update: Update, text: str) -> Update:
+        message = Message(
+            message_id=update.message.message_id,
+            date=update.message.date,
+            edit_date=dt.datetime.now(),
+            chat=self.chat,
+            text=text,
+            from_user=update.message.from_user,
+        )
+        message.set_bot(self.bot)
+        return Update(update_id=update.update_id + 100, edited_message=message)
+
 
 class StartTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
@@ -196,6 +213,49 @@ class ConfigTest(unittest.IsolatedAsyncioTestCase, Helper):
         self.assertEqual(self.filters.chats.chat_ids, frozenset([-100500]))
 
 
+class StatsTest(unittest.IsolatedAsyncioTestCase, Helper):
+    def setUp(self):
+        self.bot = FakeBot("bot")
+        self.chat = Chat(id=1, type=ChatType.PRIVATE)
+        self.chat.set_bot(self.bot)
+        self.application = FakeApplication(self.bot)
+        self.context = CallbackContext(self.application, chat_id=1, user_id=1)
+        self.user = User(id=1, first_name="Alice", is_bot=False, username="alice")
+        self.command = commands.Stats()
+
+    async def test_stats(self):
+        update = self._create_update(11, "/stats")
+        await self.command(update, self.context)
+        self.assertTrue(self.bot.text.startswith("<pre>Questions:\n- running: 0\n- queued: 0"))
+
+
+class CancelTest(unittest.IsolatedAsyncioTestCase, Helper):
+    def setUp(self):
+        inflight.answers = inflight.Registry()
+        self.bot = FakeBot("bot")
+        self.chat = Chat(id=1, type=ChatType.PRIVATE)
+        self.chat.set_bot(self.bot)
+        self.application = FakeApplication(self.bot)
+        self.context = CallbackContext(self.application, chat_id=1, user_id=1)
+        self.user = User(id=1, first_name="Alice", is_bot=False, username="alice")
+        self.command = commands.Cancel()
+
+    async def test_cancel(self):
+        task = asyncio.create_task(
+            inflight.answers.run((1, 11), user_id=1, question="Hi", answer=asyncio.sleep(10))
+        )
+        await asyncio.sleep(0)
+        update = self._create_update(12, "/cancel")
+        await self.command(update, self.context)
+        self.assertEqual(self.bot.text, "✓ Cancelled 1 answers")
+        self.assertFalse(await task)
+
+    async def test_help(self):
+        update = self._create_update(12, "/cancel everything")
+        await self.command(update, self.context)
+        self.assertTrue(self.bot.text.startswith("Syntax:"))
+
+
 class ModelPrivateTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
         self.bot = FakeBot("bot")
@@ -219,6 +279,16 @@ class ModelPrivateTest(unittest.IsolatedAsyncioTestCase, Helper):
         self.assertTrue(self.bot.text.startswith("✓ Set model"))
         self.assertEqual(self.application.chat_data[1]["model"], "gpt-5")
 
+    async def test_chat_lock(self):
+        update = self._create_update(11, text="/model gpt-5")
+        async with locks.chats.hold(1):
+            task = asyncio.create_task(self.command(update, self.context))
+            await asyncio.sleep(0.01)
+            # another settings change in the chat is in progress
+            self.assertEqual(self.application.chat_data[1], {})
+        await task
+        self.assertEqual(self.application.chat_data[1]["model"], "gpt-5")
+
     async def test_show(self):
         update = self._create_update(11, text="/model gpt-5")
         await self.command(update, self.context)
@@ -332,6 +402,7 @@ class PromptGroupTest(unittest.IsolatedAsyncioTestCase, Helper):
 
 class RetryTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
+        inflight.answers = inflight.Registry()
         mock_text_asker(FakeGPT())
         self.bot = FakeBot("bot")
         self.chat = Chat(id=1, type=ChatType.PRIVATE)
@@ -352,6 +423,7 @@ class RetryTest(unittest.IsolatedAsyncioTestCase, Helper):
 
 class ImagineTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
+        inflight.answers = inflight.Registry()
         askers.ImagineAsker.model = FakeDalle()
         self.bot = FakeBot("bot")
         self.chat = Chat(id=1, type=ChatType.PRIVATE)
@@ -395,6 +467,7 @@ class ImagineTest(unittest.IsolatedAsyncioTestCase, Helper):
 
 class MessageTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
+        inflight.answers = inflight.Registry()
         self.ai = FakeGPT()
         mock_text_asker(self.ai)
         self.bot = FakeBot("bot")
@@ -413,6 +486,36 @@ class MessageTest(unittest.IsolatedAsyncioTestCase, Helper):
         self.assertEqual(self.ai.question, "What is your name?")
         self.assertEqual(self.ai.history, [])
 
+    async def test_stream(self):
+        interval = config.conversation.stream_interval
+        config.conversation.stream_interval = 0.03
+        self.ai.delay = 0.02
+        try:
+            update = self._create_update(11, text="What is your **name**?")
+            await self.command(update, self.context)
+        finally:
+            config.conversation.stream_interval = interval
+        # the draft shows the beginning of the answer, and the answer replaces it
+        self.assertEqual(self.bot.texts, ["What"])
+        self.assertEqual(self.bot.edits[1001], "What is your <b>name</b>?")
+        self.assertEqual(self.bot.deleted, [])
+
+    async def test_stream_error(self):
+        interval = config.conversation.stream_interval
+        config.conversation.stream_interval = 0.01
+        self.ai.delay = 0.02
+        try:
+            task = asyncio.create_task(
+                self.command(self._create_update(11, text="What is your name?"), self.context)
+            )
+            await asyncio.sleep(0.05)
+            self.ai.error = Exception("connection lost")
+            await task
+        finally:
+            config.conversation.stream_interval = interval
+        # the draft of the failed answer is deleted
+        self.assertEqual(self.bot.deleted, [1001])
+
     async def test_follow_up(self):
         update = self._create_update(11, text="What is your name?")
         await self.command(update, self.context)
@@ -435,16 +538,166 @@ class MessageTest(unittest.IsolatedAsyncioTestCase, Helper):
             ],
         )
 
+    async def test_deadline(self):
+        timeout = config.deadline.timeout
+        config.deadline.timeout = 0.05
+        try:
+            deadline.start(ChatType.PRIVATE)
+            self.ai.delay = 1
+            update = self._create_update(11, text="What is your name?")
+            await self.command(update, self.context)
+        finally:
+            config.deadline.timeout = timeout
+            self.ai.delay = 0
+        self.assertEqual(self.bot.text, "Sorry, this took too long. Please try again.")
+
+    async def test_edited(self):
+        update = self._create_update(11, text="What is your name?")
+        await self.command(update, self.context)
+        self.assertEqual(self.bot.texts, ["What is your name?"])
+
+        update = self._edit(update, text="How old are you?")
+        await self.command(update, self.context)
+        # the earlier reply is replaced
+        self.assertEqual(self.bot.texts, ["What is your name?"])
+        self.assertEqual(self.bot.edits, {1001: "How old are you?"})
+
+    async def test_edited_in_progress(self):
+        self.ai.delay = 1
+        update = self._create_update(11, text="What is your name?")
+        first = asyncio.create_task(self.command(update, self.context))
+        await asyncio.sleep(0.01)
+
+        self.ai.delay = 0
+        await self.command(self._edit(update, text="How old are you?"), self.context)
+        await first
+        # the answer to the earlier version is cancelled
+        self.assertEqual(self.bot.texts, ["How old are you?"])
+        user = models.UserData(self.context.user_data)
+        self.assertEqual(user.messages.as_list(), [("How old are you?", "How old are you?")])
+
+    async def test_superseded(self):
+        self.ai.delay = 1
+        update = self._create_update(11, text="What is your name?")
+        first = asyncio.create_task(self.command(update, self.context))
+        await asyncio.sleep(0.01)
+
+        self.ai.delay = 0
+        update = self._create_update(12, text="+ And how old are you?")
+        await self.command(update, self.context)
+        await first
+        # the follow-up is answered together with the question
+        self.assertEqual(self.ai.question, "What is your name?\n\nAnd how old are you?")
+        self.assertEqual(self.bot.texts, ["What is your name?\n\nAnd how old are you?"])
+
+    async def test_superseded_plus(self):
+        self.ai.delay = 1
+        update = self._create_update(11, text="What is C?")
+        first = asyncio.create_task(self.command(update, self.context))
+        await asyncio.sleep(0.01)
+
+        self.ai.delay = 0
+        update = self._create_update(12, text="+ And C++")
+        await self.command(update, self.context)
+        await first
+        self.assertEqual(self.ai.question, "What is C?\n\nAnd C++")
+
+    async def test_debounce(self):
+        debounce = config.conversation.debounce
+        config.conversation.debounce = 0.05
+        try:
+            await asyncio.gather(
+                self.command(self._create_update(11, text="Hi!"), self.context),
+                self.command(self._create_update(12, text="What is your name?"), self.context),
+            )
+        finally:
+            config.conversation.debounce = debounce
+        self.assertEqual(self.ai.question, "Hi!\n\nWhat is your name?")
+        self.assertEqual(self.bot.texts, ["Hi!\n\nWhat is your name?"])
+
+    async def test_media_group(self):
+        updates = [
+            self._create_update(
+                update_id,
+                caption=caption,
+                media_group_id="album",
+                document=Document(
+                    file_id=name, file_unique_id=name, file_name=name, file_size=1234
+                ),
+            )
+            for update_id, name, caption in [(11, "a.txt", None), (12, "b.txt", "Compare")]
+        ]
+        await asyncio.gather(*(self.command(update, self.context) for update in updates))
+        self.assertEqual(
+            self.ai.question,
+            "a.txt:\n```\nfile content\n```\n\nCompare\n\nb.txt:\n```\nfile content\n```",
+        )
+        self.assertEqual(len(self.bot.texts), 1)
+
     async def test_forward(self):
         update = self._create_update(11, text="What is your name?", forward_date=dt.datetime.now())
         await self.command(update, self.context)
         self.assertTrue(self.bot.text.startswith("This is a forwarded message"))
 
-    async def test_document(self):
+    async def test_long_answer(self):
         update = self._create_update(11, text="I have so much to say" + "." * 5000)
         await self.command(update, self.context)
+        self.assertEqual(self.bot.texts[0], "I have so much to say" + "." * 4075)
+        self.assertEqual(self.bot.texts[1], "." * 925)
+
+    async def test_document(self):
+        update = self._create_update(11, text="I have so much to say" + "." * 25000)
+        await self.command(update, self.context)
         self.assertEqual(self.bot.text, "I have so much to... (see attachment for the rest): 11.md")
 
+    async def test_busy(self):
+        queue_size = config.admission.queue_size
+        config.admission.queue_size = 0
+        admission.questions.n_running += config.admission.limit
+        try:
+            update = self._create_update(11, text="What is your name?")
+            await self.command(update, self.context)
+            self.assertTrue(self.bot.text.startswith("I'm busy, try again in"))
+            self.assertIsNone(self.ai.question)
+        finally:
+            admission.questions.n_running -= config.admission.limit
+            config.admission.queue_size = queue_size
+
+    async def test_busy_user(self):
+        # one user's burst must not take the slots from other users
+        class Burst(FakeGPT):
+            def __init__(self):
+                super().__init__()
+                self.released = asyncio.Event()
+
+            async def ask(self, prompt, question, history):
+                if question.startswith("Alice"):
+                    await self.released.wait()
+                else:
+                    self.released.set()
+                return question
+
+        mock_text_asker(Burst())
+        limit, queue_size = config.admission.limit, config.admission.queue_size
+        config.admission.limit, config.admission.queue_size = 2, 10
+        self.addCleanup(setattr, config.admission, "limit", limit)
+        self.addCleanup(setattr, config.admission, "queue_size", queue_size)
+        config.telegram.usernames = ["alice", "erik"]
+
+        updates = [self._create_update(11 + idx, text=f"Alice #{idx}") for idx in range(3)]
+        erik = User(id=2, first_name="Erik", is_bot=False, username="erik")
+        self.chat = Chat(id=2, type=ChatType.PRIVATE)
+        self.chat.set_bot(self.bot)
+        self.application.user_data[2] = {}
+        self.application.chat_data[2] = {}
+        erik_update = self._create_update(21, text="Erik", user=erik)
+        erik_context = CallbackContext(self.application, chat_id=2, user_id=2)
+
+        calls = [self.command(update, self.context) for update in updates]
+        calls.append(self.command(erik_update, erik_context))
+        await asyncio.wait_for(asyncio.gather(*calls), timeout=1)
+        self.assertEqual(self.bot.texts[0], "Erik")
+
     async def test_exception(self):
         ai = FakeGPT(error=Exception("connection timeout"))
         mock_text_asker(ai)
@@ -456,7 +709,9 @@ class MessageTest(unittest.IsolatedAsyncioTestCase, Helper):
 
 class MessageGroupTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
-        mock_text_asker(FakeGPT())
+        inflight.answers = inflight.Registry()
+        self.ai = FakeGPT()
+        mock_text_asker(self.ai)
         self.bot = FakeBot("bot")
         self.chat = Chat(id=1, type=ChatType.GROUP)
         self.chat.set_bot(self.bot)
@@ -481,9 +736,56 @@ class MessageGroupTest(unittest.IsolatedAsyncioTestCase, Helper):
         await self.command(update, self.context)
         self.assertEqual(self.bot.text, "")
 
+    def _answer(self) -> Message:
+        """Returns the last message sent by the bot."""
+        message = Message(
+            message_id=1000 + self.bot.n_sent,
+            date=dt.datetime.now(),
+            chat=self.chat,
+            text=self.bot.text,
+            from_user=self.user_bot,
+        )
+        message.set_bot(self.bot)
+        return message
+
+    async def test_reply_chain(self):
+        mention = MessageEntity(type=MessageEntity.MENTION, offset=0, length=4)
+        update = self._create_update(11, text="@bot What is your name?", entities=(mention,))
+        await self.command(update, self.context)
+        self.assertEqual(self.ai.history, [])
+
+        update = self._create_update(12, text="And why?", reply_to_message=self._answer())
+        await self.command(update, self.context)
+        self.assertEqual(self.ai.question, "And why?")
+        self.assertEqual(self.ai.history, [("What is your name?", "What is your name?")])
+
+        # another user joins the conversation
+        update = self._create_update(
+            13, text="Where are you?", reply_to_message=self._answer(), user=self.user_erik
+        )
+        await self.command(update, self.context)
+        self.assertEqual(self.ai.question, "Where are you?")
+        self.assertEqual(
+            self.ai.history,
+            [("What is your name?", "What is your name?"), ("And why?", "And why?")],
+        )
+
+    async def test_reply_unknown(self):
+        answer = Message(
+            message_id=99,
+            date=dt.datetime.now(),
+            chat=self.chat,
+            text="I am a bot",
+            from_user=self.user_bot,
+        )
+        update = self._create_update(11, text="Why?", reply_to_message=answer)
+        await self.command(update, self.context)
+        self.assertEqual(self.ai.history, [("", "I am a bot")])
+
 
 class MessageLimitTest(unittest.IsolatedAsyncioTestCase, Helper):
     def setUp(self):
+        inflight.answers = inflight.Registry()
         self.ai = FakeGPT()
         mock_text_asker(self.ai)
         self.bot = FakeBot("bot")
@@ -536,7 +838,7 @@ class MessageLimitTest(unittest.IsolatedAsyncioTestCase, Helper):
         update = self._create_update(11, text="What is your name?", user=user)
         await self.command(update, context)
         self.assertEqual(self.bot.text, "What is your name?")
-        self.assertEqual(user_data["message_counter"]["value"], 1)
+        self.assertEqual(user_data["message_counter"].value, 1)
 
     async def test_unlimited(self):
         config.conversation.message_limit.count = 0
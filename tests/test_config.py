@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from bot.config import Config, ConfigEditor, SchemaMigrator
+from bot.config import Config, ConfigEditor, PerBot, SchemaMigrator, config, use
 
 
 class ConfigTest(unittest.TestCase):
@@ -228,6 +229,11 @@ class SetValueTest(unittest.TestCase):
         _, is_immediate, _ = self.editor.set_value("telegram.token", "tg-5678")
         self.assertFalse(is_immediate)
 
+    def test_is_delayed_nested(self):
+        _, is_immediate, _ = self.editor.set_value("pipeline.limits.ask", "4")
+        self.assertFalse(is_immediate)
+        self.assertEqual(self.editor.config.pipeline.limits["ask"], 4)
+
 
 class MigrateTest(unittest.TestCase):
     def test_migrate_v1(self):
@@ -374,3 +380,42 @@ class MigrateTest(unittest.TestCase):
         migrated, has_changed = SchemaMigrator.migrate(data)
         self.assertFalse(has_changed)
         self.assertEqual(migrated, data)
+
+
+class PerBotTest(unittest.IsolatedAsyncioTestCase):
+    async def test_use(self):
+        first = Config("config.first.yml", _src(conversation={"depth": 1}))
+        second = Config("config.second.yml", _src(conversation={"depth": 2}))
+
+        async def depth_of(conf: Config) -> int:
+            use(conf)
+            await asyncio.sleep(0)
+            return config.conversation.depth
+
+        depths = await asyncio.gather(depth_of(first), depth_of(second))
+        self.assertEqual(depths, [1, 2])
+
+    async def test_instances(self):
+        counters = PerBot(lambda: {"n": 0})
+
+        async def count(conf: Config, n: int) -> int:
+            use(conf)
+            for _ in range(n):
+                counters.get()["n"] += 1
+                await asyncio.sleep(0)
+            return counters.get()["n"]
+
+        first = Config("config.first.yml", _src())
+        second = Config("config.second.yml", _src())
+        counts = await asyncio.gather(count(first, 3), count(second, 5))
+        self.assertEqual(counts, [3, 5])
+
+
+def _src(**kwargs) -> dict:
+    src = {
+        "telegram": {"token": "tg-1234"},
+        "openai": {"api_key": "oa-1234"},
+        "conversation": {},
+        "imagine": {},
+    }
+    return {**src, **kwargs}
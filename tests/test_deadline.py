@@ -0,0 +1,74 @@
+import asyncio
+import unittest
+
+from bot import deadline
+from bot.config import Deadline, config
+
+
+class DeadlineTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.settings = config.deadline
+        config.deadline = Deadline(
+            timeout=60,
+            chat_types={"group": 30},
+            commands={"imagine": 90},
+            fast_model="gpt-4o-mini",
+            fast_below=20,
+            tokens_per_second=10,
+        )
+
+    def tearDown(self):
+        config.deadline = self.settings
+
+    async def test_unlimited(self):
+        # no limit by default
+        config.deadline = Deadline()
+        deadline.start("private")
+        self.assertIsNone(deadline.remaining())
+        self.assertFalse(deadline.expired())
+        self.assertEqual(deadline.timeout(3), 3)
+        self.assertIsNone(deadline.timeout(None))
+        self.assertEqual(deadline.model("gpt-4o"), "gpt-4o")
+        self.assertEqual(deadline.max_tokens(4096), 4096)
+
+    async def test_start(self):
+        deadline.start("private")
+        self.assertAlmostEqual(deadline.remaining(), 60, delta=1)
+        deadline.start("group")
+        self.assertAlmostEqual(deadline.remaining(), 30, delta=1)
+        deadline.start("group", "imagine")
+        self.assertAlmostEqual(deadline.remaining(), 90, delta=1)
+
+    async def test_timeout(self):
+        deadline.start("private")
+        self.assertEqual(deadline.timeout(3), 3)
+        self.assertAlmostEqual(deadline.timeout(120), 60, delta=1)
+        self.assertAlmostEqual(deadline.timeout(None), 60, delta=1)
+
+    async def test_missed(self):
+        deadline._deadline.set(deadline.time.monotonic() - 1)
+        self.assertTrue(deadline.expired())
+        with self.assertRaises(deadline.Missed):
+            deadline.check()
+        with self.assertRaises(deadline.Missed):
+            deadline.timeout(3)
+
+    async def test_adapt(self):
+        deadline.start("private")
+        self.assertEqual(deadline.model("gpt-4o"), "gpt-4o")
+        self.assertEqual(deadline.max_tokens(100), 100)
+        self.assertLessEqual(deadline.max_tokens(4096), 600)
+
+        deadline._deadline.set(deadline.time.monotonic() + 10)
+        self.assertEqual(deadline.model("gpt-4o"), "gpt-4o-mini")
+        self.assertLessEqual(deadline.max_tokens(4096), 100)
+
+    async def test_isolated(self):
+        async def remaining_in(chat_type: str) -> float:
+            deadline.start(chat_type)
+            return deadline.remaining()
+
+        # each update is processed in its own task
+        private, group = await asyncio.gather(remaining_in("private"), remaining_in("group"))
+        self.assertGreater(private, group)
+        self.assertIsNone(deadline.remaining())
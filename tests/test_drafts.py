@@ -0,0 +1,47 @@
+import datetime as dt
+import unittest
+
+from telegram import Chat, Message
+from telegram.constants import MessageLimit
+
+from bot import drafts
+from tests.mocks import FakeBot
+
+
+class DraftTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bot = FakeBot("bot")
+        chat = Chat(id=1, type=Chat.PRIVATE)
+        self.message = Message(message_id=11, date=dt.datetime.now(), chat=chat, text="Hi")
+        self.message.set_bot(self.bot)
+
+    async def test_interval(self):
+        draft = drafts.Draft(self.message, interval=60)
+        await draft.feed("Hello")
+        await draft.feed(", **world**")
+        # too early to update the draft
+        self.assertEqual(self.bot.texts, ["Hello"])
+        self.assertEqual(self.bot.edits, {})
+        self.assertEqual(draft.text, "Hello, **world**")
+        self.assertEqual(draft.message_ids, [1001])
+
+    async def test_edit(self):
+        draft = drafts.Draft(self.message, interval=0)
+        await draft.feed("Hello")
+        await draft.feed(", **world**")
+        self.assertEqual(self.bot.edits, {1001: "Hello, <b>world</b>"})
+
+    async def test_long(self):
+        draft = drafts.Draft(self.message, interval=0)
+        await draft.feed("word " * 1000)
+        await draft.feed("more")
+        # only the first message of the answer is shown
+        self.assertLessEqual(len(self.bot.text), MessageLimit.MAX_TEXT_LENGTH)
+        self.assertEqual(self.bot.edits, {})
+
+    async def test_discard(self):
+        draft = drafts.Draft(self.message, interval=0)
+        await draft.feed("Hello")
+        await draft.discard()
+        self.assertEqual(self.bot.deleted, [1001])
+        self.assertEqual(draft.message_ids, [])
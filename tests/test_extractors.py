@@ -0,0 +1,105 @@
+import unittest
+
+from bot import extractors
+from bot.extractors import LxmlExtractor, SoupExtractor, StreamingExtractor
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+PAGE = """<!doctype html>
+<html>
+<head>
+    <title>Page title</title>
+    <style>body { color: red; }</style>
+    <script>console.log("hello");</script>
+</head>
+<body>
+    <nav><a href="/">Home</a> <a href="/about">About</a></nav>
+    <main>
+        <h1>Cats   and
+            boxes</h1>
+        <p>Cats <b>do</b> like boxes.</p>
+        <p>Nobody knows why&nbsp;&amp; when.</p>
+        <ul><li>One</li><li>Two</li></ul>
+        <pre>def meow():
+    return "meow"</pre>
+        <aside>Related posts</aside>
+    </main>
+    <footer>Copyright</footer>
+</body>
+</html>
+"""
+
+PAGE_TEXT = """Cats and boxes
+
+Cats do like boxes.
+
+Nobody knows why & when.
+
+One
+Two
+
+def meow():
+    return "meow\""""
+
+
+class StreamingExtractorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.extractor = StreamingExtractor()
+
+    def test_extract(self):
+        text = self.extractor.extract(PAGE)
+        self.assertEqual(text, PAGE_TEXT)
+
+    def test_body(self):
+        html = "<html><body><nav>Menu</nav><p>first</p>\n\n<p>second</p></body></html>"
+        text = self.extractor.extract(html)
+        self.assertEqual(text, "first\n\nsecond")
+
+    def test_whitespace(self):
+        text = self.extractor.extract("<span>  one \n\t two  </span><br><span>three</span>")
+        self.assertEqual(text, "one two\nthree")
+
+    def test_unbalanced(self):
+        text = self.extractor.extract("<p>one</aside><p>two")
+        self.assertEqual(text, "one\n\ntwo")
+
+    def test_empty(self):
+        self.assertEqual(self.extractor.extract(""), "")
+
+
+class SoupExtractorTest(unittest.TestCase):
+    def test_extract(self):
+        html = "<html><body><main>hello</main></body></html>"
+        text = SoupExtractor().extract(html)
+        self.assertEqual(text, "hello")
+
+
+@unittest.skipIf(lxml is None, "lxml is not installed")
+class LxmlExtractorTest(unittest.TestCase):
+    def test_extract(self):
+        text = LxmlExtractor().extract(PAGE)
+        self.assertTrue(text.startswith("Cats and\nboxes\n\nCats do like boxes."))
+        self.assertFalse("Related posts" in text)
+        self.assertFalse("Copyright" in text)
+
+    def test_adjacent_skipped(self):
+        html = (
+            "<html><body><p>Hello</p><nav><script>var a = 1;</script>Menu</nav>"
+            "<footer>Copyright</footer><aside>Related</aside><p>world</p></body></html>"
+        )
+        text = LxmlExtractor().extract(html)
+        self.assertEqual(text, "Hello\n\nworld")
+
+
+class GetTest(unittest.TestCase):
+    def test_get(self):
+        extractor = extractors.get("streaming")
+        self.assertIsInstance(extractor, StreamingExtractor)
+        self.assertIs(extractors.get("streaming"), extractor)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            extractors.get("regex")
@@ -1,14 +1,18 @@
+from typing import Optional
 import unittest
 from httpx import Request, Response
 
+from bot import deadline
 from bot.fetcher import Fetcher, Content
 
 
 class FakeClient:
     def __init__(self, responses: dict[str, Response | Exception]) -> None:
         self.responses = responses
+        self.timeouts = []
 
-    async def get(self, url: str) -> Response:
+    async def get(self, url: str, timeout: Optional[float] = None) -> Response:
+        self.timeouts.append(timeout)
         request = Request(method="GET", url=url)
         response = self.responses[url]
         if isinstance(response, Exception):
@@ -50,6 +54,45 @@ first
 https://example.org/second contents:
 
 second
+---""",
+        )
+
+    async def test_substitute_urls_budget(self):
+        long_text = "\n\n".join(f"Paragraph number {idx} goes here." for idx in range(10))
+        resp_1 = Response(status_code=200, headers={"content-type": "text/plain"}, text="first")
+        resp_2 = Response(status_code=200, headers={"content-type": "text/plain"}, text=long_text)
+        self.fetcher.client = FakeClient(
+            {
+                "https://example.org/first": resp_1,
+                "https://example.org/second": resp_2,
+            }
+        )
+        text = "Compare https://example.org/first and https://example.org/second"
+        text = await self.fetcher.substitute_urls(text, max_tokens=41)
+        self.assertEqual(
+            text,
+            """Compare https://example.org/first and https://example.org/second
+
+---
+https://example.org/first contents:
+
+first
+---
+
+---
+https://example.org/second contents (trimmed):
+
+Paragraph number 0 goes here.
+
+Paragraph number 1 goes here.
+
+Paragraph number 2 goes here.
+
+[... 5 paragraphs omitted ...]
+
+Paragraph number 8 goes here.
+
+Paragraph number 9 goes here.
 ---""",
         )
 
@@ -62,6 +105,20 @@ second
         text = await self.fetcher._fetch_url("https://failure.org")
         self.assertEqual(text, "Failed to fetch (builtins.ConnectionError)")
 
+    async def test_fetch_url_deadline(self):
+        resp = Response(status_code=200, headers={"content-type": "text/plain"}, text="hello")
+        self.fetcher.client = FakeClient({"https://success.org": resp})
+        await self.fetcher._fetch_url("https://success.org")
+        self.assertEqual(self.fetcher.client.timeouts[-1], Fetcher.timeout)
+
+        deadline._deadline.set(deadline.time.monotonic() + 1)
+        await self.fetcher._fetch_url("https://success.org")
+        self.assertLessEqual(self.fetcher.client.timeouts[-1], 1)
+
+        deadline._deadline.set(deadline.time.monotonic() - 1)
+        with self.assertRaises(deadline.Missed):
+            await self.fetcher._fetch_url("https://success.org")
+
     async def test_ignore_quoted(self):
         src = "What is 'https://example.org/first'?"
         text = await self.fetcher.substitute_urls(src)
@@ -0,0 +1,176 @@
+import asyncio
+import inspect
+import unittest
+
+from bot import inflight
+
+
+class RegistryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.answers = inflight.Registry(max_replies=2)
+
+    async def test_run(self):
+        async def answer():
+            return "answer"
+
+        completed = await self.answers.run((1, 11), user_id=1, question="Hi", answer=answer())
+        self.assertTrue(completed)
+        self.assertEqual(len(self.answers), 0)
+
+    async def test_cancel(self):
+        started = asyncio.Event()
+
+        async def answer():
+            started.set()
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=answer())
+        )
+        await started.wait()
+        self.assertTrue(self.answers.cancel((1, 11)))
+        self.assertFalse(await task)
+        self.assertEqual(self.answers.n_cancelled, 1)
+        self.assertFalse(self.answers.cancel((1, 11)))
+
+    async def test_same_key(self):
+        started = asyncio.Event()
+        done = []
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+            done.append("slow")
+
+        async def fast():
+            done.append("fast")
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=slow())
+        )
+        await started.wait()
+        await self.answers.run((1, 11), user_id=1, question="Hello", answer=fast())
+        self.assertFalse(await task)
+        self.assertEqual(done, ["fast"])
+
+    async def test_concurrent_edits(self):
+        started = asyncio.Event()
+        done = []
+
+        async def answer(name: str, delay: float = 0):
+            started.set()
+            await asyncio.sleep(delay)
+            done.append(name)
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=answer("first", 10))
+        )
+        await started.wait()
+        # two edits of the same question arrive at once
+        results = await asyncio.gather(
+            task,
+            self.answers.run((1, 11), user_id=1, question="Hello", answer=answer("second")),
+            self.answers.run((1, 11), user_id=1, question="Hey", answer=answer("third")),
+        )
+        self.assertEqual(results, [False, False, True])
+        self.assertEqual(done, ["third"])
+        self.assertEqual(len(self.answers), 0)
+
+    async def test_committed(self):
+        started = asyncio.Event()
+        done = []
+
+        async def answer():
+            self.answers.commit((1, 11))
+            started.set()
+            await asyncio.sleep(0.01)
+            done.append("delivered")
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=answer())
+        )
+        await started.wait()
+        self.assertFalse(self.answers.cancel((1, 11)))
+        self.assertTrue(await task)
+        self.assertEqual(done, ["delivered"])
+
+    async def test_supersede(self):
+        started = asyncio.Event()
+
+        async def answer():
+            started.set()
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=answer())
+        )
+        await started.wait()
+        self.assertIsNone(self.answers.supersede(chat_id=1, user_id=2))
+        self.assertEqual(self.answers.supersede(chat_id=1, user_id=1), "Hi")
+        self.assertFalse(await task)
+
+    async def test_cancel_chat(self):
+        async def answer():
+            await asyncio.sleep(10)
+
+        tasks = [
+            asyncio.create_task(self.answers.run(key, user_id=1, question="Hi", answer=answer()))
+            for key in [(1, 11), (1, 12), (2, 21)]
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(self.answers.cancel_chat(1), 2)
+        self.assertEqual(self.answers.cancel_all(), 1)
+        self.assertEqual(await asyncio.gather(*tasks), [False, False, False])
+
+    async def test_outer_cancel(self):
+        async def answer():
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(
+            self.answers.run((1, 11), user_id=1, question="Hi", answer=answer())
+        )
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    async def test_cancel_before_start(self):
+        async def answer():
+            pass
+
+        coro = answer()
+        task = asyncio.create_task(self.answers.run((1, 11), user_id=1, question="Hi", answer=coro))
+        await asyncio.sleep(0)
+        self.answers.cancel((1, 11))
+        self.assertFalse(await task)
+        self.assertEqual(inspect.getcoroutinestate(coro), inspect.CORO_CLOSED)
+
+    async def test_drain(self):
+        async def answer(delay: float):
+            await asyncio.sleep(delay)
+
+        tasks = [
+            asyncio.create_task(
+                self.answers.run((1, 11), user_id=1, question="Hi", answer=answer(0.01))
+            ),
+            asyncio.create_task(
+                self.answers.run((1, 12), user_id=1, question="Hi", answer=answer(10))
+            ),
+        ]
+        await asyncio.sleep(0)
+        n_abandoned = await self.answers.drain(timeout=0.1)
+        self.assertEqual(n_abandoned, 1)
+        self.assertEqual(await asyncio.gather(*tasks), [True, False])
+
+    async def test_drain_empty(self):
+        self.assertEqual(await self.answers.drain(timeout=10), 0)
+
+    def test_replies(self):
+        self.answers.remember((1, 11), [101])
+        self.answers.remember((1, 12), [102, 103])
+        self.answers.remember((1, 11), [104])
+        self.answers.remember((1, 13), [])
+        self.answers.remember((1, 14), [105])
+        self.assertEqual(self.answers.replies_to((1, 11)), [104])
+        self.assertEqual(self.answers.replies_to((1, 12)), [])
+        self.assertEqual(self.answers.replies_to((1, 14)), [105])
@@ -0,0 +1,57 @@
+import asyncio
+import gc
+import unittest
+
+from bot import locks
+from bot import metrics
+
+
+class KeyedLocksTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.locks = locks.KeyedLocks("test")
+        self.events = []
+
+    async def _work(self, key: str, name: str) -> None:
+        async with self.locks.hold(key):
+            self.events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            self.events.append(f"{name} end")
+
+    async def test_same_key(self):
+        await asyncio.gather(self._work("alice", "one"), self._work("alice", "two"))
+        self.assertEqual(self.events, ["one start", "one end", "two start", "two end"])
+
+    async def test_different_keys(self):
+        await asyncio.gather(self._work("alice", "one"), self._work("bob", "two"))
+        self.assertEqual(self.events, ["one start", "two start", "one end", "two end"])
+
+    async def test_reentrant(self):
+        async with self.locks.hold("alice"):
+            async with self.locks.hold("alice"):
+                self.events.append("inner")
+        self.assertEqual(self.events, ["inner"])
+
+    async def test_child_task(self):
+        async def child() -> None:
+            async with self.locks.hold("alice"):
+                self.events.append("child")
+
+        async with self.locks.hold("alice"):
+            task = asyncio.create_task(child())
+            await asyncio.sleep(0.01)
+            self.events.append("parent")
+        await task
+        self.assertEqual(self.events, ["parent", "child"])
+
+    async def test_cleanup(self):
+        async with self.locks.hold("alice"):
+            self.assertEqual(len(self.locks), 1)
+        gc.collect()
+        self.assertEqual(len(self.locks), 0)
+
+    async def test_wait_time(self):
+        count = metrics.summary("locks.test.wait_ms").count
+        await asyncio.gather(self._work("alice", "one"), self._work("alice", "two"))
+        summary = metrics.summary("locks.test.wait_ms")
+        self.assertEqual(summary.count, count + 2)
+        self.assertTrue(max(summary.values) >= 5)
@@ -0,0 +1,101 @@
+import asyncio
+import io
+import json
+import logging
+import unittest
+
+from bot import logs
+from bot.config import Logging
+
+
+class SetupTest(unittest.TestCase):
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.handlers = list(self.root.handlers)
+        self.level = self.root.level
+        self.bot_level = logging.getLogger("bot").level
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.stop()
+        self.root.handlers = self.handlers
+        self.root.setLevel(self.level)
+        logging.getLogger("bot").setLevel(self.bot_level)
+        logging.getLogger("__main__").setLevel(logging.NOTSET)
+
+    def test_text(self):
+        logs.setup(Logging(level="info", format="text"), stream=self.stream)
+        logger = logging.getLogger("bot.test")
+        logger.debug("skipped")
+        logger.info("question id=%s", 42)
+        logs.stop()
+        output = self.stream.getvalue()
+        self.assertIn("INFO bot.test [-] question id=42", output)
+        self.assertNotIn("skipped", output)
+
+    def test_json(self):
+        logs.setup(Logging(level="debug", format="json"), stream=self.stream)
+        logger = logging.getLogger("bot.test")
+
+        async def handle(update_id: int) -> None:
+            logs.request_id.set(str(update_id))
+            logger.debug("processing %s", update_id)
+
+        async def process() -> None:
+            await asyncio.gather(handle(1), handle(2))
+
+        asyncio.run(process())
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            logger.exception("failed")
+        logs.stop()
+
+        records = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]["request_id"], "1")
+        self.assertEqual(records[0]["message"], "processing 1")
+        self.assertEqual(records[0]["level"], "DEBUG")
+        self.assertEqual(records[1]["request_id"], "2")
+        self.assertEqual(records[2]["request_id"], "-")
+        self.assertIn("ValueError: oops", records[2]["error"])
+
+    def test_lazy(self):
+        class Expensive:
+            n_formatted = 0
+
+            def __str__(self):
+                Expensive.n_formatted += 1
+                return "expensive"
+
+        logs.setup(Logging(level="info"), stream=self.stream)
+        logging.getLogger("bot.test").debug("value: %s", Expensive())
+        logs.stop()
+        self.assertEqual(Expensive.n_formatted, 0)
+
+
+class SamplerTest(unittest.TestCase):
+    def test_sample(self):
+        sampler = logs.Sampler(0.5)
+        passed = 0
+        for idx in range(1000):
+            record = logging.LogRecord("bot", logging.DEBUG, "", 0, "msg", None, None)
+            record.request_id = str(idx)
+            passed += sampler.filter(record)
+        self.assertGreater(passed, 400)
+        self.assertLess(passed, 600)
+
+    def test_same_request(self):
+        sampler = logs.Sampler(0.5)
+        record = logging.LogRecord("bot", logging.DEBUG, "", 0, "msg", None, None)
+        record.request_id = "42"
+        results = {sampler.filter(record) for _ in range(10)}
+        self.assertEqual(len(results), 1)
+
+    def test_info(self):
+        sampler = logs.Sampler(0)
+        record = logging.LogRecord("bot", logging.INFO, "", 0, "msg", None, None)
+        record.request_id = "42"
+        self.assertTrue(sampler.filter(record))
+        record.levelno = logging.DEBUG
+        self.assertFalse(sampler.filter(record))
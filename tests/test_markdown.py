@@ -40,7 +40,7 @@ select regexp_like('Meet me at 10:30', '\d+:\d+');
 select 10 &gt; 5 = true;
 </pre>
 
-See [Documentation](https://github.com/nalgeon/sqlean) for reference.
+See <a href="https://github.com/nalgeon/sqlean">Documentation</a> for reference.
 """
 
 
@@ -60,15 +60,165 @@ class Test(unittest.TestCase):
     def test_bold(self):
         text = markdown.to_html("one **two** three")
         self.assertEqual(text, "one <b>two</b> three")
-        text = markdown.to_html("one *two* three")
-        self.assertEqual(text, "one *two* three")
         text = markdown.to_html("one **two three")
         self.assertEqual(text, "one **two three")
+        text = markdown.to_html("one **`two`** three")
+        self.assertEqual(text, "one <b><code>two</code></b> three")
+
+    def test_nested_emphasis(self):
+        text = markdown.to_html("one **two *three* four** five")
+        self.assertEqual(text, "one <b>two <i>three</i> four</b> five")
+        text = markdown.to_html("one **two *three*** four")
+        self.assertEqual(text, "one <b>two <i>three</i></b> four")
+        text = markdown.to_html("one *two **three** four* five")
+        self.assertEqual(text, "one <i>two <b>three</b> four</i> five")
+        text = markdown.to_html("one *two **three*** four")
+        self.assertEqual(text, "one <i>two <b>three</b></i> four")
+
+    def test_emphasis_spaces(self):
+        # markers next to a space do not open or close emphasis
+        self.assertEqual(markdown.to_html("a ** b ** c"), "a ** b ** c")
+        self.assertEqual(markdown.to_html("a **b ** c"), "a **b ** c")
+        self.assertEqual(markdown.to_html("a * b * c"), "a * b * c")
+        self.assertEqual(markdown.to_html("a *b * c"), "a *b * c")
+        self.assertEqual(markdown.to_html("a _ b _ c"), "a _ b _ c")
+        text = markdown.to_html("**2 * 3 * 4**")
+        self.assertEqual(text, "<b>2 * 3 * 4</b>")
+
+    def test_italic(self):
+        text = markdown.to_html("one *two* three")
+        self.assertEqual(text, "one <i>two</i> three")
+        text = markdown.to_html("one _two_ three")
+        self.assertEqual(text, "one <i>two</i> three")
+        text = markdown.to_html("2 * 3 * 4")
+        self.assertEqual(text, "2 * 3 * 4")
+        text = markdown.to_html("snake_case_name")
+        self.assertEqual(text, "snake_case_name")
+
+    def test_link(self):
+        text = markdown.to_html("see [the docs](https://example.org/?a=1&b=2)")
+        self.assertEqual(text, 'see <a href="https://example.org/?a=1&amp;b=2">the docs</a>')
+        text = markdown.to_html("see [the docs] (https://example.org)")
+        self.assertEqual(text, "see [the docs] (https://example.org)")
+
+    def test_heading(self):
+        text = markdown.to_html("## Cats & boxes\ntext")
+        self.assertEqual(text, "<b>Cats &amp; boxes</b>\ntext")
+        text = markdown.to_html("#hashtag")
+        self.assertEqual(text, "#hashtag")
+        text = markdown.to_html("### C# ###  \ntext")
+        self.assertEqual(text, "<b>C#</b>\ntext")
 
     def test_bullet(self):
         text = markdown.to_html("*   one two three")
         self.assertEqual(text, "— one two three")
         text = markdown.to_html("* one two three")
-        self.assertEqual(text, "* one two three")
-        text = markdown.to_html(" *  one two three")
-        self.assertEqual(text, " *  one two three")
+        self.assertEqual(text, "— one two three")
+        text = markdown.to_html("- one two three")
+        self.assertEqual(text, "— one two three")
+        text = markdown.to_html("*one two three")
+        self.assertEqual(text, "*one two three")
+
+    def test_nested_list(self):
+        text = markdown.to_html("- one\n  - two\n    * three\n- four")
+        self.assertEqual(text, "— one\n  — two\n    — three\n— four")
+
+    def test_pre(self):
+        text = markdown.to_html("```\n**a** * b\n- c\n```")
+        self.assertEqual(text, "<pre>\n**a** * b\n- c\n</pre>")
+
+    def test_pre_fences(self):
+        text = markdown.to_html("```\n```python\na\n  ```  \nb")
+        self.assertEqual(text, "<pre>\n```python\na\n</pre>\nb")
+
+    def test_unclosed_pre(self):
+        text = markdown.to_html("code:\n```python\nprint(1 < 2)")
+        self.assertEqual(text, "code:\n<pre>\nprint(1 &lt; 2)</pre>")
+
+
+class IncrementalRendererTest(unittest.TestCase):
+    def test_feed(self):
+        renderer = markdown.IncrementalRenderer()
+        html = ""
+        for idx in range(0, len(TEXT_MD), 7):
+            html = renderer.feed(TEXT_MD[idx : idx + 7])
+        self.assertEqual(html, markdown.to_html(TEXT_MD))
+
+    def test_keeps_done_part(self):
+        renderer = markdown.IncrementalRenderer()
+        renderer.feed("**one**\n\ntwo")
+        self.assertEqual(renderer.n_done, len("**one**\n\n"))
+        html = renderer.feed(" **three**")
+        self.assertEqual(html, "<b>one</b>\n\ntwo <b>three</b>")
+
+    def test_open_pre(self):
+        renderer = markdown.IncrementalRenderer()
+        html = renderer.feed("code:\n```python\na = 1\n\n")
+        self.assertEqual(renderer.n_done, 0)
+        self.assertEqual(html, "code:\n<pre>\na = 1\n\n</pre>")
+        html = renderer.feed("b = 2\n```\n\ndone")
+        self.assertEqual(html, "code:\n<pre>\na = 1\n\nb = 2\n</pre>\n\ndone")
+
+
+class SplitHtmlTest(unittest.TestCase):
+    def test_short(self):
+        self.assertEqual(markdown.split_html("<b>hello</b>", 100), ["<b>hello</b>"])
+
+    def test_paragraphs(self):
+        par = "a" * 30
+        chunks = markdown.split_html(f"{par}\n\n{par}\n\n{par}", 90)
+        self.assertEqual(chunks, [f"{par}\n\n{par}", par])
+
+    def test_pre(self):
+        html = "<pre>" + "\n".join(f"line {idx}" for idx in range(20)) + "\n</pre>"
+        chunks = markdown.split_html(html, 100)
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks:
+            self.assertTrue(len(chunk) <= 100)
+            self.assertTrue(chunk.startswith("<pre>"))
+            self.assertTrue(chunk.endswith("</pre>"))
+        text = "".join(chunk[5:-6] for chunk in chunks)
+        self.assertEqual(text.count("line"), 20)
+
+    def test_tags(self):
+        html = '<a href="https://example.com">' + "word " * 40 + "</a>"
+        chunks = markdown.split_html(html, 100)
+        for chunk in chunks:
+            self.assertTrue(len(chunk) <= 100)
+            self.assertTrue(chunk.startswith('<a href="https://example.com">'))
+            self.assertTrue(chunk.endswith("</a>"))
+
+    def test_entities(self):
+        html = "&amp;" * 30
+        chunks = markdown.split_html(html, 64)
+        self.assertEqual("".join(chunks), html)
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith("&amp;"))
+            self.assertTrue(chunk.endswith("&amp;"))
+
+    def test_no_tags(self):
+        # no room is reserved for closing tags that are not there
+        chunks = markdown.split_html("a" * 250, 100)
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+
+    def test_nested_tags(self):
+        html = "<b><i><code>" + "word " * 100 + "</code></i></b>"
+        chunks = markdown.split_html(html, 60)
+        for chunk in chunks:
+            self.assertTrue(len(chunk) <= 60)
+            self.assertTrue(chunk.startswith("<b><i><code>"))
+            self.assertTrue(chunk.endswith("</code></i></b>"))
+        text = " ".join(chunk[12:-15] for chunk in chunks)
+        self.assertEqual(text.split(), ["word"] * 100)
+
+    def test_long_link(self):
+        link = '<a href="https://example.com/' + "x" * 80 + '">'
+        html = link + "word " * 40 + "</a> done"
+        chunks = markdown.split_html(html, 120)
+        self.assertTrue(chunks[0].startswith(link))
+        for chunk in chunks:
+            self.assertTrue(len(chunk) <= 120)
+            self.assertEqual(chunk.count("<a "), chunk.count("</a>"))
+        text = markdown.tag_re.sub("", " ".join(chunks))
+        self.assertEqual(text.split(), ["word"] * 40 + ["done"])
+
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from telegram.ext import ApplicationBuilder
+
+from bot import bot
+from bot import locks
+from bot import memory
+from bot import persistence
+from bot import workers
+from bot.config import config
+from bot.models import UserData
+
+
+def make_user(size: int) -> dict:
+    data = {}
+    UserData(data).messages.add("x" * size, "answer")
+    return data
+
+
+class FakeApplication:
+    def __init__(self):
+        self.unloaded = []
+
+    def unload_user_data(self, user_id: int) -> None:
+        self.unloaded.append(user_id)
+
+
+class MemoryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.memory_limit = config.conversation.memory_limit
+        self.max_bytes = config.conversation.max_bytes
+        config.conversation.max_bytes = 0
+
+    def tearDown(self):
+        config.conversation.memory_limit = self.memory_limit
+        config.conversation.max_bytes = self.max_bytes
+
+    def test_touch(self):
+        histories = memory.Memory()
+        alice = make_user(100)
+        histories.touch(1, alice)
+        self.assertEqual(len(histories), 1)
+        self.assertGreater(histories.size, 100)
+
+        UserData(alice).messages.add("y" * 100, "answer")
+        histories.touch(1, alice)
+        self.assertEqual(len(histories), 1)
+        self.assertGreater(histories.size, 200)
+
+        histories.forget(1)
+        self.assertEqual(len(histories), 0)
+        self.assertEqual(histories.size, 0)
+
+    def test_unlimited(self):
+        config.conversation.memory_limit = 0
+        histories = memory.Memory()
+        users = [make_user(600_000) for _ in range(3)]
+        for user_id, data in enumerate(users):
+            histories.touch(user_id, data)
+        self.assertEqual(histories.n_evicted, 0)
+
+    def test_evict(self):
+        config.conversation.memory_limit = 1
+        histories = memory.Memory()
+        histories.application = FakeApplication()
+        alice, bob, cindy = make_user(400_000), make_user(400_000), make_user(400_000)
+        histories.touch(1, alice)
+        histories.touch(2, bob)
+        # alice is active again, so bob is the least recently active now
+        histories.touch(1, alice)
+        histories.touch(3, cindy)
+        self.assertEqual(histories.n_evicted, 1)
+        self.assertEqual(histories.application.unloaded, [2])
+        # the history itself is kept for the database
+        self.assertEqual(len(UserData(bob).messages.messages), 1)
+        self.assertLessEqual(histories.size, 1024 * 1024)
+
+    def test_no_application(self):
+        config.conversation.memory_limit = 1
+        histories = memory.Memory()
+        histories.touch(1, make_user(600_000))
+        histories.touch(2, make_user(600_000))
+        self.assertEqual(histories.n_evicted, 0)
+
+    async def test_answer_in_progress(self):
+        config.conversation.memory_limit = 1
+        histories = memory.Memory()
+        histories.application = FakeApplication()
+        histories.touch(1, make_user(400_000))
+        histories.touch(2, make_user(400_000))
+        async with locks.users.hold(1):
+            histories.touch(3, make_user(400_000))
+        self.assertEqual(histories.application.unloaded, [2])
+
+    def test_keep_current(self):
+        config.conversation.memory_limit = 1
+        histories = memory.Memory()
+        alice = make_user(2_000_000)
+        histories.touch(1, alice)
+        self.assertEqual(histories.n_evicted, 0)
+        self.assertEqual(len(UserData(alice).messages.messages), 1)
+
+
+class EvictTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.memory_limit = config.conversation.memory_limit
+        config.conversation.memory_limit = 1
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = persistence.SqlitePersistence(os.path.join(self.dir.name, "persistence.db"))
+        self.store._open()
+        # the application registers itself for the current bot
+        application = memory.histories.application
+        self.application = (
+            ApplicationBuilder()
+            .application_class(bot.DrainingApplication)
+            .token("123:secret")
+            .persistence(self.store)
+            .updater(None)
+            .build()
+        )
+        memory.histories.application = application
+        self.histories = memory.Memory()
+        self.histories.application = self.application
+
+    async def asyncTearDown(self):
+        await self.store.flush()
+
+    def tearDown(self):
+        config.conversation.memory_limit = self.memory_limit
+        workers.shutdown()
+        self.dir.cleanup()
+
+    def _answer(self, user_id: int, size: int) -> None:
+        data = self.application.user_data[user_id]
+        UserData(data).messages.add("x" * size, "answer")
+        self.histories.touch(user_id, data)
+        # as the application does after handling an update
+        self.application.mark_data_for_update_persistence(user_ids=user_id)
+
+    async def _reload(self, user_id: int) -> dict:
+        data = self.application.user_data[user_id]
+        await self.store.refresh_user_data(user_id, data)
+        return data
+
+    async def test_reload(self):
+        self._answer(1, 600_000)
+        self._answer(2, 600_000)
+        self.assertNotIn(1, self.application.user_data)
+        while self.store.busy:
+            await asyncio.sleep(0.01)
+        data = await self._reload(1)
+        self.assertEqual(len(UserData(data).messages.messages), 1)
+
+    async def test_reload_unwritten(self):
+        self._answer(1, 600_000)
+        self._answer(2, 600_000)
+        # the user returns before the history reaches the database
+        data = await self._reload(1)
+        self.assertEqual(len(UserData(data).messages.messages), 1)
@@ -0,0 +1,39 @@
+import unittest
+from bot import metrics
+from bot.metrics import Summary
+
+
+class SummaryTest(unittest.TestCase):
+    def test_observe(self):
+        summary = Summary()
+        for value in range(1, 101):
+            summary.observe(value)
+        self.assertEqual(summary.count, 100)
+        self.assertEqual(summary.mean, 50.5)
+        self.assertEqual(summary.percentile(50), 50)
+        self.assertEqual(summary.percentile(95), 95)
+        self.assertEqual(summary.percentile(100), 100)
+
+    def test_empty(self):
+        summary = Summary()
+        self.assertEqual(summary.mean, 0)
+        self.assertEqual(summary.percentile(99), 0)
+
+    def test_size(self):
+        summary = Summary(size=10)
+        for value in range(100):
+            summary.observe(value)
+        self.assertEqual(summary.count, 100)
+        self.assertEqual(summary.percentile(0), 90)
+
+
+class RegistryTest(unittest.TestCase):
+    def test_observe(self):
+        metrics.observe("test.registry", 42)
+        self.assertEqual(metrics.summary("test.registry").count, 1)
+        self.assertEqual(metrics.snapshot()["test.registry"]["p50"], 42)
+
+    def test_gauge(self):
+        metrics.gauge("test.gauge", 1)
+        metrics.gauge("test.gauge", 5)
+        self.assertEqual(metrics.gauges()["test.gauge"], 5)
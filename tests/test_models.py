@@ -1,10 +1,24 @@
 from collections import deque
 import datetime as dt
+import pickle
+import random
+import string
+import time
+from typing import NamedTuple
 import unittest
+from unittest import mock
 
 from bot import models
 from bot.config import config
-from bot.models import ExpiringCounter, TimestampedValue, UserData, UserMessage, UserMessages
+from bot.models import (
+    ExpiringCounter,
+    ReplyChains,
+    Stamped,
+    TimestampedValue,
+    UserData,
+    UserMessage,
+    UserMessages,
+)
 
 
 class UserDataTest(unittest.TestCase):
@@ -14,7 +28,7 @@ class UserDataTest(unittest.TestCase):
         self.assertEqual(user.messages.as_list(), [])
         self.assertEqual(data["messages"], deque([], maxlen=config.conversation.depth))
         self.assertEqual(user.message_counter.value, 0)
-        self.assertEqual(data["message_counter"]["value"], 0)
+        self.assertEqual(data["message_counter"].value, 0)
 
     def test_messages(self):
         data = {}
@@ -30,7 +44,79 @@ class UserDataTest(unittest.TestCase):
         user.message_counter.increment()
         user.message_counter.increment()
         self.assertEqual(user.message_counter.value, 2)
-        self.assertEqual(data["message_counter"]["value"], 2)
+        self.assertEqual(data["message_counter"].value, 2)
+
+    def test_no_copy(self):
+        data = {}
+        UserData(data).messages.add("question", "answer")
+        messages = data["messages"]
+        user = UserData(data)
+        self.assertIs(user.messages.messages, messages)
+        self.assertIs(data["messages"], messages)
+
+    def test_depth_changed(self):
+        depth = config.conversation.depth
+        try:
+            data = {}
+            UserData(data).messages.add("question", "answer")
+            config.conversation.depth = depth + 1
+            user = UserData(data)
+            self.assertEqual(data["messages"].maxlen, depth + 1)
+            self.assertEqual(user.messages.as_list(), [("question", "answer")])
+        finally:
+            config.conversation.depth = depth
+
+
+class UserMessageTest(unittest.TestCase):
+    def test_fields(self):
+        message = UserMessage("Hello", "Hi")
+        question, answer = message
+        self.assertEqual((question, answer), ("Hello", "Hi"))
+        self.assertEqual(message, ("Hello", "Hi"))
+        self.assertEqual(message, UserMessage("Hello", "Hi"))
+        self.assertNotEqual(message, UserMessage("Hello", "Bye"))
+        with self.assertRaises(AttributeError):
+            message.extra = 42
+
+    def test_pickle(self):
+        message = pickle.loads(pickle.dumps(UserMessage("Hello", "Hi")))
+        self.assertEqual(message, UserMessage("Hello", "Hi"))
+
+    def test_unpickle_legacy(self):
+        # older versions stored the messages as named tuples
+        class LegacyMessage(NamedTuple):
+            question: str
+            answer: str
+
+        LegacyMessage.__module__ = "bot.models"
+        LegacyMessage.__qualname__ = "UserMessage"
+        current = models.UserMessage
+        models.UserMessage = LegacyMessage
+        try:
+            dump = pickle.dumps(deque([LegacyMessage("Hello", "Hi")], maxlen=3))
+        finally:
+            models.UserMessage = current
+
+        messages = pickle.loads(dump)
+        self.assertIsInstance(messages[0], UserMessage)
+        self.assertEqual(messages[0].question, "Hello")
+        self.assertEqual(messages[0].answer, "Hi")
+
+    def test_compress(self):
+        question, answer = "What is it? " * 100, "I don't know. " * 100
+        message = UserMessage(question, answer)
+        message.compress()
+        self.assertTrue(message.is_compressed)
+        self.assertLess(message.size, len(question) + len(answer))
+        self.assertEqual(message, (question, answer))
+        self.assertGreater(message.n_tokens, 0)
+        message = pickle.loads(pickle.dumps(message))
+        self.assertEqual(message, (question, answer))
+
+    def test_compress_short(self):
+        message = UserMessage("Hello", "Hi")
+        message.compress()
+        self.assertFalse(message.is_compressed)
 
 
 class UserMessagesTest(unittest.TestCase):
@@ -90,49 +176,236 @@ class UserMessagesTest(unittest.TestCase):
         self.assertEqual(um.as_list(), [("Hello", "Hi"), ("Is it cold today?", "Yep!")])
 
 
+class UserMessagesLimitsTest(unittest.TestCase):
+    def setUp(self):
+        self.max_bytes = config.conversation.max_bytes
+        self.max_tokens = config.conversation.max_tokens
+
+    def tearDown(self):
+        config.conversation.max_bytes = self.max_bytes
+        config.conversation.max_tokens = self.max_tokens
+
+    def test_compress_old(self):
+        um = UserMessages({}, maxlen=3)
+        um.add("What is it? " * 100, "I don't know. " * 100)
+        um.add("And this? " * 100, "Neither. " * 100)
+        self.assertTrue(um.messages[0].is_compressed)
+        self.assertFalse(um.messages[1].is_compressed)
+        self.assertEqual(um.as_list()[0], ("What is it? " * 100, "I don't know. " * 100))
+
+    def test_max_bytes(self):
+        config.conversation.max_bytes = 2000
+        rnd = random.Random(42)
+        um = UserMessages({}, maxlen=10)
+        for idx in range(5):
+            # random text does not compress well
+            text = "".join(rnd.choices(string.ascii_letters, k=500))
+            um.add(f"question {idx} {text}", f"answer {idx}")
+        self.assertLessEqual(um.size, 2000)
+        self.assertLess(len(um.messages), 5)
+        self.assertEqual(um.last.answer, "answer 4")
+
+    def test_max_tokens(self):
+        config.conversation.max_tokens = 30
+        um = UserMessages({}, maxlen=10)
+        for idx in range(5):
+            um.add("one two three four five six seven eight nine ten", f"answer {idx}")
+        self.assertLessEqual(um.n_tokens, 30)
+        self.assertEqual(len(um.messages), 2)
+        self.assertEqual(um.last.answer, "answer 4")
+
+    def test_keep_last(self):
+        config.conversation.max_tokens = 1
+        um = UserMessages({}, maxlen=3)
+        um.add("one two three", "four five six")
+        self.assertEqual(len(um.messages), 1)
+
+    def test_documents(self):
+        text = "A very long story. " * 1000
+        question = f"Summarize this:\n\nstory.txt:\n```\n{text}\n```"
+        data = {}
+        um = UserMessages(data, maxlen=3)
+        um.add(question, "A summary")
+        um.add(question + "\nin one sentence", "A sentence")
+        # the document is stored once
+        self.assertEqual(len(data["blobs"]), 1)
+        self.assertLess(um.size, len(text))
+        self.assertNotIn(text, um.messages[1].question)
+        history = um.as_list()
+        self.assertEqual(history[0], (question, "A summary"))
+        self.assertEqual(history[1], (question + "\nin one sentence", "A sentence"))
+        self.assertEqual(um.last.question, question + "\nin one sentence")
+
+        um.pop()
+        self.assertEqual(len(data["blobs"]), 1)
+        um.pop()
+        self.assertNotIn("blobs", data)
+
+    def test_shrink_no_decompress(self):
+        config.conversation.max_bytes = 50000
+        rnd = random.Random(42)
+        um = UserMessages({}, maxlen=10)
+        with mock.patch.object(models, "_decompress", side_effect=models._decompress) as spy:
+            for idx in range(8):
+                text = "".join(rnd.choices(string.ascii_letters, k=20000))
+                um.add(f"story.txt:\n```\n{text}\n```", f"summary {idx}")
+        spy.assert_not_called()
+        self.assertLessEqual(um.size, 50000)
+        self.assertEqual(len(um.data["blobs"]), len(um.messages))
+        self.assertEqual(um.last.answer, "summary 7")
+
+    def test_clear_documents(self):
+        text = "A very long story. " * 1000
+        data = {}
+        um = UserMessages(data, maxlen=3)
+        um.add(f"story.txt:\n```\n{text}\n```", "A summary")
+        um.clear()
+        self.assertNotIn("blobs", data)
+
+    def test_small_documents(self):
+        question = "story.txt:\n```\nA short story.\n```"
+        data = {}
+        um = UserMessages(data, maxlen=3)
+        um.add(question, "A summary")
+        self.assertNotIn("blobs", data)
+        self.assertEqual(um.messages[0].question, question)
+
+
+class ReplyChainsTest(unittest.TestCase):
+    def _chat(self, chains: ReplyChains) -> None:
+        # 11 -> 101, 12 -> 102 + 103 (a long answer), 13 -> 104
+        chains.add_question(11, None, "What is your name?")
+        chains.add_answer([101], 11, "I'm a bot")
+        chains.add_question(12, 101, "Why?")
+        chains.add_answer([102, 103], 12, "Because")
+        chains.add_question(13, 103, "Where are you?")
+        chains.add_answer([104], 13, "Here")
+
+    def test_history(self):
+        chains = ReplyChains({}, maxlen=10)
+        self._chat(chains)
+        self.assertEqual(
+            chains.history(104, max_tokens=100, depth=5),
+            [("What is your name?", "I'm a bot"), ("Why?", "Because"), ("Where are you?", "Here")],
+        )
+        self.assertEqual(
+            chains.history(102, max_tokens=100, depth=5),
+            [("What is your name?", "I'm a bot"), ("Why?", "Because")],
+        )
+        self.assertEqual(chains.history(999, max_tokens=100, depth=5), [])
+
+    def test_depth(self):
+        chains = ReplyChains({}, maxlen=10)
+        self._chat(chains)
+        self.assertEqual(
+            chains.history(104, max_tokens=100, depth=1), [("Where are you?", "Here")]
+        )
+
+    def test_max_tokens(self):
+        chains = ReplyChains({}, maxlen=10)
+        self._chat(chains)
+        history = chains.history(104, max_tokens=6, depth=5)
+        self.assertEqual(history, [("Why?", "Because"), ("Where are you?", "Here")])
+
+    def test_evict(self):
+        data = {}
+        chains = ReplyChains(data, maxlen=4)
+        self._chat(chains)
+        self.assertEqual(len(chains), 4)
+        self.assertEqual(list(data["replies"]), [102, 103, 13, 104])
+        # the chain ends where the messages are forgotten
+        self.assertEqual(
+            chains.history(104, max_tokens=100, depth=5),
+            [("", "Because"), ("Where are you?", "Here")],
+        )
+
+    def test_recently_used(self):
+        chains = ReplyChains({}, maxlen=3)
+        chains.add_question(11, None, "What is your name?")
+        chains.add_answer([101], 11, "I'm a bot")
+        chains.add_question(21, None, "What time is it?")
+        chains.history(101, max_tokens=100, depth=5)
+        chains.add_answer([201], 21, "Noon")
+        self.assertEqual(list(chains.links), [101, 11, 201])
+
+    def test_cycle(self):
+        chains = ReplyChains({}, maxlen=10)
+        chains.add_question(11, 101, "What is your name?")
+        chains.add_answer([101], 11, "I'm a bot")
+        self.assertEqual(
+            chains.history(101, max_tokens=100, depth=5), [("What is your name?", "I'm a bot")]
+        )
+
+    def test_pickle(self):
+        data = {}
+        chains = ReplyChains(data, maxlen=10)
+        chains.add_question(11, None, "What is it? " * 100)
+        chains.add_answer([101], 11, "I don't know")
+        data = pickle.loads(pickle.dumps(data))
+        chains = ReplyChains(data, maxlen=10)
+        self.assertEqual(
+            chains.history(101, max_tokens=1000, depth=5), [("What is it? " * 100, "I don't know")]
+        )
+
+
 class TimestampedValueTest(unittest.TestCase):
     def test_init(self):
         data = {}
-        now = dt.datetime.now()
+        now = int(time.time())
         counter = TimestampedValue(data, name="counter")
-        self.assertEqual(data["counter"]["value"], None)
-        self.assertGreaterEqual(data["counter"]["timestamp"], now)
+        self.assertEqual(data["counter"].value, None)
+        self.assertGreaterEqual(data["counter"].timestamp, now)
         self.assertIsNone(counter.value)
         self.assertGreaterEqual(counter.timestamp, now)
 
     def test_init_initial(self):
         data = {}
-        now = dt.datetime.now()
+        now = int(time.time())
         counter = TimestampedValue(data, name="counter", initial=42)
-        self.assertEqual(data["counter"]["value"], 42)
-        self.assertGreaterEqual(data["counter"]["timestamp"], now)
+        self.assertEqual(data["counter"].value, 42)
+        self.assertGreaterEqual(data["counter"].timestamp, now)
         self.assertEqual(counter.value, 42)
         self.assertGreaterEqual(counter.timestamp, now)
 
+    def test_init_legacy(self):
+        timestamp = dt.datetime(2024, 5, 1, 12, 30)
+        data = {"counter": {"value": 7, "timestamp": timestamp}}
+        counter = TimestampedValue(data, name="counter")
+        self.assertIsInstance(data["counter"], Stamped)
+        self.assertEqual(counter.value, 7)
+        self.assertEqual(counter.timestamp, int(timestamp.timestamp()))
+
+    def test_pickle(self):
+        data = {}
+        TimestampedValue(data, name="counter", initial=42)
+        stored = pickle.loads(pickle.dumps(data))["counter"]
+        self.assertEqual(stored.value, 42)
+        self.assertEqual(stored.timestamp, data["counter"].timestamp)
+
     def test_value(self):
         data = {}
         counter = TimestampedValue(data, name="counter")
 
         counter.value = 11
-        self.assertEqual(data["counter"]["value"], 11)
+        self.assertEqual(data["counter"].value, 11)
         self.assertEqual(counter.value, 11)
 
         counter.value = 21
-        self.assertEqual(data["counter"]["value"], 21)
+        self.assertEqual(data["counter"].value, 21)
         self.assertEqual(counter.value, 21)
 
     def test_timestamp(self):
         data = {}
         counter = TimestampedValue(data, name="counter")
 
-        now = dt.datetime.now()
+        now = int(time.time())
         counter.value = 11
-        self.assertGreaterEqual(data["counter"]["timestamp"], now)
+        self.assertGreaterEqual(data["counter"].timestamp, now)
         self.assertGreaterEqual(counter.timestamp, now)
 
-        now = dt.datetime.now()
+        now = int(time.time())
         counter.value = 21
-        self.assertGreaterEqual(data["counter"]["timestamp"], now)
+        self.assertGreaterEqual(data["counter"].timestamp, now)
         self.assertGreaterEqual(counter.timestamp, now)
 
 
@@ -150,18 +423,18 @@ class ExpiringCounterTest(unittest.TestCase):
 
     def test_is_expired(self):
         self.assertFalse(self.counter.is_expired())
-        self.data._data["timestamp"] = dt.datetime.now() - dt.timedelta(hours=2)
+        self.data._data.timestamp = int(time.time()) - 2 * 3600
         self.assertTrue(self.counter.is_expired())
 
     def test_expires_after(self):
         self.assertGreater(self.counter.expires_after(), dt.timedelta(minutes=59))
         self.assertLessEqual(self.counter.expires_after(), dt.timedelta(minutes=60))
 
-        self.data._data["timestamp"] = self.data._data["timestamp"] - dt.timedelta(minutes=30)
+        self.data._data.timestamp -= 30 * 60
         self.assertGreater(self.counter.expires_after(), dt.timedelta(minutes=29))
         self.assertLessEqual(self.counter.expires_after(), dt.timedelta(minutes=30))
 
-        self.data._data["timestamp"] = dt.datetime.now() - dt.timedelta(hours=2)
+        self.data._data.timestamp = int(time.time()) - 2 * 3600
         self.assertEqual(self.counter.expires_after(), dt.timedelta(0))
 
     def test_increment_expired(self):
@@ -170,7 +443,7 @@ class ExpiringCounterTest(unittest.TestCase):
         self.counter.increment()
         self.assertEqual(self.data.value, 3)
 
-        self.data._data["timestamp"] = dt.datetime.now() - dt.timedelta(hours=2)
+        self.data._data.timestamp = int(time.time()) - 2 * 3600
         self.counter.increment()
         self.assertEqual(self.data.value, 1)
 
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from bot import bot
+from bot import commands
+from bot import workers
+from bot.config import Config, config, use
+from bot.multibot import check
+
+
+class CheckTest(unittest.TestCase):
+    def test_ok(self):
+        configs = [
+            Config("config.first.yml", _src(persistence_path="./data/first.pkl")),
+            Config("config.second.yml", _src(persistence_path="./data/second.pkl")),
+        ]
+        check(configs)
+
+    def test_same_persistence(self):
+        configs = [Config("config.first.yml", _src()), Config("config.second.yml", _src())]
+        with self.assertRaises(ValueError):
+            check(configs)
+
+    def test_same_webhook(self):
+        webhook = {"url": "https://example.org/telegram"}
+        configs = [
+            Config("config.first.yml", _src(persistence_path="a.pkl", webhook=webhook)),
+            Config("config.second.yml", _src(persistence_path="b.pkl", webhook=webhook)),
+        ]
+        with self.assertRaises(ValueError):
+            check(configs)
+        configs[1].webhook.path = "/second"
+        check(configs)
+
+
+class ContextTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "config.second.yml")
+
+    def tearDown(self):
+        workers.shutdown()
+        self.dir.cleanup()
+
+    async def test_save(self):
+        second = Config(self.path, _src(persistence_path="./data/second.pkl"))
+
+        async def serve() -> str:
+            use(second)
+            editor = commands.config.editor
+            editor.set_value("conversation.depth", "7")
+            await workers.run("config", editor.save)
+            return await workers.run("config", lambda: config.filename)
+
+        # the bot runs in its own task, as in multibot.run
+        filename = await asyncio.create_task(serve())
+        self.assertEqual(filename, self.path)
+        with open(self.path) as file:
+            data = yaml.safe_load(file)
+        self.assertEqual(data["conversation"]["depth"], 7)
+        self.assertNotEqual(config.filename, self.path)
+
+
+
+class ShutdownTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_tasks(self):
+        stopped = asyncio.Event()
+
+        async def answer() -> None:
+            # e.g. an answer abandoned on shutdown
+            try:
+                await asyncio.sleep(60)
+            finally:
+                stopped.set()
+
+        task = asyncio.create_task(answer())
+        await asyncio.sleep(0)
+        await bot._cancel_tasks()
+        self.assertTrue(task.cancelled())
+        self.assertTrue(stopped.is_set())
+
+
+def _src(**kwargs) -> dict:
+    src = {
+        "telegram": {"token": "tg-1234"},
+        "openai": {"api_key": "oa-1234"},
+        "conversation": {},
+        "imagine": {},
+    }
+    return {**src, **kwargs}
@@ -0,0 +1,203 @@
+import asyncio
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+from telegram import Chat, Message
+from telegram.constants import ChatType
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from bot import outbox
+from bot import workers
+from tests.mocks import FakeBot
+
+
+class FlakyBot(FakeBot):
+    """Fails to send the given number of messages."""
+
+    def __init__(self, username: str, n_failures: int = 0, error: Exception = None) -> None:
+        super().__init__(username)
+        self.n_failures = n_failures
+        self.error = error or NetworkError("connection reset")
+        self.kwargs = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        if self.n_failures:
+            self.n_failures -= 1
+            raise self.error
+        self.kwargs.append(kwargs)
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "persistence.db")
+        self.bot = FlakyBot("bot")
+        self.delays = outbox.RETRY_DELAYS
+        outbox.RETRY_DELAYS = (0, 0)
+        outbox.init(self.path)
+
+    def tearDown(self) -> None:
+        outbox.close()
+        outbox.RETRY_DELAYS = self.delays
+        workers.shutdown()
+        self.dir.cleanup()
+
+    def _message(self, chat_type: str = ChatType.PRIVATE) -> Message:
+        chat = Chat(id=1, type=chat_type)
+        message = Message(message_id=11, date=dt.datetime.now(), chat=chat, text="Question")
+        message.set_bot(self.bot)
+        return message
+
+    async def _settle(self) -> None:
+        while outbox._state.retries:
+            await asyncio.gather(*outbox._state.retries, return_exceptions=True)
+
+    async def test_send(self):
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        self.assertEqual(self.bot.text, "Hello")
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_replace(self):
+        await outbox.send(self._message(), outbox.TEXT, "Hello", replace=[101, 102])
+        self.assertEqual(self.bot.texts, [])
+        self.assertEqual(self.bot.edits, {101: "Hello"})
+        self.assertEqual(self.bot.deleted, [102])
+
+    async def test_replace_photo(self):
+        await outbox.send(self._message(), outbox.PHOTO, "image.png", replace=[101])
+        self.assertEqual(self.bot.deleted, [101])
+
+    async def test_reply_in_group(self):
+        await outbox.send(self._message(ChatType.GROUP), outbox.TEXT, "Hello")
+        self.assertEqual(self.bot.kwargs[0]["reply_to_message_id"], 11)
+
+    async def test_photo(self):
+        await outbox.send(self._message(), outbox.PHOTO, "image.png", caption="A cat")
+        self.assertEqual(self.bot.text, "A cat: image.png")
+
+    async def test_plain_text_fallback(self):
+        self.bot.n_failures = 1
+        self.bot.error = BadRequest("Can't parse entities: unclosed tag")
+        await outbox.send(self._message(), outbox.TEXT, "Hello **world**")
+        self.assertEqual(self.bot.text, "Hello world")
+        self.assertNotIn("parse_mode", self.bot.kwargs[0])
+
+    async def test_retry(self):
+        self.bot.n_failures = 1
+        sent = await outbox.send(self._message(), outbox.TEXT, "Hello")
+        self.assertEqual(sent, [])
+        self.assertEqual(self.bot.texts, [])
+        self.assertEqual(len(outbox._state.outbox.pending()), 1)
+
+        await self._settle()
+        self.assertEqual(self.bot.texts, ["Hello"])
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_retries_exhausted(self):
+        self.bot.n_failures = 10
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        await self._settle()
+        self.assertEqual(self.bot.texts, [])
+        # kept for the next start
+        entries = outbox._state.outbox.pending()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].attempts, len(outbox.RETRY_DELAYS))
+
+    async def test_unexpected_error(self):
+        self.bot.n_failures = 1
+        self.bot.error = KeyError("message_id")
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        self.assertEqual(len(outbox._state.outbox.pending()), 1)
+        await self._settle()
+        self.assertEqual(self.bot.texts, ["Hello"])
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_retry_temporary(self):
+        for error in (TimedOut(), RetryAfter(0)):
+            self.bot.n_failures = 1
+            self.bot.error = error
+            await outbox.send(self._message(), outbox.TEXT, "Hello")
+            await self._settle()
+        self.assertEqual(self.bot.texts, ["Hello", "Hello"])
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_forbidden(self):
+        self.bot.n_failures = 10
+        self.bot.error = Forbidden("Forbidden: bot was blocked by the user")
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        # dropped right away, without retries
+        self.assertEqual(outbox._state.retries, set())
+        self.assertEqual(outbox._state.outbox.pending(), [])
+        self.assertEqual(self.bot.n_failures, 9)
+
+    async def test_bad_request(self):
+        self.bot.n_failures = 10
+        self.bot.error = BadRequest("Chat not found")
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        self.assertEqual(outbox._state.retries, set())
+        self.assertEqual(outbox._state.outbox.pending(), [])
+        self.assertEqual(self.bot.n_failures, 9)
+
+    async def test_missing_reply(self):
+        self.bot.n_failures = 1
+        self.bot.error = BadRequest("Message to be replied not found")
+        sent = await outbox.send(self._message(ChatType.GROUP), outbox.TEXT, "Hello")
+        self.assertEqual(sent, [1001])
+        self.assertEqual(self.bot.texts, ["Hello"])
+        self.assertIsNone(self.bot.kwargs[0]["reply_to_message_id"])
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_redeliver(self):
+        self.bot.n_failures = 1
+        await outbox.send(self._message(), outbox.TEXT, "Hello")
+        # restart before the retry
+        outbox.close()
+        outbox.init(self.path)
+        entries = outbox._state.outbox.pending()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].attempts, 1)
+
+        count = await outbox.redeliver(self.bot)
+        self.assertEqual(count, 1)
+        await self._settle()
+        self.assertEqual(self.bot.texts, ["Hello"])
+        self.assertEqual(outbox._state.outbox.pending(), [])
+
+    async def test_resume(self):
+        # fails on the second part of a long answer
+        paragraph = "." * 3000
+        text = f"{paragraph}\n\n{paragraph}"
+        original = self.bot.send_message
+
+        async def send_message(chat_id: int, text: str, **kwargs):
+            if self.bot.texts:
+                self.bot.send_message = original
+                raise NetworkError("connection reset")
+            return await original(chat_id, text, **kwargs)
+
+        self.bot.send_message = send_message
+        await outbox.send(self._message(), outbox.TEXT, text)
+        self.assertEqual(self.bot.texts, [paragraph])
+        self.assertEqual(outbox._state.outbox.pending()[0].message_ids, [1001])
+
+        await self._settle()
+        self.assertEqual(self.bot.texts, [paragraph, paragraph])
+
+
+class DirectTest(unittest.IsolatedAsyncioTestCase):
+    async def test_error(self):
+        bot = FlakyBot("bot", n_failures=1)
+        chat = Chat(id=1, type=ChatType.PRIVATE)
+        message = Message(message_id=11, date=dt.datetime.now(), chat=chat, text="Question")
+        message.set_bot(bot)
+        with self.assertRaises(NetworkError):
+            await outbox.send(message, outbox.TEXT, "Hello")
+
+
+class PlainTextTest(unittest.TestCase):
+    def test_to_plain_text(self):
+        html = "<b>bold</b> &lt;tag&gt; <pre><code>x &amp; y</code></pre>"
+        self.assertEqual(outbox.to_plain_text(html), "bold <tag> x & y")
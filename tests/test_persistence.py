@@ -0,0 +1,224 @@
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from collections import deque
+
+from bot import persistence
+from bot import workers
+from bot.models import UserMessage
+
+
+class SqlitePersistenceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "persistence.db")
+
+    def tearDown(self) -> None:
+        workers.shutdown()
+        self.dir.cleanup()
+
+    async def _open(self, path: str = None) -> persistence.SqlitePersistence:
+        store = persistence.SqlitePersistence(filepath=path or self.path)
+        self.assertEqual(await store.get_user_data(), {})
+        self.assertEqual(await store.get_chat_data(), {})
+        return store
+
+    async def test_user_data(self):
+        store = await self._open()
+        messages = deque([UserMessage("Hello", "Hi")], maxlen=3)
+        await store.update_user_data(1, {"messages": messages})
+        await store.update_user_data(2, {"messages": deque()})
+        await store.flush()
+
+        store = await self._open()
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data["messages"], messages)
+        self.assertEqual(user_data["messages"].maxlen, 3)
+        await store.flush()
+
+    async def test_chat_data(self):
+        store = await self._open()
+        await store.update_chat_data(-100, {"prompt": "Be brief"})
+        await store.flush()
+
+        store = await self._open()
+        chat_data = {}
+        await store.refresh_chat_data(-100, chat_data)
+        self.assertEqual(chat_data, {"prompt": "Be brief"})
+        await store.flush()
+
+    async def test_refresh_once(self):
+        store = await self._open()
+        await store.update_user_data(1, {"model": "gpt-4"})
+        await store.flush()
+
+        store = await self._open()
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        user_data["model"] = "gpt-3.5-turbo"
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data["model"], "gpt-3.5-turbo")
+        await store.flush()
+
+    async def test_unknown(self):
+        store = await self._open()
+        user_data = {}
+        await store.refresh_user_data(42, user_data)
+        self.assertEqual(user_data, {})
+        await store.flush()
+
+    async def test_batch_write(self):
+        store = await self._open()
+        await store.update_user_data(1, {"value": 1})
+        await store.update_user_data(2, {"value": 2})
+        await store._write_task
+        self.assertEqual(store._pending[persistence.USER_TABLE], {})
+        rows = store._reader.execute("select id from user_data order by id").fetchall()
+        self.assertEqual(rows, [(1,), (2,)])
+        await store.flush()
+
+    async def test_drop(self):
+        store = await self._open()
+        await store.update_user_data(1, {"value": 1})
+        await store.drop_user_data(1)
+        await store.update_chat_data(2, {"value": 2})
+        await store.flush()
+
+        store = await self._open()
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {})
+        await store.drop_chat_data(2)
+        await store.flush()
+
+        store = await self._open()
+        chat_data = {}
+        await store.refresh_chat_data(2, chat_data)
+        self.assertEqual(chat_data, {})
+        await store.flush()
+
+    async def test_migrate(self):
+        pickle_path = os.path.join(self.dir.name, "persistence.pkl")
+        data = {
+            "user_data": {1: {"messages": deque([UserMessage("Hello", "Hi")])}},
+            "chat_data": {-100: {"prompt": "Be brief"}},
+            "bot_data": {},
+        }
+        with open(pickle_path, "wb") as file:
+            pickle.dump(data, file)
+
+        store = await self._open(pickle_path)
+        self.assertEqual(store.filepath, self.path)
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(list(user_data["messages"]), [UserMessage("Hello", "Hi")])
+        await store.update_user_data(1, {"messages": deque()})
+        await store.flush()
+
+        # the data is imported only once
+        store = await self._open(pickle_path)
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data["messages"], deque())
+        chat_data = {}
+        await store.refresh_chat_data(-100, chat_data)
+        self.assertEqual(chat_data, {"prompt": "Be brief"})
+        await store.flush()
+
+    async def test_unload(self):
+        store = await self._open()
+        await store.update_user_data(1, {"model": "gpt-4"})
+        await store._write_task
+        self.assertFalse(store.busy)
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        store.unload(persistence.USER_TABLE, 1)
+        # loaded again on next access
+        user_data = {}
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {"model": "gpt-4"})
+        await store.flush()
+
+    async def test_expire(self):
+        store = await self._open()
+        await store.update_user_data(1, {"model": "gpt-4"})
+        await store.update_user_data(2, {"model": "gpt-4o"})
+        await store.update_chat_data(-100, {"prompt": "Be brief"})
+        await store._write_task
+        await store.refresh_user_data(2, {})
+
+        counts = await store.expire(int(time.time()) + 1)
+        # the loaded entry stays
+        self.assertEqual(counts, {persistence.USER_TABLE: 1, persistence.CHAT_TABLE: 1})
+        await store.flush()
+
+        store = await self._open()
+        user_data, chat_data = {}, {}
+        await store.refresh_user_data(1, user_data)
+        await store.refresh_chat_data(-100, chat_data)
+        self.assertEqual(user_data, {})
+        self.assertEqual(chat_data, {})
+        user_data = {}
+        await store.refresh_user_data(2, user_data)
+        self.assertEqual(user_data, {"model": "gpt-4o"})
+        await store.flush()
+
+
+class ResolvePathsTest(unittest.TestCase):
+    def test_pickle(self):
+        paths = persistence._resolve_paths("./data/persistence.pkl")
+        self.assertEqual(paths, ("./data/persistence.db", "./data/persistence.pkl"))
+
+    def test_database(self):
+        paths = persistence._resolve_paths("./data/persistence.db")
+        self.assertEqual(paths, ("./data/persistence.db", "./data/persistence.pkl"))
+
+
+class SharedPersistenceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "persistence.db")
+
+    def tearDown(self) -> None:
+        workers.shutdown()
+        self.dir.cleanup()
+
+    async def _open(self) -> persistence.SqlitePersistence:
+        store = persistence.SqlitePersistence(filepath=self.path, shared=True)
+        await store.get_user_data()
+        return store
+
+    async def test_reload_changed(self):
+        first = await self._open()
+        second = await self._open()
+        user_data = {}
+        await first.refresh_user_data(1, user_data)
+
+        await second.update_user_data(1, {"model": "gpt-4"})
+        await second._write_task
+        await first.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {"model": "gpt-4"})
+
+        await second.update_user_data(1, {"model": "gpt-4o"})
+        await second._write_task
+        await first.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {"model": "gpt-4o"})
+        await first.flush()
+        await second.flush()
+
+    async def test_keep_own(self):
+        store = await self._open()
+        user_data = {"model": "gpt-4"}
+        await store.update_user_data(1, dict(user_data))
+        await store._write_task
+        user_data["prompt"] = "Be brief"
+        await store.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {"model": "gpt-4", "prompt": "Be brief"})
+        await store.flush()
+
+    async def test_prepare(self):
+        persistence.prepare(self.path)
+        self.assertTrue(os.path.exists(self.path))
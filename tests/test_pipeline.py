@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+
+from bot import metrics
+from bot import pipeline
+from bot.config import Pipeline as PipelineConfig, config
+
+
+class Cached(pipeline.Stage):
+    """Answers from a cache."""
+
+    name = "cache"
+
+    async def process(self, request: pipeline.Request) -> None:
+        request.answer = f"cached: {request.question}"
+
+
+class Recorder(pipeline.Stage):
+    answers = False
+
+    def __init__(self, name: str, delay: float = 0) -> None:
+        self.name = name
+        self.delay = delay
+        self.calls = []
+        self.n_running = 0
+        self.max_running = 0
+
+    async def process(self, request: pipeline.Request) -> None:
+        self.n_running += 1
+        self.max_running = max(self.max_running, self.n_running)
+        try:
+            await asyncio.sleep(self.delay)
+            self.calls.append(request.question)
+        finally:
+            self.n_running -= 1
+
+
+def make_request(question: str) -> pipeline.Request:
+    return pipeline.Request(
+        update=None, message=None, context=None, question=question, asker=None, model="gpt-4"
+    )
+
+
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+    async def test_run(self):
+        first, second = Recorder("first"), Recorder("second")
+        line = pipeline.Pipeline([first, Cached(), second])
+        request = make_request("What is your name?")
+        await line.run(request)
+        self.assertEqual(request.answer, "cached: What is your name?")
+        self.assertEqual(request.original, "What is your name?")
+        self.assertEqual(first.calls, ["What is your name?"])
+        self.assertEqual(second.calls, ["What is your name?"])
+        self.assertGreater(metrics.summary("pipeline.first.run_ms").count, 0)
+
+    async def test_skip_answered(self):
+        class Answer(pipeline.Stage):
+            name = "answer"
+
+            async def process(self, request):
+                raise AssertionError("should be skipped")
+
+        line = pipeline.Pipeline([Answer()])
+        request = make_request("What is your name?")
+        request.answer = "I'm a bot"
+        await line.run(request)
+        self.assertEqual(request.answer, "I'm a bot")
+
+    async def test_limit(self):
+        stage = Recorder("slow", delay=0.01)
+        stage.limit = 2
+        line = pipeline.Pipeline([stage])
+        await asyncio.gather(*(line.run(make_request(str(idx))) for idx in range(5)))
+        self.assertEqual(len(stage.calls), 5)
+        self.assertEqual(stage.max_running, 2)
+
+    async def test_timeout(self):
+        stage = Recorder("slow", delay=1)
+        stage.timeout = 0.01
+        line = pipeline.Pipeline([stage])
+        with self.assertRaises(asyncio.TimeoutError):
+            await line.run(make_request("What is your name?"))
+        self.assertEqual(line.n_timeouts, 1)
+        self.assertEqual(stage.n_running, 0)
+
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = config.pipeline
+
+    def tearDown(self):
+        config.pipeline = self.settings
+
+    def test_default(self):
+        config.pipeline = PipelineConfig()
+        line = pipeline.build()
+        names = [stage.name for stage in line.stages]
+        self.assertEqual(names, ["prepare", "fetch", "ask", "remember", "reply"])
+
+    def test_config(self):
+        config.pipeline = PipelineConfig(
+            stages=[{"use": "tests.test_pipeline:Cached", "before": "ask"}],
+            limits={"fetch": 4},
+            timeouts={"cache": 1.5},
+        )
+        line = pipeline.build()
+        names = [stage.name for stage in line.stages]
+        self.assertEqual(names, ["prepare", "fetch", "cache", "ask", "remember", "reply"])
+        self.assertEqual(line.stages[1].limit, 4)
+        self.assertEqual(line.stages[2].timeout, 1.5)
+
+    def test_dotted_path(self):
+        stage = pipeline.load_stage("tests.test_pipeline.Cached")
+        self.assertIsInstance(stage, Cached)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            pipeline.load_stage("tests.test_pipeline:Missing")
+        with self.assertRaises(ValueError):
+            pipeline.load_stage("tests.test_pipeline:make_request")
+        config.pipeline = PipelineConfig(
+            stages=[{"use": "tests.test_pipeline:Cached", "before": "missing"}]
+        )
+        with self.assertRaises(ValueError):
+            pipeline.build()
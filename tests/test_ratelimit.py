@@ -0,0 +1,168 @@
+import asyncio
+import time
+import unittest
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from bot import ratelimit
+from bot.config import config
+from bot.ratelimit import RateLimiter, TokenBucket
+
+
+class FakeApi:
+    def __init__(self, errors: list = None) -> None:
+        self.errors = errors or []
+        self.calls = []
+
+    def request(self, name: str):
+        async def callback():
+            self.calls.append(name)
+            if self.errors:
+                raise self.errors.pop(0)
+            return True
+
+        return callback
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertTrue(bucket.try_take())
+        self.assertTrue(bucket.try_take())
+        self.assertFalse(bucket.try_take())
+
+    async def test_priority(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        bucket.try_take()
+        order = []
+
+        async def take(priority: int, name: str) -> None:
+            await bucket.take(priority)
+            order.append(name)
+
+        await asyncio.gather(take(2, "action"), take(1, "edit"), take(0, "answer"))
+        self.assertEqual(order, ["answer", "edit", "action"])
+
+    async def test_pause(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        bucket.pause(0.05)
+        start = time.monotonic()
+        await bucket.take(0)
+        self.assertTrue(time.monotonic() - start >= 0.04)
+
+    async def test_cancel(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        bucket.try_take()
+        task = asyncio.create_task(bucket.take(0))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(bucket._waiters, [])
+
+
+    async def test_resize(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+        bucket.try_take()
+        task = asyncio.create_task(bucket.take(0))
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+        # the waiter gets the token at the new rate
+        bucket.resize(rate=100, capacity=1)
+        await asyncio.wait_for(task, timeout=0.1)
+
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.limits = config.ratelimit
+        config.ratelimit = type(self.limits)(chat_rate=20, chat_burst=1, max_retries=2)
+        self.delay = ratelimit.RETRY_DELAY
+        ratelimit.RETRY_DELAY = 0.01
+        self.limiter = RateLimiter()
+
+    def tearDown(self) -> None:
+        config.ratelimit = self.limits
+        ratelimit.RETRY_DELAY = self.delay
+
+    async def _send(self, api: FakeApi, endpoint: str, chat_id: int = 1):
+        return await self.limiter.process_request(
+            callback=api.request(endpoint),
+            args=(),
+            kwargs={},
+            endpoint=endpoint,
+            data={"chat_id": chat_id},
+            rate_limit_args=None,
+        )
+
+    async def test_no_chat(self):
+        api = FakeApi()
+        for _ in range(5):
+            await self.limiter.process_request(api.request("getMe"), (), {}, "getMe", {}, None)
+        self.assertEqual(len(api.calls), 5)
+        self.assertEqual(self.limiter._chats, {})
+
+    async def test_chat_rate(self):
+        api = FakeApi()
+        start = time.monotonic()
+        await asyncio.gather(*(self._send(api, "sendMessage") for _ in range(3)))
+        self.assertTrue(time.monotonic() - start >= 0.09)
+        self.assertEqual(len(api.calls), 3)
+
+    async def test_chats_independent(self):
+        api = FakeApi()
+        start = time.monotonic()
+        await asyncio.gather(*(self._send(api, "sendMessage", chat_id) for chat_id in range(1, 4)))
+        self.assertTrue(time.monotonic() - start < 0.05)
+
+    async def test_change_limits(self):
+        api = FakeApi()
+        await self._send(api, "sendMessage")
+        config.ratelimit = type(self.limits)(chat_rate=1000, chat_burst=5, max_retries=2)
+        start = time.monotonic()
+        await asyncio.gather(*(self._send(api, "sendMessage") for _ in range(5)))
+        self.assertTrue(time.monotonic() - start < 0.04)
+        self.assertEqual(self.limiter._chats[1].capacity, 5)
+
+    async def test_skip_action(self):
+        api = FakeApi()
+        await self._send(api, "sendMessage")
+        result = await self._send(api, "sendChatAction")
+        self.assertTrue(result)
+        self.assertEqual(api.calls, ["sendMessage"])
+        self.assertEqual(self.limiter.n_skipped, 1)
+
+    async def test_retry_after(self):
+        api = FakeApi(errors=[RetryAfter(0)])
+        result = await self._send(api, "sendMessage")
+        self.assertTrue(result)
+        self.assertEqual(api.calls, ["sendMessage", "sendMessage"])
+
+    async def test_network_error(self):
+        api = FakeApi(errors=[NetworkError("connection reset")])
+        result = await self._send(api, "sendMessage")
+        self.assertTrue(result)
+        self.assertEqual(len(api.calls), 2)
+
+    async def test_timed_out_send(self):
+        api = FakeApi(errors=[TimedOut()])
+        with self.assertRaises(TimedOut):
+            await self._send(api, "sendMessage")
+        self.assertEqual(api.calls, ["sendMessage"])
+
+    async def test_timed_out_edit(self):
+        api = FakeApi(errors=[TimedOut()])
+        result = await self._send(api, "editMessageText")
+        self.assertTrue(result)
+        self.assertEqual(api.calls, ["editMessageText", "editMessageText"])
+
+    async def test_max_retries(self):
+        api = FakeApi(errors=[NetworkError("down")] * 3)
+        with self.assertRaises(NetworkError):
+            await self._send(api, "sendMessage")
+        self.assertEqual(len(api.calls), 3)
+
+    async def test_bad_request(self):
+        api = FakeApi(errors=[BadRequest("can't parse entities")])
+        with self.assertRaises(BadRequest):
+            await self._send(api, "sendMessage")
+        self.assertEqual(len(api.calls), 1)
@@ -0,0 +1,177 @@
+from collections import deque
+import os
+import tempfile
+import time
+import unittest
+
+from telegram import Chat, Message, Update, User
+
+from bot import persistence
+from bot import retention
+from bot import workers
+from bot.config import Retention, config
+from bot.models import Stamped, UserMessage
+
+DAY = 86400
+
+
+class FakeApplication:
+    """Keeps the data like the real application does, with a real persistence."""
+
+    def __init__(self, store: persistence.SqlitePersistence) -> None:
+        self.persistence = store
+        self.user_data = {}
+        self.chat_data = {}
+        self.dropped = set()
+        self.marked = set()
+
+    def drop_user_data(self, user_id: int) -> None:
+        self.user_data.pop(user_id, None)
+        self.dropped.add(user_id)
+
+    def drop_chat_data(self, chat_id: int) -> None:
+        self.chat_data.pop(chat_id, None)
+        self.dropped.add(chat_id)
+
+    def unload_user_data(self, user_id: int) -> None:
+        self.user_data.pop(user_id, None)
+        self.persistence.unload(persistence.USER_TABLE, user_id)
+
+    def unload_chat_data(self, chat_id: int) -> None:
+        self.chat_data.pop(chat_id, None)
+        self.persistence.unload(persistence.CHAT_TABLE, chat_id)
+
+    def mark_data_for_update_persistence(self, chat_ids=None, user_ids=None) -> None:
+        self.marked.update(chat_ids or ())
+        self.marked.update(user_ids or ())
+
+    async def update_persistence(self) -> None:
+        for user_id, data in self.user_data.items():
+            await self.persistence.update_user_data(user_id, data)
+        for chat_id, data in self.chat_data.items():
+            await self.persistence.update_chat_data(chat_id, data)
+
+
+class SweeperTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.settings = config.retention
+        config.retention = Retention(interval=3600, unload_after=24, ttl=30)
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = persistence.SqlitePersistence(os.path.join(self.dir.name, "persistence.db"))
+        self.store._open()
+        self.application = FakeApplication(self.store)
+        self.sweeper = retention.Sweeper(self.application)
+        self.now = int(time.time())
+
+    async def asyncTearDown(self):
+        await self.store.flush()
+
+    def tearDown(self):
+        config.retention = self.settings
+        workers.shutdown()
+        self.dir.cleanup()
+
+    async def test_active(self):
+        messages = deque([UserMessage("Hello", "Hi")], maxlen=3)
+        self.application.user_data[1] = {"messages": messages, "last_active": self.now}
+        self.application.chat_data[1] = {"prompt": "Be brief", "last_active": self.now}
+        result = await self.sweeper.sweep()
+        self.assertEqual(result, retention.Result())
+        self.assertIn(1, self.application.user_data)
+        self.assertIn(1, self.application.chat_data)
+
+    async def test_unload(self):
+        messages = deque([UserMessage("Hello", "Hi")], maxlen=3)
+        last_active = self.now - 2 * DAY
+        self.application.user_data[1] = {"messages": messages, "last_active": last_active}
+        self.application.chat_data[1] = {"prompt": "Be brief", "last_active": last_active}
+        result = await self.sweeper.sweep()
+        self.assertEqual(result.unloaded, 2)
+        self.assertEqual(self.application.user_data, {})
+        self.assertEqual(self.application.chat_data, {})
+
+        # the data is still in the database
+        user_data = {}
+        await self.store.refresh_user_data(1, user_data)
+        self.assertEqual(list(user_data["messages"]), [UserMessage("Hello", "Hi")])
+        chat_data = {}
+        await self.store.refresh_chat_data(1, chat_data)
+        self.assertEqual(chat_data["prompt"], "Be brief")
+
+    async def test_drop(self):
+        messages = deque([UserMessage("Hello", "Hi")], maxlen=3)
+        last_active = self.now - 31 * DAY
+        self.application.user_data[1] = {"messages": messages, "last_active": last_active}
+        self.application.chat_data[-100] = {"prompt": "Be brief", "last_active": last_active}
+        result = await self.sweeper.sweep()
+        self.assertEqual(result.dropped, 2)
+        self.assertEqual(self.application.dropped, {1, -100})
+
+    async def test_expire(self):
+        await self.store.update_user_data(1, {"model": "gpt-4"})
+        await self.store._write_task
+        with self.store._writer:
+            self.store._writer.execute("update user_data set updated_at = ?", (self.now - 31 * DAY,))
+        result = await self.sweeper.sweep()
+        self.assertEqual(result.expired, 1)
+
+    async def test_compact(self):
+        period = config.conversation.message_limit.period
+        config.conversation.message_limit.period = "hour"
+        self.addCleanup(setattr, config.conversation.message_limit, "period", period)
+        self.application.user_data[1] = {
+            "messages": deque([], maxlen=3),
+            "message_counter": Stamped(5, self.now - 2 * 3600),
+            "model": "gpt-4",
+            "last_active": self.now - 3600,
+        }
+        result = await self.sweeper.sweep()
+        self.assertEqual(result.compacted, 1)
+        self.assertEqual(
+            self.application.user_data[1], {"model": "gpt-4", "last_active": self.now - 3600}
+        )
+        self.assertIn(1, self.application.marked)
+
+    async def test_compact_active(self):
+        # the history may be filled by an answer in progress
+        messages = deque([], maxlen=3)
+        self.application.user_data[1] = {"messages": messages, "last_active": self.now}
+        result = await self.sweeper.sweep()
+        self.assertEqual(result, retention.Result())
+        self.assertIs(self.application.user_data[1]["messages"], messages)
+        self.assertNotIn(1, self.application.marked)
+
+    async def test_empty(self):
+        self.application.user_data[1] = {
+            "messages": deque([], maxlen=3),
+            "last_active": self.now - 3600,
+        }
+        result = await self.sweeper.sweep()
+        self.assertEqual(result.dropped, 1)
+        self.assertNotIn(1, self.application.user_data)
+
+    async def test_legacy(self):
+        self.application.user_data[1] = {"model": "gpt-4"}
+        await self.sweeper.sweep()
+        self.assertGreaterEqual(self.application.user_data[1]["last_active"], self.now)
+        self.assertIn(1, self.application.marked)
+
+    async def test_keep_forever(self):
+        config.retention = Retention(unload_after=0, ttl=0)
+        self.application.user_data[1] = {"model": "gpt-4", "last_active": self.now - 365 * DAY}
+        result = await self.sweeper.sweep()
+        self.assertEqual(result, retention.Result())
+        self.assertIn(1, self.application.user_data)
+
+
+class TouchTest(unittest.TestCase):
+    def test_touch(self):
+        application = FakeApplication(store=None)
+        application.user_data[1] = {}
+        user = User(id=1, first_name="Alice", is_bot=False)
+        chat = Chat(id=-100, type=Chat.GROUP)
+        message = Message(message_id=11, date=None, chat=chat, from_user=user, text="Hi")
+        retention.touch(application, Update(update_id=11, message=message))
+        self.assertGreater(application.user_data[1]["last_active"], 0)
+        # the missing data is not created
+        self.assertNotIn(-100, application.chat_data)
@@ -0,0 +1,64 @@
+import datetime as dt
+import queue
+import unittest
+
+from telegram import Chat, InlineQuery, Message, Update, User
+from telegram.constants import ChatType
+
+from bot import sharding
+
+
+def _create_update(update_id: int, chat_id: int, user_id: int = 1) -> Update:
+    message = Message(
+        message_id=update_id,
+        date=dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc),
+        chat=Chat(id=chat_id, type=ChatType.PRIVATE if chat_id > 0 else ChatType.GROUP),
+        from_user=User(id=user_id, first_name="Alice", is_bot=False, username="alice"),
+        text="Hello",
+    )
+    return Update(update_id=update_id, message=message)
+
+
+class ShardOfTest(unittest.TestCase):
+    def test_private(self):
+        self.assertEqual(sharding.shard_of(_create_update(1, chat_id=7, user_id=7), 4), 3)
+        self.assertEqual(sharding.shard_of(_create_update(2, chat_id=8, user_id=8), 4), 0)
+
+    def test_group(self):
+        shard = sharding.shard_of(_create_update(1, chat_id=-1001), 4)
+        self.assertTrue(0 <= shard < 4)
+
+    def test_stable(self):
+        # the chat's data is changed by a single worker, whoever writes
+        updates = [
+            _create_update(idx, chat_id=-1001, user_id=user_id)
+            for idx, user_id in enumerate((41, 42, 43))
+        ]
+        shards = {sharding.shard_of(update, 3) for update in updates}
+        self.assertEqual(shards, {-1001 % 3})
+
+    def test_no_user(self):
+        update = Update(update_id=1, channel_post=_create_update(1, chat_id=-1006).message)
+        self.assertEqual(sharding.shard_of(update, 4), 2)
+
+    def test_no_chat(self):
+        user = User(id=6, first_name="Alice", is_bot=False)
+        update = Update(update_id=1, inline_query=InlineQuery("1", user, "Hello", ""))
+        self.assertEqual(sharding.shard_of(update, 4), 2)
+
+    def test_empty(self):
+        self.assertEqual(sharding.shard_of(Update(update_id=1), 4), 0)
+
+
+class RouterTest(unittest.TestCase):
+    def test_route(self):
+        queues = [queue.Queue() for _ in range(2)]
+        router = sharding.Router(queues)
+        update = _create_update(1, chat_id=5, user_id=5)
+        self.assertEqual(router.route(update), 1)
+        self.assertTrue(queues[0].empty())
+        data = queues[1].get_nowait()
+        restored = Update.de_json(data, bot=None)
+        self.assertEqual(restored.update_id, 1)
+        self.assertEqual(restored.effective_chat.id, 5)
+        self.assertEqual(restored.effective_message.text, "Hello")
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+def imported_by(module: str) -> set[str]:
+    """Returns the modules loaded by importing the module in a fresh interpreter."""
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    env = dict(os.environ, CONFIG="missing.yml")
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True
+    )
+    return set(result.stdout.split())
+
+
+class StartupTest(unittest.TestCase):
+    def test_cli(self):
+        modules = imported_by("bot.cli")
+        self.assertNotIn("telegram", modules)
+        self.assertNotIn("openai", modules)
+
+    def test_bot(self):
+        # yaml is needed only to read or write the config file
+        modules = imported_by("bot.bot")
+        self.assertNotIn("yaml", modules)
+
+    def test_config(self):
+        # the config file is not read on import
+        modules = imported_by("bot.config")
+        self.assertIn("bot.config", modules)
+
+    def test_ai(self):
+        modules = imported_by("bot.ai")
+        self.assertNotIn("bot.ai.assistant", modules)
+        self.assertNotIn("openai", modules)
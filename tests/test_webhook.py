@@ -0,0 +1,85 @@
+import asyncio
+import json
+import unittest
+from typing import Union
+
+import httpx
+
+from bot import webhook
+
+UPDATE = {
+    "update_id": 1,
+    "message": {"message_id": 11, "date": 0, "chat": {"id": 1, "type": "private"}},
+}
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.updates = []
+        self.server = webhook.Server(
+            path="/telegram", secret_token="secret", handle=self.updates.append, max_connections=4
+        )
+        await self.server.start("127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.port}"
+        self.client = httpx.AsyncClient(base_url=self.url)
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+        await self.server.stop()
+
+    async def _post(self, path: str = "/telegram", secret: Union[str, bytes] = "secret", body: bytes = None):
+        headers = {webhook.SECRET_HEADER: secret}
+        content = body if body is not None else json.dumps(UPDATE).encode()
+        return await self.client.post(path, content=content, headers=headers)
+
+    async def test_update(self):
+        response = await self._post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.updates, [UPDATE])
+        self.assertEqual(self.server.n_received, 1)
+
+    async def test_keep_alive(self):
+        for _ in range(3):
+            response = await self._post()
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.updates), 3)
+
+    async def test_concurrent(self):
+        clients = [httpx.AsyncClient(base_url=self.url) for _ in range(4)]
+        try:
+            headers = {webhook.SECRET_HEADER: "secret"}
+            responses = await asyncio.gather(
+                *(client.post("/telegram", json=UPDATE, headers=headers) for client in clients)
+            )
+        finally:
+            for client in clients:
+                await client.aclose()
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertEqual(len(self.updates), 4)
+
+    async def test_wrong_secret(self):
+        response = await self._post(secret="guess")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.updates, [])
+
+    async def test_non_ascii_secret(self):
+        response = await self._post(secret="sécret".encode())
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.updates, [])
+
+    async def test_wrong_path(self):
+        response = await self._post(path="/other")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_wrong_method(self):
+        response = await self.client.get("/telegram")
+        self.assertEqual(response.status_code, 405)
+
+    async def test_bad_json(self):
+        response = await self._post(body=b"{not json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.updates, [])
+
+    async def test_too_large(self):
+        response = await self._post(body=b" " * (webhook.MAX_BODY_SIZE + 1))
+        self.assertEqual(response.status_code, 413)
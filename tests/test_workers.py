@@ -0,0 +1,40 @@
+import threading
+import unittest
+
+from bot import metrics
+from bot import workers
+from bot.config import config
+
+
+def _thread_name(_: str) -> str:
+    return threading.current_thread().name
+
+
+class RunTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.threshold = config.workers.threshold
+        config.workers.threshold = 10
+
+    def tearDown(self) -> None:
+        config.workers.threshold = self.threshold
+        workers.shutdown()
+
+    async def test_inline(self):
+        name = await workers.run("test_inline", _thread_name, "small", size=5)
+        self.assertEqual(name, threading.current_thread().name)
+        self.assertEqual(metrics.summary("workers.test_inline.run_ms").count, 1)
+        self.assertEqual(metrics.summary("workers.test_inline.wait_ms").mean, 0)
+
+    async def test_pool(self):
+        name = await workers.run("test_pool", _thread_name, "large", size=100)
+        self.assertTrue(name.startswith("worker"))
+        self.assertEqual(metrics.summary("workers.test_pool.run_ms").count, 1)
+        self.assertEqual(metrics.summary("workers.test_pool.wait_ms").count, 1)
+
+    async def test_unknown_size(self):
+        name = await workers.run("test_unknown_size", _thread_name, "any")
+        self.assertTrue(name.startswith("worker"))
+
+    async def test_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            await workers.run("test_error", lambda: 1 / 0)